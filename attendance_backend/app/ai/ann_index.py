@@ -0,0 +1,155 @@
+"""Approximate nearest-neighbour index for school-wide face search"""
+import json
+import os
+from typing import Dict, List, Optional
+import numpy as np
+from .matcher import normalize_embeddings
+
+# Rows scored against the centroids at a time, bounds the (rows x nlist) score matrix
+ASSIGN_CHUNK_SIZE = 8192
+
+# k-means is trained on at most this many samples per cluster
+TRAIN_SAMPLES_PER_LIST = 256
+
+class IVFIndex:
+    """Inverted-file index with a spherical k-means coarse quantizer.
+    
+    Every embedding is filed under its nearest centroid. A query scores the
+    centroids, gathers the student IDs of the `nprobe` closest lists and
+    returns them as candidates; the caller re-ranks those candidates exactly
+    against the full-precision gallery rows. Only IDs are stored here, the
+    vectors stay in the gallery.
+    """
+    
+    def __init__(self, centroids: np.ndarray):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.trained_size = 0
+        self._lists: List[List[int]] = [[] for _ in range(len(centroids))]
+        self._list_of: Dict[int, int] = {}
+    
+    def __len__(self) -> int:
+        return len(self._list_of)
+    
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+    
+    @classmethod
+    def train(cls, matrix: np.ndarray, student_ids: np.ndarray, nlist: int, iterations: int = 10, seed: int = 0) -> "IVFIndex":
+        """Cluster normalized embeddings and file every row under its centroid"""
+        rng = np.random.default_rng(seed)
+        nlist = max(1, min(nlist, len(matrix)))
+        
+        sample = matrix
+        max_samples = nlist * TRAIN_SAMPLES_PER_LIST
+        if len(matrix) > max_samples:
+            sample = matrix[rng.choice(len(matrix), max_samples, replace=False)]
+        
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignments = _nearest_centroids(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+            counts = np.bincount(assignments, minlength=nlist)
+            # Re-seed empty clusters with random samples
+            empty = np.flatnonzero(counts == 0)
+            if len(empty):
+                sums[empty] = sample[rng.choice(len(sample), len(empty), replace=False)]
+            centroids = normalize_embeddings(sums)
+        
+        index = cls(centroids)
+        index.add_many(student_ids, matrix)
+        index.trained_size = len(matrix)
+        return index
+    
+    def add_many(self, student_ids: np.ndarray, matrix: np.ndarray):
+        """File several normalized embeddings at once"""
+        if len(student_ids) == 0:
+            return
+        self._file(student_ids.tolist(), _nearest_centroids(matrix, self.centroids).tolist())
+    
+    def refile_many(self, student_ids: np.ndarray, matrix: np.ndarray):
+        """File the embeddings that are missing or filed under another list than their nearest one"""
+        if len(student_ids) == 0:
+            return
+        nearest = _nearest_centroids(matrix, self.centroids)
+        filed = np.fromiter((self._list_of.get(student_id, -1) for student_id in student_ids.tolist()), dtype=np.int64, count=len(student_ids))
+        moved = nearest != filed
+        self._file(student_ids[moved].tolist(), nearest[moved].tolist())
+    
+    def _file(self, student_ids: List[int], list_nos: List[int]):
+        for student_id, list_no in zip(student_ids, list_nos):
+            self.remove(student_id)
+            self._lists[list_no].append(student_id)
+            self._list_of[student_id] = list_no
+    
+    def add(self, student_id: int, embedding: np.ndarray):
+        """File one normalized embedding, replacing any previous entry for the student"""
+        self.add_many(np.array([student_id], dtype=np.int64), embedding.reshape(1, -1))
+    
+    def remove(self, student_id: int):
+        """Drop a student from the index, if present"""
+        list_no = self._list_of.pop(student_id, None)
+        if list_no is not None:
+            self._lists[list_no].remove(student_id)
+    
+    def student_ids(self) -> np.ndarray:
+        """IDs currently filed in the index"""
+        return np.fromiter(self._list_of.keys(), dtype=np.int64, count=len(self._list_of))
+    
+    def probe(self, embedding: np.ndarray, nprobe: int) -> np.ndarray:
+        """Return the candidate student IDs from the `nprobe` lists closest to the query"""
+        scores = self.centroids @ normalize_embeddings(embedding)
+        nprobe = max(1, min(nprobe, self.nlist))
+        closest = np.argpartition(-scores, nprobe - 1)[:nprobe]
+        candidates = []
+        for list_no in closest:
+            candidates.extend(self._lists[list_no])
+        return np.array(candidates, dtype=np.int64)
+    
+    def save(self, path: str, model_name: str):
+        """Persist centroids and list assignments"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        meta = {"model_name": model_name, "trained_size": self.trained_size}
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(
+            tmp_path,
+            centroids=self.centroids,
+            student_ids=self.student_ids(),
+            assignments=np.fromiter(self._list_of.values(), dtype=np.int64, count=len(self._list_of)),
+            meta=np.array(json.dumps(meta)),
+        )
+        os.replace(tmp_path, path)
+    
+    @classmethod
+    def load(cls, path: str, model_name: str, dim: int) -> Optional["IVFIndex"]:
+        """Load a persisted index, or None if missing or built for another model"""
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                meta = json.loads(str(data["meta"]))
+                centroids = data["centroids"]
+                student_ids = data["student_ids"]
+                assignments = data["assignments"]
+        except Exception as e:
+            print(f"⚠️ Could not read ANN index {path}: {e}")
+            return None
+        
+        if meta.get("model_name") != model_name or centroids.shape[1] != dim:
+            return None
+        
+        index = cls(centroids)
+        index.trained_size = meta.get("trained_size", len(student_ids))
+        for student_id, list_no in zip(student_ids.tolist(), assignments.tolist()):
+            index._lists[list_no].append(student_id)
+            index._list_of[student_id] = list_no
+        return index
+
+def _nearest_centroids(matrix: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Index of the most similar centroid for every row, computed in chunks"""
+    assignments = np.empty(len(matrix), dtype=np.int64)
+    for start in range(0, len(matrix), ASSIGN_CHUNK_SIZE):
+        chunk = matrix[start:start + ASSIGN_CHUNK_SIZE]
+        assignments[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+    return assignments
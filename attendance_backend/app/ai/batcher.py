@@ -0,0 +1,151 @@
+"""Dynamic micro-batching of face recognition inference"""
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from typing import Callable, List
+import numpy as np
+
+class RecognitionBatcher:
+    """Collect aligned face crops from concurrent requests and embed them in batches.
+    
+    A worker thread takes the first queued crop and keeps collecting more
+    for up to `max_wait_ms` (or until `max_batch_size`), then runs the
+    recognition model once for the whole batch and resolves each crop's
+    future. It only waits while requests in the pipeline have not queued
+    their crops yet, so a lone request at low load is embedded immediately. With a session
+    pool, one worker per session runs batches side by side.
+    """
+    
+    def __init__(self, embed_fn: Callable[[List[np.ndarray]], np.ndarray], max_batch_size: int = 16, max_wait_ms: float = 5.0, workers: int = 1):
+        self._embed_fn = embed_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.workers = workers
+        self._queue: "queue.Queue" = queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._active_requests = 0
+        self._submitted_requests = 0
+        
+        # Observability
+        self.batches = 0
+        self.faces = 0
+        self.max_queue_depth = 0
+        self.batch_size_histogram = Counter()
+        self.queue_depth_histogram = Counter()
+    
+    def start(self):
+        """Start the worker threads (idempotent)"""
+        with self._lock:
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._run, name=f"recognition-batcher-{len(self._threads)}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+    
+    def stop(self):
+        """Stop the worker threads after the queued crops are processed"""
+        # One sentinel stops every worker: each puts it back for the next
+        if self._threads:
+            self._queue.put(None)
+            for thread in self._threads:
+                thread.join(timeout=5)
+            self._threads = []
+            self._queue = queue.Queue()
+    
+    def request_started(self):
+        """Mark a request as in the pipeline, so the worker waits until it queues its crops"""
+        with self._lock:
+            self._active_requests += 1
+    
+    def request_finished(self):
+        with self._lock:
+            self._active_requests -= 1
+    
+    def submit(self, crop: np.ndarray) -> Future:
+        """Queue one aligned crop; the future resolves to its embedding"""
+        self.start()
+        future = Future()
+        self._queue.put((crop, future))
+        depth = self._queue.qsize()
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+        return future
+    
+    def embed(self, crops: List[np.ndarray]) -> np.ndarray:
+        """Embed crops through the shared batches and wait for the results"""
+        with self._lock:
+            self._submitted_requests += 1
+        try:
+            futures = [self.submit(crop) for crop in crops]
+            return np.stack([future.result() for future in futures])
+        finally:
+            with self._lock:
+                self._submitted_requests -= 1
+    
+    def stats(self) -> dict:
+        """Queue depth and batch-size histograms"""
+        return {
+            "queue_depth": self._queue.qsize(),
+            "max_queue_depth": self.max_queue_depth,
+            "active_requests": self._active_requests,
+            "pending_requests": self._pending_requests(),
+            "batches": self.batches,
+            "faces": self.faces,
+            "avg_batch_size": round(self.faces / self.batches, 2) if self.batches else 0.0,
+            "batch_size_histogram": dict(sorted(self.batch_size_histogram.items())),
+            "queue_depth_histogram": dict(sorted(self.queue_depth_histogram.items())),
+        }
+    
+    def _pending_requests(self) -> int:
+        """Requests in the pipeline that have not queued their crops yet"""
+        return max(0, self._active_requests - self._submitted_requests)
+    
+    def _collect(self, first) -> list:
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            # Queued crops are always taken; only wait for requests still to queue theirs
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._pending_requests() == 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if item is None:
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+    
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                self._queue.put(None)
+                return
+            with self._lock:
+                self.queue_depth_histogram[self._queue.qsize() + 1] += 1
+            batch = self._collect(first)
+            
+            crops = [crop for crop, _ in batch]
+            try:
+                embeddings = self._embed_fn(crops)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            
+            for (_, future), embedding in zip(batch, embeddings):
+                future.set_result(embedding)
+            
+            with self._lock:
+                self.batches += 1
+                self.faces += len(batch)
+                self.batch_size_histogram[len(batch)] += 1
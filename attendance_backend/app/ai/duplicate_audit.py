@@ -0,0 +1,173 @@
+"""Gallery-wide audit for students registered twice with the same face"""
+import hashlib
+import json
+import os
+import time
+from typing import Iterator, Optional, Tuple
+import numpy as np
+
+# Rows per side of a similarity block: 1024 x 1024 float32 is 4 MB, about an L2/L3 slice
+AUDIT_BLOCK_SIZE = 1024
+
+def similar_pairs(matrix: np.ndarray, threshold: float, rows: Optional[np.ndarray] = None,
+                  block_size: int = AUDIT_BLOCK_SIZE) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """Yield (row, col, similarity) arrays of pairs at or above `threshold`, one block at a time
+    
+    The full N x N matrix is never built: each step multiplies a block of
+    rows by a block of columns and keeps only the hits. Every unordered pair
+    is reported once, with row < col in the full run.
+    
+    Args:
+        matrix: L2-normalized rows
+        rows: Only pairs involving these rows (an incremental run); None = all pairs
+    """
+    n = len(matrix)
+    if rows is None:
+        for start in range(0, n, block_size):
+            block = matrix[start:start + block_size]
+            # Only the upper triangle: column blocks from the diagonal on
+            for col_start in range(start, n, block_size):
+                sims = block @ matrix[col_start:col_start + block_size].T
+                hit_rows, hit_cols = np.nonzero(sims >= threshold)
+                hit_rows, hit_cols = hit_rows + start, hit_cols + col_start
+                keep = hit_rows < hit_cols
+                yield hit_rows[keep], hit_cols[keep], sims[hit_rows[keep] - start, hit_cols[keep] - col_start]
+        return
+    
+    selected = np.zeros(n, dtype=bool)
+    selected[rows] = True
+    rows = np.flatnonzero(selected)
+    for start in range(0, len(rows), block_size):
+        block_rows = rows[start:start + block_size]
+        block = matrix[block_rows]
+        for col_start in range(0, n, block_size):
+            sims = block @ matrix[col_start:col_start + block_size].T
+            hit, hit_cols = np.nonzero(sims >= threshold)
+            hit_rows, hit_cols = block_rows[hit], hit_cols + col_start
+            # A pair of two selected rows is found from both sides; keep it once
+            keep = (hit_rows != hit_cols) & (~selected[hit_cols] | (hit_rows < hit_cols))
+            yield hit_rows[keep], hit_cols[keep], sims[hit[keep], hit_cols[keep] - col_start]
+
+def student_fingerprints(matrix: np.ndarray, owner_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """(student_ids, 64-bit hash of each student's rows), to tell which students changed since the last audit"""
+    order = np.argsort(owner_ids, kind="stable")
+    rows, owners = matrix[order], owner_ids[order]
+    student_ids, starts = np.unique(owners, return_index=True)
+    ends = np.append(starts[1:], len(owners))
+    fingerprints = np.array(
+        [int.from_bytes(hashlib.blake2b(rows[start:end].tobytes(), digest_size=8).digest(), "little")
+         for start, end in zip(starts.tolist(), ends.tolist())],
+        dtype=np.uint64
+    )
+    return student_ids, fingerprints
+
+def best_student_pairs(pair_a: np.ndarray, pair_b: np.ndarray, sims: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Reduce row pairs to one (a < b) pair per pair of students, keeping the best similarity
+    
+    Pairs of two rows of the same student are dropped.
+    """
+    low, high = np.minimum(pair_a, pair_b), np.maximum(pair_a, pair_b)
+    keep = low != high
+    low, high, sims = low[keep], high[keep], sims[keep]
+    order = np.lexsort((-sims, high, low))
+    low, high, sims = low[order], high[order], sims[order]
+    first = np.ones(len(low), dtype=bool)
+    first[1:] = (low[1:] != low[:-1]) | (high[1:] != high[:-1])
+    return low[first], high[first], sims[first]
+
+class DuplicateAudit:
+    """Incremental all-pairs similarity audit over the gallery's scoring rows.
+    
+    Rows are whatever verify scores against: one centroid per student with
+    "centroid" template scoring, every template with "max". Row pairs are
+    reduced to the best one per pair of students, so the result is exact
+    for either scoring. The first run compares every pair of rows in
+    blocks. Each run saves a fingerprint per student and the pairs it
+    found, so later runs only compare the rows of students whose templates
+    changed (or who are new) against everyone, and carry over the pairs
+    between unchanged students. Changing the threshold, the scoring or the
+    recognizer triggers a full run.
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+    
+    def _load(self, model_name: str, threshold: float, scoring: str) -> Optional[dict]:
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with np.load(self.path) as data:
+                state = {name: data[name] for name in data.files}
+            meta = json.loads(str(state.pop("meta")))
+        except Exception as e:
+            print(f"⚠️ Could not read duplicate audit state {self.path}: {e}")
+            return None
+        if meta.get("model_name") != model_name or meta.get("threshold") != threshold or meta.get("scoring") != scoring:
+            return None
+        return state
+    
+    def _save(self, model_name: str, threshold: float, scoring: str, student_ids, fingerprints, pair_a, pair_b, pair_sims):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp.npz"
+        np.savez(
+            tmp_path,
+            student_ids=student_ids,
+            fingerprints=fingerprints,
+            pair_a=pair_a,
+            pair_b=pair_b,
+            pair_sims=pair_sims,
+            meta=np.array(json.dumps({"model_name": model_name, "threshold": threshold, "scoring": scoring})),
+        )
+        os.replace(tmp_path, self.path)
+    
+    def run(self, matrix: np.ndarray, owner_ids: np.ndarray, threshold: float, model_name: str,
+            scoring: str = "centroid", full: bool = False) -> Tuple[np.ndarray, np.ndarray, np.ndarray, dict]:
+        """Pairs of students with some pair of rows at least `threshold` alike
+        
+        Args:
+            matrix: L2-normalized rows, several per student allowed
+            owner_ids: Student ID of every row
+            scoring: What the rows are ("centroid" or "max"), kept with the saved state
+        
+        Returns:
+            Tuple[student_ids_a, student_ids_b, best similarities, summary]
+        """
+        started = time.perf_counter()
+        student_ids, fingerprints = student_fingerprints(matrix, owner_ids)
+        previous = None if full else self._load(model_name, threshold, scoring)
+        
+        if previous is None:
+            rows = None
+            compared = len(student_ids)
+            kept_a = kept_b = np.empty(0, dtype=np.int64)
+            kept_sims = np.empty(0, dtype=np.float32)
+        else:
+            # Unchanged students keep their fingerprint; their mutual pairs still hold
+            known = dict(zip(previous["student_ids"].tolist(), previous["fingerprints"].tolist()))
+            changed = np.array([known.get(student_id) != fingerprint
+                                for student_id, fingerprint in zip(student_ids.tolist(), fingerprints.tolist())], dtype=bool)
+            compared = int(changed.sum())
+            rows = np.flatnonzero(np.isin(owner_ids, student_ids[changed]))
+            unchanged_ids = student_ids[~changed]
+            keep = np.isin(previous["pair_a"], unchanged_ids) & np.isin(previous["pair_b"], unchanged_ids)
+            kept_a, kept_b, kept_sims = previous["pair_a"][keep], previous["pair_b"][keep], previous["pair_sims"][keep]
+        
+        found_a, found_b, found_sims = [kept_a], [kept_b], [kept_sims]
+        for hit_rows, hit_cols, sims in similar_pairs(matrix, threshold, rows):
+            hit_a, hit_b = owner_ids[hit_rows], owner_ids[hit_cols]
+            # A student's own templates always match each other
+            other = hit_a != hit_b
+            found_a.append(hit_a[other])
+            found_b.append(hit_b[other])
+            found_sims.append(sims[other].astype(np.float32))
+        pair_a, pair_b, pair_sims = best_student_pairs(np.concatenate(found_a), np.concatenate(found_b), np.concatenate(found_sims))
+        self._save(model_name, threshold, scoring, student_ids, fingerprints, pair_a, pair_b, pair_sims)
+        
+        summary = {
+            "mode": "full" if rows is None else "incremental",
+            "students": len(student_ids),
+            "compared_students": compared,
+            "candidate_pairs": len(pair_a),
+            "seconds": round(time.perf_counter() - started, 3),
+        }
+        return pair_a, pair_b, pair_sims, summary
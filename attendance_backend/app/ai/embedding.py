@@ -1,37 +1,107 @@
 """Generate face embeddings"""
 import numpy as np
 import json
+import struct
 from typing import Optional, Tuple
 from .insightface_model import face_model
+from .validator import validate_single_face, check_face_quality
+from ..core.config import settings
 
-def generate_embedding(image: np.ndarray) -> Tuple[Optional[str], str]:
+# Binary storage layout: fixed little-endian header followed by the raw vector
+# magic (4s) | format version (B) | dtype code (B) | dimension (H) | model tag (16s)
+EMBEDDING_MAGIC = b"FEMB"
+EMBEDDING_FORMAT_VERSION = 1
+EMBEDDING_HEADER = struct.Struct("<4sBBH16s")
+EMBEDDING_DTYPES = {0: np.dtype("<f4"), 1: np.dtype("<f2")}
+EMBEDDING_DTYPE_CODES = {"float32": 0, "float16": 1}
+
+def generate_embedding(image: np.ndarray) -> Tuple[Optional[np.ndarray], str]:
     """Generate face embedding from image
     
+    The face count and quality are checked on the detection, so unusable
+    frames are rejected before the recognition model runs.
+    
     Returns:
-        Tuple[embedding_json, message]: (embedding as JSON string, status message)
+        Tuple[embedding, message]: (embedding as float32 array, status message)
     """
     try:
-        faces = face_model.detect_faces(image)
+        verdict = {}
+        def select(faces):
+            ok, message = validate_single_face(faces)
+            if ok:
+                ok, message, metrics = check_face_quality(image, faces[0])
+                if not ok:
+                    print(f"🚫 Face rejected before recognition: {message} {metrics}")
+            verdict.update(ok=ok, message=message)
+            return faces if ok else []
         
-        if len(faces) == 0:
-            return None, "No face detected in image"
-        
-        if len(faces) > 1:
-            return None, "Multiple faces detected. Please ensure only one face is visible"
+        faces = face_model.detect_faces(image, select=select)
+        if not verdict["ok"]:
+            return None, verdict["message"]
         
         # Get the first (and only) face
         face = faces[0]
-        embedding = face.embedding
-        
-        # Convert numpy array to JSON string for storage
-        embedding_json = json.dumps(embedding.tolist())
+        embedding = np.asarray(face.embedding, dtype=np.float32)
         
-        return embedding_json, "Face embedding generated successfully"
+        return embedding, "Face embedding generated successfully"
         
     except Exception as e:
         return None, f"Error generating embedding: {str(e)}"
 
+def embedding_to_bytes(embedding: np.ndarray, dtype: str = None, model_name: str = None) -> bytes:
+    """Serialize an embedding to the compact binary storage format
+    
+    Args:
+        embedding: 1-D embedding vector
+        dtype: "float32" or "float16" (uses config default if None)
+        model_name: Model tag stored in the header (uses config default if None)
+    """
+    if dtype is None:
+        dtype = settings.embedding_storage_dtype
+    if model_name is None:
+        model_name = settings.recognition_model_name
+    if dtype not in EMBEDDING_DTYPE_CODES:
+        raise ValueError(f"Unsupported embedding dtype: {dtype}")
+    
+    code = EMBEDDING_DTYPE_CODES[dtype]
+    vector = np.ascontiguousarray(embedding, dtype=EMBEDDING_DTYPES[code]).ravel()
+    header = EMBEDDING_HEADER.pack(
+        EMBEDDING_MAGIC, EMBEDDING_FORMAT_VERSION, code, vector.size, model_name.encode("ascii")[:16]
+    )
+    return header + vector.tobytes()
+
+def read_embedding_header(blob: bytes) -> Tuple[np.dtype, int, str]:
+    """Read (dtype, dimension, model_name) from a binary embedding"""
+    magic, version, code, dim, model_tag = EMBEDDING_HEADER.unpack_from(blob)
+    if magic != EMBEDDING_MAGIC or version != EMBEDDING_FORMAT_VERSION or code not in EMBEDDING_DTYPES:
+        raise ValueError("Unrecognized embedding blob header")
+    return EMBEDDING_DTYPES[code], dim, model_tag.rstrip(b"\0").decode("ascii")
+
+def embedding_from_bytes(blob: bytes) -> np.ndarray:
+    """Convert a binary embedding back to a float32 array (zero-copy for float32 blobs)"""
+    dtype, dim, _ = read_embedding_header(blob)
+    vector = np.frombuffer(blob, dtype=dtype, count=dim, offset=EMBEDDING_HEADER.size)
+    return vector if dtype == np.float32 else vector.astype(np.float32)
+
 def embedding_from_json(embedding_json: str) -> np.ndarray:
     """Convert JSON string back to numpy array"""
     embedding_list = json.loads(embedding_json)
-    return np.array(embedding_list, dtype=np.float32)
\ No newline at end of file
+    return np.array(embedding_list, dtype=np.float32)
+
+def embedding_from_storage(embedding_blob: Optional[bytes], embedding_json: Optional[str]) -> np.ndarray:
+    """Decode a stored embedding, falling back to legacy JSON rows not yet migrated"""
+    if embedding_blob is not None:
+        return embedding_from_bytes(embedding_blob)
+    return embedding_from_json(embedding_json)
+
+def embedding_model_tag(embedding_blob: Optional[bytes]) -> str:
+    """Model tag of a stored embedding; legacy JSON rows predate tags and belong to the default pack"""
+    if embedding_blob is None:
+        return settings.insightface_model_name.encode("ascii")[:16].decode("ascii")
+    return read_embedding_header(embedding_blob)[2]
+
+def is_current_model(embedding_blob: Optional[bytes], model_name: str = None) -> bool:
+    """Whether a stored embedding was produced by the recognizer serving matches (or by `model_name`)"""
+    if model_name is None:
+        model_name = settings.recognition_model_name
+    return embedding_model_tag(embedding_blob) == model_name.encode("ascii")[:16].decode("ascii")
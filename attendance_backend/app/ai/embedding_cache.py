@@ -0,0 +1,89 @@
+"""Content-hash cache of computed embeddings for retried uploads"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+import cv2
+import numpy as np
+from ..core.config import settings
+
+class EmbeddingCache:
+    """Bounded LRU cache with a TTL, keyed by a hash of the uploaded image.
+    
+    Exact keys are a SHA-256 of the raw bytes, so a retried upload skips
+    decoding, detection and recognition. Optional perceptual keys (a 64-bit
+    difference hash of the decoded image) also catch re-encodes of the same
+    frame, but skip only detection and recognition. Only successful
+    embeddings are cached. Thread-safe.
+    """
+    
+    def __init__(self, max_entries: int = 256, ttl_s: float = 300.0):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self._entries: "OrderedDict[str, Tuple[float, np.ndarray, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        
+        # Observability
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+    
+    @staticmethod
+    def key_for_bytes(image_data: bytes) -> str:
+        return "sha256:" + hashlib.sha256(image_data).hexdigest()
+    
+    @staticmethod
+    def key_for_image(image: np.ndarray) -> str:
+        """Difference hash: brighter-than-right-neighbour bits of a 9x8 grayscale thumbnail"""
+        gray = cv2.cvtColor(cv2.resize(image, (9, 8), interpolation=cv2.INTER_AREA), cv2.COLOR_RGB2GRAY)
+        bits = (gray[:, 1:] > gray[:, :-1]).flatten()
+        return "dhash:" + np.packbits(bits).tobytes().hex()
+    
+    def get(self, key: str) -> Optional[Tuple[np.ndarray, str]]:
+        """Cached (embedding, message) for the key, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            stored_at, embedding, message = entry
+            if time.monotonic() - stored_at > self.ttl_s:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return embedding, message
+    
+    def put(self, key: str, embedding: np.ndarray, message: str):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), embedding, message)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self) -> dict:
+        """Hit rate, size and eviction counts"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "memory_bytes": sum(len(key) + embedding.nbytes for key, (_, embedding, _) in self._entries.items()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+# Global singleton instance
+embedding_cache = EmbeddingCache(settings.embedding_cache_size, settings.embedding_cache_ttl_s)
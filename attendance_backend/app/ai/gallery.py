@@ -0,0 +1,324 @@
+"""Process-resident gallery of enrolled face embeddings"""
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+import numpy as np
+from .ann_index import IVFIndex
+from .matcher import normalize_embeddings, find_best_match_vectorized
+from ..core.config import settings
+
+EMBEDDING_DIM = 512
+
+class FaceGallery:
+    """In-memory copy of every enrolled embedding, ready for matrix matching.
+    
+    A student can have several templates. Rows are kept L2-normalized in one
+    contiguous float32 matrix, sorted by class and then student, so that each
+    class is a contiguous slice (a view, never a copy) and each student's
+    templates are adjacent. Mutations build new arrays and swap them in under
+    the lock, so searches only hold the lock long enough to grab a consistent
+    snapshot.
+    
+    With `template_scoring` = "max" the scoring matrix holds every template
+    and a student scores their best template; with "centroid" it holds one
+    normalized mean template per student.
+    
+    The gallery lives in the worker process: with several uvicorn/gunicorn
+    workers each one keeps its own copy, loaded at startup.
+    
+    Once the gallery reaches `ann_min_gallery_size` students, school-wide
+    searches go through an IVF index over the student centroids and only the
+    probed candidates' rows are scored exactly. The index is trained outside
+    the lock on a snapshot of the centroids, so searches and enrollments
+    carry on meanwhile; students changed during training are refiled when
+    the new index is swapped in.
+    """
+    
+    def __init__(self, dim: int = EMBEDDING_DIM):
+        self.dim = dim
+        self._lock = threading.Lock()
+        # Every template, the source of truth for mutations
+        self._templates = np.empty((0, dim), dtype=np.float32)
+        self._template_student_ids = np.empty(0, dtype=np.int64)
+        self._template_class_ids = np.empty(0, dtype=np.int64)
+        # One normalized mean template per student
+        self._centroids = np.empty((0, dim), dtype=np.float32)
+        self._centroid_ids = np.empty(0, dtype=np.int64)
+        # Scoring rows: the templates or the centroids, depending on template_scoring
+        self._matrix = np.empty((0, dim), dtype=np.float32)
+        self._student_ids = np.empty(0, dtype=np.int64)
+        self._class_ids = np.empty(0, dtype=np.int64)
+        self._class_slices = {}
+        self._id_order = np.empty(0, dtype=np.int64)
+        self._sorted_ids = np.empty(0, dtype=np.int64)
+        self.ann_index: Optional[IVFIndex] = None
+        # Students whose centroid changed while an index was being trained, None when not training
+        self._ann_changed: Optional[set] = None
+        self.loaded = False
+    
+    def __len__(self) -> int:
+        return len(self._template_student_ids)
+    
+    @property
+    def student_count(self) -> int:
+        return len(self._centroid_ids)
+    
+    def load(self, rows: Iterable[Tuple[int, int, np.ndarray]]):
+        """Replace the gallery contents with (student_id, class_id, embedding) rows, one per template"""
+        rows = list(rows)
+        if rows:
+            student_ids = np.array([row[0] for row in rows], dtype=np.int64)
+            class_ids = np.array([row[1] for row in rows], dtype=np.int64)
+            matrix = normalize_embeddings(np.stack([row[2] for row in rows]))
+        else:
+            student_ids = np.empty(0, dtype=np.int64)
+            class_ids = np.empty(0, dtype=np.int64)
+            matrix = np.empty((0, self.dim), dtype=np.float32)
+        
+        with self._lock:
+            self._swap(matrix, student_ids, class_ids)
+            self.ann_index = None
+            self.loaded = True
+        self._sync_ann_index()
+        print(f"🗂️ Face gallery loaded: {len(student_ids)} template(s) for {self.student_count} student(s) in {len(self._class_slices)} class(es)")
+    
+    def set_templates(self, student_id: int, class_id: int, embeddings: np.ndarray):
+        """Replace all templates of a student (an empty list removes the student)"""
+        self.set_students({student_id: (class_id, embeddings)})
+    
+    def set_students(self, students: Dict[int, Tuple[int, np.ndarray]]):
+        """Replace all templates of several students, {student_id: (class_id, embeddings)}, in one rebuild"""
+        if not students:
+            return
+        rows = {
+            student_id: normalize_embeddings(np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dim))
+            for student_id, (_, embeddings) in students.items()
+        }
+        with self._lock:
+            keep = ~np.isin(self._template_student_ids, list(rows))
+            self._swap(
+                np.concatenate([self._templates[keep]] + list(rows.values())),
+                np.concatenate([self._template_student_ids[keep]] + [
+                    np.full(len(student_rows), student_id, dtype=np.int64) for student_id, student_rows in rows.items()
+                ]),
+                np.concatenate([self._template_class_ids[keep]] + [
+                    np.full(len(student_rows), students[student_id][0], dtype=np.int64) for student_id, student_rows in rows.items()
+                ]),
+            )
+            if self.ann_index is not None:
+                for student_id, student_rows in rows.items():
+                    if len(student_rows):
+                        self.ann_index.add(student_id, self._centroids[self._centroid_ids == student_id][0])
+                    else:
+                        self.ann_index.remove(student_id)
+            self._mark_ann_changed(rows)
+        self._sync_ann_index()
+    
+    def student_templates(self, student_id: int) -> np.ndarray:
+        """Normalized templates of one student"""
+        with self._lock:
+            templates, student_ids = self._templates, self._template_student_ids
+        return templates[student_ids == student_id]
+    
+    def remove(self, student_id: int):
+        """Drop all templates of a student, if present"""
+        with self._lock:
+            keep = self._template_student_ids != student_id
+            if keep.all():
+                return
+            self._swap(self._templates[keep], self._template_student_ids[keep], self._template_class_ids[keep])
+            if self.ann_index is not None:
+                self.ann_index.remove(student_id)
+            self._mark_ann_changed([student_id])
+        self._sync_ann_index()
+    
+    def remove_class(self, class_id: int):
+        """Drop every template belonging to a class"""
+        with self._lock:
+            if class_id not in self._class_slices:
+                return
+            keep = self._template_class_ids != class_id
+            removed = np.unique(self._template_student_ids[~keep]).tolist()
+            if self.ann_index is not None:
+                for student_id in removed:
+                    self.ann_index.remove(student_id)
+            self._mark_ann_changed(removed)
+            self._swap(self._templates[keep], self._template_student_ids[keep], self._template_class_ids[keep])
+        self._sync_ann_index()
+    
+    def move(self, student_id: int, class_id: int):
+        """Re-file a student's templates under a new class"""
+        with self._lock:
+            hit = self._template_student_ids == student_id
+            if not hit.any():
+                return
+            class_ids = self._template_class_ids.copy()
+            class_ids[hit] = class_id
+            self._swap(self._templates, self._template_student_ids, class_ids)
+    
+    def centroid_snapshot(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (centroids, student_ids): one normalized mean template per student"""
+        with self._lock:
+            return self._centroids, self._centroid_ids
+    
+    def snapshot(self, class_id: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the scoring (matrix, student_ids) for the whole gallery or one class
+        
+        With "max" scoring a student can own several rows; argmax and the
+        student-keyed face assignment then pick their best template.
+        """
+        with self._lock:
+            matrix, student_ids = self._matrix, self._student_ids
+            bounds = self._class_slices.get(class_id) if class_id is not None else None
+        if class_id is None:
+            return matrix, student_ids
+        if bounds is None:
+            return matrix[:0], student_ids[:0]
+        start, end = bounds
+        return matrix[start:end], student_ids[start:end]
+    
+    def search(self, embedding: np.ndarray, class_id: Optional[int] = None,
+               threshold: float = None, exclude_student_id: Optional[int] = None) -> Tuple[Optional[int], float, bool]:
+        """Find the best matching student with one matrix-vector product
+        
+        Returns:
+            Tuple[best_student_id, best_similarity, is_match]
+        """
+        rows = None
+        with self._lock:
+            if class_id is None and self.ann_index is not None:
+                matrix, student_ids = self._matrix, self._student_ids
+                rows = self._rows_for(self.ann_index.probe(embedding, settings.ann_nprobe))
+                nlist = self.ann_index.nlist
+        if rows is not None:
+            print(f"🧭 ANN search: {len(rows)} candidate(s) from {min(settings.ann_nprobe, nlist)} of {nlist} lists")
+            matrix, student_ids = matrix[rows], student_ids[rows]
+        else:
+            matrix, student_ids = self.snapshot(class_id)
+        if exclude_student_id is not None:
+            keep = student_ids != exclude_student_id
+            matrix, student_ids = matrix[keep], student_ids[keep]
+        return find_best_match_vectorized(embedding, matrix, student_ids, threshold)
+    
+    def _swap(self, templates: np.ndarray, student_ids: np.ndarray, class_ids: np.ndarray):
+        # Sort templates by class, then student, and rebuild centroids and the scoring rows; caller holds the lock
+        order = np.lexsort((student_ids, class_ids))
+        self._templates = np.ascontiguousarray(templates[order], dtype=np.float32)
+        self._template_student_ids = student_ids[order]
+        self._template_class_ids = class_ids[order]
+        
+        # Each student's templates are adjacent, so centroids are one reduceat
+        if len(order):
+            starts = np.concatenate([[0], np.flatnonzero(np.diff(self._template_student_ids)) + 1])
+            self._centroids = normalize_embeddings(np.add.reduceat(self._templates, starts, axis=0))
+            self._centroid_ids = self._template_student_ids[starts]
+            centroid_class_ids = self._template_class_ids[starts]
+        else:
+            self._centroids = np.empty((0, self.dim), dtype=np.float32)
+            self._centroid_ids = np.empty(0, dtype=np.int64)
+            centroid_class_ids = np.empty(0, dtype=np.int64)
+        
+        if settings.template_scoring == "centroid":
+            self._matrix, self._student_ids, class_ids = self._centroids, self._centroid_ids, centroid_class_ids
+        else:
+            self._matrix, self._student_ids, class_ids = self._templates, self._template_student_ids, self._template_class_ids
+        self._class_ids = class_ids
+        
+        slices = {}
+        if len(class_ids):
+            boundaries = np.flatnonzero(np.diff(class_ids)) + 1
+            starts = np.concatenate([[0], boundaries])
+            ends = np.concatenate([boundaries, [len(class_ids)]])
+            for start, end in zip(starts, ends):
+                slices[int(class_ids[start])] = (int(start), int(end))
+        self._class_slices = slices
+        self._id_order = np.argsort(self._student_ids, kind="stable")
+        self._sorted_ids = self._student_ids[self._id_order]
+    
+    def _rows_for(self, student_ids: np.ndarray) -> np.ndarray:
+        # Map student IDs to all of their current scoring rows; caller holds the lock
+        left = np.searchsorted(self._sorted_ids, student_ids, side="left")
+        counts = np.searchsorted(self._sorted_ids, student_ids, side="right") - left
+        total = int(counts.sum())
+        if total == 0:
+            return np.empty(0, dtype=np.int64)
+        # Expand each [left, left + count) range without a Python loop
+        offsets = np.repeat(left - np.concatenate([[0], np.cumsum(counts)[:-1]]), counts)
+        return self._id_order[np.arange(total) + offsets]
+    
+    def _mark_ann_changed(self, student_ids):
+        # Remember students to refile in an index being trained; caller holds the lock
+        if self._ann_changed is not None:
+            self._ann_changed.update(student_ids)
+    
+    def _sync_ann_index(self):
+        """Build, restore or retrain the ANN index as the gallery size requires
+        
+        Called without the lock: only the snapshot and the swap take it, and
+        the k-means training runs in between. One thread trains at a time;
+        the current index (or exact search) serves until the swap.
+        """
+        with self._lock:
+            size = self.student_count
+            if not settings.ann_enabled or size < settings.ann_min_gallery_size:
+                self.ann_index = None
+                return
+            index = self.ann_index
+            if self._ann_changed is not None or (index is not None and size < index.trained_size * settings.ann_retrain_growth):
+                return
+            centroids, centroid_ids = self._centroids, self._centroid_ids
+            self._ann_changed = set()
+        
+        try:
+            restored = False
+            if index is None:
+                index = IVFIndex.load(settings.ann_index_path, settings.recognition_model_name, self.dim)
+                restored = index is not None
+                if restored:
+                    # Students re-enrolled or given new templates while the index was on disk
+                    # may have moved to another list; refiled here, outside the lock
+                    index.refile_many(centroid_ids, centroids)
+            if index is None or size >= index.trained_size * settings.ann_retrain_growth:
+                nlist = settings.ann_nlist or int(np.sqrt(size))
+                index = IVFIndex.train(centroids, centroid_ids, nlist)
+                restored = False
+                print(f"🧭 ANN index trained: {nlist} lists over {size} students")
+            
+            with self._lock:
+                changed, self._ann_changed = self._ann_changed, None
+                if not settings.ann_enabled or self.student_count < settings.ann_min_gallery_size:
+                    self.ann_index = None
+                    return
+                for student_id in changed:
+                    index.remove(student_id)
+                self.ann_index = index
+                self._reconcile_ann_index()
+                if restored:
+                    print(f"🧭 ANN index restored from {settings.ann_index_path} ({index.nlist} lists)")
+                else:
+                    self._save_ann_index()
+        finally:
+            with self._lock:
+                self._ann_changed = None
+    
+    def _reconcile_ann_index(self):
+        # Catch up with students added or removed since the index's snapshot
+        indexed = self.ann_index.student_ids()
+        for student_id in np.setdiff1d(indexed, self._centroid_ids).tolist():
+            self.ann_index.remove(student_id)
+        missing = ~np.isin(self._centroid_ids, indexed)
+        self.ann_index.add_many(self._centroid_ids[missing], self._centroids[missing])
+    
+    def _save_ann_index(self):
+        try:
+            self.ann_index.save(settings.ann_index_path, settings.recognition_model_name)
+        except Exception as e:
+            print(f"⚠️ Could not save ANN index: {e}")
+    
+    def save_ann_index(self):
+        """Persist the ANN index so the next start does not retrain it"""
+        with self._lock:
+            if self.ann_index is not None:
+                self._save_ann_index()
+
+# Global singleton instance
+face_gallery = FaceGallery()
@@ -0,0 +1,40 @@
+"""Rolling inference latency for readiness and stats"""
+import threading
+import time
+from collections import deque
+import numpy as np
+
+class LatencyWindow:
+    """Latency samples in milliseconds from the last `max_age_s` seconds, at most `size` of them
+    
+    Old samples expire so an instance marked slow by /ready becomes ready
+    again once the load balancer stops sending it traffic. Thread-safe.
+    """
+    
+    def __init__(self, size: int = 500, max_age_s: float = 60.0):
+        self.max_age_s = max_age_s
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+    
+    def record(self, milliseconds: float):
+        with self._lock:
+            self._samples.append((time.monotonic(), milliseconds))
+    
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+    
+    def _recent(self) -> list:
+        cutoff = time.monotonic() - self.max_age_s
+        with self._lock:
+            while self._samples and self._samples[0][0] < cutoff:
+                self._samples.popleft()
+            return [milliseconds for _, milliseconds in self._samples]
+    
+    def stats(self) -> dict:
+        """Sample count with p50 and p95, None before any recent sample"""
+        recent = self._recent()
+        if not recent:
+            return {"samples": 0, "p50_ms": None, "p95_ms": None}
+        p50, p95 = np.percentile(recent, [50, 95])
+        return {"samples": len(recent), "p50_ms": round(float(p50), 2), "p95_ms": round(float(p95), 2)}
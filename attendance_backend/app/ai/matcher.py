@@ -1,6 +1,6 @@
 """Compare face embeddings"""
 import numpy as np
-from typing import Tuple, List
+from typing import Tuple, List, Optional
 from ..core.config import settings
 
 def cosine_similarity(embedding1: np.ndarray, embedding2: np.ndarray) -> float:
@@ -68,4 +68,77 @@ def find_best_match(target_embedding: np.ndarray, candidate_embeddings: List[Tup
     is_match = best_similarity >= threshold
     print(f"{'✅' if is_match else '❌'} Best match: Student {best_student_id} with {best_similarity:.4f} (threshold: {threshold})")
     
-    return best_student_id, best_similarity, is_match
\ No newline at end of file
+    return best_student_id, best_similarity, is_match
+
+def normalize_embeddings(embeddings: np.ndarray) -> np.ndarray:
+    """L2-normalize embeddings row-wise as float32 (zero rows stay zero)"""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return embeddings / norms
+
+def find_best_match_vectorized(target_embedding: np.ndarray, gallery_matrix: np.ndarray, student_ids: np.ndarray, threshold: float = None) -> Tuple[Optional[int], float, bool]:
+    """Find the best match against a pre-normalized gallery in one matrix-vector product
+    
+    Args:
+        target_embedding: The embedding to match against
+        gallery_matrix: (N, D) float32 matrix of L2-normalized embeddings
+        student_ids: (N,) array of student IDs, parallel to the matrix rows
+        threshold: Similarity threshold
+    
+    Returns:
+        Tuple[best_student_id, best_similarity, is_match]
+    """
+    if len(student_ids) == 0:
+        print("⚠️ No candidate embeddings provided")
+        return None, 0.0, False
+    
+    if threshold is None:
+        threshold = settings.face_similarity_threshold
+    
+    similarities = gallery_matrix @ normalize_embeddings(target_embedding)
+    best_index = int(np.argmax(similarities))
+    best_similarity = float(similarities[best_index])
+    best_student_id = int(student_ids[best_index])
+    
+    is_match = best_similarity >= threshold
+    print(f"{'✅' if is_match else '❌'} Best match among {len(student_ids)}: Student {best_student_id} with {best_similarity:.4f} (threshold: {threshold})")
+    
+    return best_student_id, best_similarity, is_match
+
+def assign_faces_to_students(probe_embeddings: np.ndarray, gallery_matrix: np.ndarray, student_ids: np.ndarray, threshold: float = None) -> List[Tuple[Optional[int], float]]:
+    """Match several faces at once so that no two faces claim the same student
+    
+    Every face is scored against every gallery row in one matrix-matrix product,
+    then pairs above the threshold are assigned from the highest similarity down.
+    
+    Args:
+        probe_embeddings: (F, D) embeddings of the detected faces
+        gallery_matrix: (N, D) float32 matrix of L2-normalized embeddings
+        student_ids: (N,) array of student IDs, parallel to the matrix rows
+        threshold: Similarity threshold
+    
+    Returns:
+        List of (student_id or None, similarity) per face, in probe order
+    """
+    if threshold is None:
+        threshold = settings.face_similarity_threshold
+    
+    if len(probe_embeddings) == 0 or len(student_ids) == 0:
+        return [(None, 0.0) for _ in range(len(probe_embeddings))]
+    
+    similarities = normalize_embeddings(probe_embeddings) @ gallery_matrix.T
+    results = [(None, float(score)) for score in similarities.max(axis=1)]
+    
+    face_indices, row_indices = np.nonzero(similarities >= threshold)
+    order = np.argsort(-similarities[face_indices, row_indices], kind="stable")
+    assigned_faces, assigned_students = set(), set()
+    for k in order:
+        face_index, student_id = int(face_indices[k]), int(student_ids[row_indices[k]])
+        if face_index in assigned_faces or student_id in assigned_students:
+            continue
+        assigned_faces.add(face_index)
+        assigned_students.add(student_id)
+        results[face_index] = (student_id, float(similarities[face_index, row_indices[k]]))
+    
+    return results
@@ -0,0 +1,64 @@
+"""Pool of model copies for parallel inference"""
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from typing import List
+
+class SessionPool:
+    """Hand out one model copy per inference, blocking while all are busy.
+    
+    Each copy has its own ONNX Runtime sessions and intra-op thread pool,
+    so N copies with 1/N of the threads each run N inferences side by side
+    instead of contending inside one session. Copies are reused in FIFO
+    order. Thread-safe.
+    """
+    
+    def __init__(self, sessions: List):
+        if not sessions:
+            raise ValueError("A session pool needs at least one session")
+        self.sessions = list(sessions)
+        self._idle: "queue.Queue" = queue.Queue()
+        for session in self.sessions:
+            self._idle.put(session)
+        self._lock = threading.Lock()
+        
+        # Observability
+        self.checkouts = 0
+        self.contended_checkouts = 0
+        self.wait_ms_total = 0.0
+    
+    @property
+    def size(self) -> int:
+        return len(self.sessions)
+    
+    @contextmanager
+    def checkout(self):
+        """Borrow an idle copy for the duration of the block"""
+        started = time.perf_counter()
+        try:
+            session = self._idle.get_nowait()
+            contended = False
+        except queue.Empty:
+            session = self._idle.get()
+            contended = True
+        waited_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self.checkouts += 1
+            self.contended_checkouts += contended
+            self.wait_ms_total += waited_ms
+        try:
+            yield session
+        finally:
+            self._idle.put(session)
+    
+    def stats(self) -> dict:
+        """Pool size, busy copies and how often callers had to wait"""
+        with self._lock:
+            return {
+                "size": self.size,
+                "busy": self.size - self._idle.qsize(),
+                "checkouts": self.checkouts,
+                "contended_checkouts": self.contended_checkouts,
+                "avg_wait_ms": round(self.wait_ms_total / self.checkouts, 3) if self.checkouts else 0.0,
+            }
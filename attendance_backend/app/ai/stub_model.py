@@ -0,0 +1,105 @@
+"""Deterministic stand-in for the InsightFace modules, for benchmarks and load tests without model weights"""
+import time
+from typing import List, Optional
+import cv2
+import numpy as np
+from insightface.utils import face_align
+from .batcher import RecognitionBatcher
+from .gallery import EMBEDDING_DIM
+from .insightface_model import InsightFaceModel, PackAnalysis
+from .session_pool import SessionPool
+from ..core.config import settings
+
+# Side of the downsampled crop the stub embedding is projected from
+STUB_FEATURE_SIZE = 16
+
+class StubDetector:
+    """Finds one frontal face in the middle of every image, with ArcFace template landmarks
+    
+    `latency_ms` sleeps like an inference would, releasing the GIL as ONNX
+    Runtime does, so load tests can reproduce a saturated face pipeline.
+    """
+    
+    def __init__(self, det_score: float = 0.99, face_fraction: float = 0.5, latency_ms: float = 0.0):
+        self.det_score = det_score
+        self.face_fraction = face_fraction
+        self.latency_ms = latency_ms
+    
+    def detect(self, image: np.ndarray, input_size=None, max_num: int = 0, metric: str = 'default'):
+        if self.latency_ms > 0:
+            time.sleep(self.latency_ms / 1000.0)
+        height, width = image.shape[:2]
+        side = min(height, width) * self.face_fraction
+        left, top = (width - side) / 2, (height - side) / 2
+        bboxes = np.array([[left, top, left + side, top + side, self.det_score]], dtype=np.float32)
+        kps = face_align.arcface_dst * (side / 112.0) + np.array([left, top])
+        return bboxes, kps[None].astype(np.float32)
+
+class StubRecognizer:
+    """Projects a downsampled aligned crop to 512 dimensions with a fixed random matrix
+    
+    The same crop always gives the same embedding and different photos give
+    unrelated ones, so enrolled synthetic photos match themselves.
+    `latency_ms` is slept per face of a batch.
+    """
+    
+    input_size = (112, 112)
+    
+    def __init__(self, seed: int = 0, latency_ms: float = 0.0):
+        self.latency_ms = latency_ms
+        features = STUB_FEATURE_SIZE * STUB_FEATURE_SIZE * 3
+        self.projection = np.random.default_rng(seed).standard_normal((features, EMBEDDING_DIM)).astype(np.float32)
+    
+    def prepare(self, ctx_id: int = 0, **kwargs):
+        """Nothing to set up; loaded recognizers are prepared before use"""
+    
+    def get_feat(self, imgs: List[np.ndarray]) -> np.ndarray:
+        if self.latency_ms > 0:
+            time.sleep(self.latency_ms * len(imgs) / 1000.0)
+        features = np.stack([
+            cv2.resize(img, (STUB_FEATURE_SIZE, STUB_FEATURE_SIZE), interpolation=cv2.INTER_AREA).astype(np.float32).ravel()
+            for img in imgs
+        ])
+        features -= features.mean(axis=1, keepdims=True)
+        return features @ self.projection
+
+def stub_pack(detection_ms: float = 0.0, recognition_ms: float = 0.0) -> PackAnalysis:
+    """One model copy made of the stub detector and recognizer"""
+    return PackAnalysis({'detection': StubDetector(latency_ms=detection_ms), 'recognition': StubRecognizer(latency_ms=recognition_ms)})
+
+def install_stub_model(model: Optional[InsightFaceModel] = None, sessions: int = 1,
+                       detection_ms: float = 0.0, recognition_ms: float = 0.0):
+    """Serve `model` (the global one by default) from stub copies instead of loading the weights
+    
+    Only the ONNX modules are replaced: pooling, adaptive detection,
+    alignment, micro-batching and the quality gate run the real code.
+    """
+    if model is None:
+        from .insightface_model import face_model as model
+    if model._batcher is not None:
+        model._batcher.stop()
+    model._pool = SessionPool([stub_pack(detection_ms, recognition_ms) for _ in range(sessions)])
+    model._model = model._pool.sessions[0]
+    model._batcher = RecognitionBatcher(
+        model.embed_crops,
+        max_batch_size=settings.recognition_max_batch_size,
+        max_wait_ms=settings.recognition_max_wait_ms,
+        workers=model._pool.size
+    )
+    model._batcher.start()
+    model.warmed_up = True
+    print(f"🧪 Stub face model installed ({sessions} session(s)), no weights loaded")
+    return model
+
+def synthetic_photo(seed: int, width: int = 640, height: int = 480) -> np.ndarray:
+    """RGB photo that passes the quality gate; each seed is a different "person" under the stub model"""
+    noise = np.random.default_rng(seed).integers(0, 255, (height, width, 3), dtype=np.uint8)
+    return cv2.GaussianBlur(noise, (3, 3), 0)
+
+def synthetic_jpeg(seed: int, width: int = 640, height: int = 480, quality: int = 90) -> bytes:
+    """`synthetic_photo` encoded as an upload"""
+    image = cv2.cvtColor(synthetic_photo(seed, width, height), cv2.COLOR_RGB2BGR)
+    ok, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("Could not encode synthetic photo")
+    return encoded.tobytes()
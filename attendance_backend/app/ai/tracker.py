@@ -0,0 +1,86 @@
+"""Cross-frame face tracking for live camera streams"""
+import time
+from typing import List, Optional
+import numpy as np
+
+def box_iou(boxes_a: np.ndarray, boxes_b: np.ndarray) -> np.ndarray:
+    """Pairwise IoU between two sets of x1, y1, x2, y2 boxes"""
+    top_left = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    bottom_right = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area_a = np.prod(boxes_a[:, 2:] - boxes_a[:, :2], axis=1)
+    area_b = np.prod(boxes_b[:, 2:] - boxes_b[:, :2], axis=1)
+    return intersection / np.maximum(area_a[:, None] + area_b[None, :] - intersection, 1e-6)
+
+class Track:
+    """One face followed across frames, with the identity last recognized for it"""
+    
+    def __init__(self, track_id: int, bbox: np.ndarray):
+        self.track_id = track_id
+        self.bbox = bbox
+        self.missed = 0
+        self.student_id: Optional[int] = None
+        self.confidence: Optional[float] = None
+        self.recognized_at: Optional[float] = None
+
+class FaceTracker:
+    """Associate detections with the previous frame's faces by box overlap.
+    
+    A detection overlapping a live track by at least `iou_threshold` (greedy,
+    best overlap first) continues it; the rest start new tracks. Tracks not
+    seen for `max_missed` frames are dropped. A track only needs recognition
+    when it is new, when its identity is older than `refresh_s`, or, for a
+    face that matched nobody, every `retry_s`. One tracker per stream; it is
+    not thread-safe.
+    """
+    
+    def __init__(self, iou_threshold: float = 0.3, max_missed: int = 5, refresh_s: float = 3.0, retry_s: float = 0.5):
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.refresh_s = refresh_s
+        self.retry_s = retry_s
+        self.tracks: List[Track] = []
+        self._next_id = 1
+    
+    def update(self, boxes: List[np.ndarray]) -> List[Track]:
+        """Match this frame's boxes to tracks; returns the track of every box, in order"""
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        assigned: List[Optional[Track]] = [None] * len(boxes)
+        matched = set()
+        
+        if len(boxes) and self.tracks:
+            ious = box_iou(boxes, np.stack([track.bbox for track in self.tracks]))
+            for flat in np.argsort(-ious, axis=None):
+                box_index, track_index = divmod(int(flat), len(self.tracks))
+                if ious[box_index, track_index] < self.iou_threshold:
+                    break
+                if assigned[box_index] is not None or track_index in matched:
+                    continue
+                assigned[box_index] = self.tracks[track_index]
+                matched.add(track_index)
+        
+        for track_index, track in enumerate(self.tracks):
+            track.missed = 0 if track_index in matched else track.missed + 1
+        self.tracks = [track for track in self.tracks if track.missed <= self.max_missed]
+        
+        for box_index, box in enumerate(boxes):
+            if assigned[box_index] is None:
+                assigned[box_index] = Track(self._next_id, box)
+                self._next_id += 1
+                self.tracks.append(assigned[box_index])
+            else:
+                assigned[box_index].bbox = box
+        return assigned
+    
+    def needs_recognition(self, track: Track, now: Optional[float] = None) -> bool:
+        """Whether the track's face has to go through recognition this frame"""
+        if track.recognized_at is None:
+            return True
+        age = (now if now is not None else time.monotonic()) - track.recognized_at
+        return age >= (self.refresh_s if track.student_id is not None else self.retry_s)
+    
+    def set_identity(self, track: Track, student_id: Optional[int], confidence: Optional[float], now: Optional[float] = None):
+        """Record the recognition result carried forward for the track"""
+        track.student_id = student_id
+        track.confidence = confidence
+        track.recognized_at = now if now is not None else time.monotonic()
@@ -1,18 +1,93 @@
-"""Face validation and quality checks"""
-from .insightface_model import face_model
+"""Face validation and quality checks on an existing detection"""
+from typing import List, Tuple
+import cv2
+import numpy as np
+from insightface.app.common import Face
+from ..core.config import settings
 
-def validate_single_face(image):
-    """Ensure only one face is detected"""
-    model = face_model.get_model()
-    faces = model.get(image)
-    return len(faces) == 1, len(faces)
+# Side of the grayscale face patch the blur and exposure metrics are measured on, so they do not depend on face size
+QUALITY_PATCH_SIZE = 112
 
-def check_face_quality(image):
-    """Check face quality and pose"""
-    model = face_model.get_model()
-    faces = model.get(image)
-    if faces:
-        face = faces[0]
-        # Basic quality checks
-        return True, "Good quality"
-    return False, "No face detected"
\ No newline at end of file
+# Nose height between the eye line and the mouth line on a frontal face (ArcFace template landmarks)
+FRONTAL_NOSE_RATIO = 0.495
+
+def validate_single_face(faces: List[Face]) -> Tuple[bool, str]:
+    """Ensure exactly one face was detected"""
+    if len(faces) == 0:
+        return False, "No face detected in image"
+    if len(faces) > 1:
+        return False, "Multiple faces detected. Please ensure only one face is visible"
+    return True, "Single face detected"
+
+def estimate_pose(kps: np.ndarray) -> Tuple[float, float]:
+    """Approximate (yaw, pitch) in degrees from the 5 landmarks: eyes, nose, mouth corners
+    
+    Roll is removed first by rotating the points so the eyes are level. Yaw
+    is the nose offset from the face midline relative to half the eye
+    distance, pitch the nose height between the eye and mouth lines relative
+    to a frontal face.
+    """
+    left_eye, right_eye, nose, mouth_left, mouth_right = np.asarray(kps, dtype=np.float64)
+    eye_vector = right_eye - left_eye
+    roll = np.arctan2(eye_vector[1], eye_vector[0])
+    rotation = np.array([[np.cos(-roll), -np.sin(-roll)], [np.sin(-roll), np.cos(-roll)]])
+    left_eye, right_eye, nose, mouth_left, mouth_right = (rotation @ np.stack([left_eye, right_eye, nose, mouth_left, mouth_right]).T).T
+    
+    eye_center, mouth_center = (left_eye + right_eye) / 2, (mouth_left + mouth_right) / 2
+    half_eye_distance = max(np.linalg.norm(right_eye - left_eye) / 2, 1e-6)
+    midline_x = (eye_center[0] + mouth_center[0]) / 2
+    yaw = np.degrees(np.arcsin(np.clip((nose[0] - midline_x) / half_eye_distance, -1.0, 1.0)))
+    face_height = max(mouth_center[1] - eye_center[1], 1e-6)
+    nose_ratio = (nose[1] - eye_center[1]) / face_height
+    pitch = np.degrees(np.arcsin(np.clip((nose_ratio - FRONTAL_NOSE_RATIO) * 2, -1.0, 1.0)))
+    return float(yaw), float(pitch)
+
+def face_quality_metrics(image: np.ndarray, face: Face) -> dict:
+    """Cheap quality metrics of one detected face, without running the recognition model
+    
+    Returns:
+        face_size (shortest box side in image pixels), det_score, blur
+        (Laplacian variance, higher is sharper), brightness (mean 0-255),
+        yaw and pitch (approximate degrees)
+    """
+    height, width = image.shape[:2]
+    x1, y1, x2, y2 = face.bbox
+    left, top = max(int(x1), 0), max(int(y1), 0)
+    right, bottom = min(int(np.ceil(x2)), width), min(int(np.ceil(y2)), height)
+    metrics = {
+        "face_size": round(float(min(x2 - x1, y2 - y1)), 1),
+        "det_score": round(float(face.det_score), 3),
+    }
+    if right > left and bottom > top:
+        patch = cv2.resize(
+            cv2.cvtColor(image[top:bottom, left:right], cv2.COLOR_RGB2GRAY),
+            (QUALITY_PATCH_SIZE, QUALITY_PATCH_SIZE), interpolation=cv2.INTER_AREA
+        )
+        metrics["blur"] = round(float(cv2.Laplacian(patch, cv2.CV_64F).var()), 1)
+        metrics["brightness"] = round(float(patch.mean()), 1)
+    if face.kps is not None:
+        metrics["yaw"], metrics["pitch"] = (round(angle, 1) for angle in estimate_pose(face.kps))
+    return metrics
+
+def check_face_quality(image: np.ndarray, face: Face) -> Tuple[bool, str, dict]:
+    """Decide whether a detected face is worth running recognition on
+    
+    Returns:
+        Tuple[acceptable, message, metrics]
+    """
+    metrics = face_quality_metrics(image, face)
+    if not settings.quality_check_enabled:
+        return True, "Quality check disabled", metrics
+    if metrics["face_size"] < settings.quality_min_face_size:
+        return False, "Face too small. Please move closer to the camera", metrics
+    if metrics["det_score"] < settings.quality_min_det_score:
+        return False, "Face not clearly visible. Please face the camera", metrics
+    if "brightness" in metrics and metrics["brightness"] < settings.quality_min_brightness:
+        return False, "Image too dark. Please improve the lighting", metrics
+    if "brightness" in metrics and metrics["brightness"] > settings.quality_max_brightness:
+        return False, "Image overexposed. Please reduce the lighting", metrics
+    if "blur" in metrics and metrics["blur"] < settings.quality_min_blur:
+        return False, "Image too blurry. Please hold still", metrics
+    if abs(metrics.get("yaw", 0.0)) > settings.quality_max_yaw or abs(metrics.get("pitch", 0.0)) > settings.quality_max_pitch:
+        return False, "Face turned away. Please look straight at the camera", metrics
+    return True, "Good quality", metrics
@@ -8,6 +8,7 @@ from ..db.base import get_db
 from ..services.attendance_service import AttendanceService
 from ..services.class_service import ClassService
 from ..schemas.attendance import AttendanceResponse, AttendanceWithDetails, AttendanceSummary
+from ..utils.photo_utils import thumbnail_path
 
 router = APIRouter(prefix="/attendance", tags=["attendance"])
 attendance_service = AttendanceService()
@@ -62,6 +63,7 @@ async def get_attendance_today(
         if attendance.student:
             attendance_dict["student_name"] = attendance.student.full_name
             attendance_dict["student_student_id"] = attendance.student.student_id
+            attendance_dict["student_thumbnail_path"] = thumbnail_path(attendance.student.photo_path)
         if attendance.class_obj:
             attendance_dict["class_name"] = attendance.class_obj.class_name
         result.append(attendance_dict)
@@ -89,6 +91,7 @@ async def get_attendance_by_class(
         if attendance.student:
             attendance_dict["student_name"] = attendance.student.full_name
             attendance_dict["student_student_id"] = attendance.student.student_id
+            attendance_dict["student_thumbnail_path"] = thumbnail_path(attendance.student.photo_path)
         if attendance.class_obj:
             attendance_dict["class_name"] = attendance.class_obj.class_name
         result.append(attendance_dict)
@@ -6,8 +6,10 @@ from pydantic import BaseModel
 from ..core.security import require_admin, require_teacher
 from ..db.base import get_db
 from ..db import crud
+from ..services.class_service import ClassService
 
 router = APIRouter(prefix="/classes", tags=["classes"])
+class_service = ClassService()
 
 # Simple schemas
 class SimpleClassCreate(BaseModel):
@@ -165,7 +167,7 @@ async def delete_class(
 ):
     """Delete a class"""
     try:
-        result = crud.delete_class(db, class_id)
+        result = await class_service.delete_class(class_id, db)
         return {"success": result}
     except Exception as e:
         return {"success": False, "error": str(e)}
\ No newline at end of file
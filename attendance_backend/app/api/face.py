@@ -1,27 +1,45 @@
 """Face registration and verification endpoints"""
-from fastapi import APIRouter, UploadFile, File, HTTPException, status, Depends, Form
-from typing import Optional
+from fastapi import APIRouter, UploadFile, File, HTTPException, status, Depends, Form, Query, WebSocket, WebSocketDisconnect
+from typing import Optional, List
 from sqlalchemy.orm import Session
-from ..core.security import require_teacher
-from ..db.base import get_db
-from ..services.face_service import FaceService
+import asyncio
+import time
+import zipfile
+from ..core.security import require_teacher, require_admin, decode_access_token
+from ..core.executor import face_executor
+from ..db import crud
+from ..db.base import get_db, SessionLocal
+from ..ai.insightface_model import face_model
+from ..ai.embedding_cache import embedding_cache
+from ..ai.gallery import face_gallery
+from ..ai.tracker import FaceTracker
+from ..services.face_service import FaceService, ensure_face_gallery, mark_attendance_bulk
+from ..services.enrollment_service import EnrollmentService
+from ..services.audit_service import AuditService
+from ..services.reembedding_service import reembedding_job
 from ..services.class_service import ClassService
-from ..services.attendance_service import AttendanceService
-from ..schemas.face import FaceRegisterResponse, FaceVerifyResponse
+from ..core.config import settings
+from ..utils.archive_utils import zip_entries
+from ..schemas.face import (
+    FaceRegisterResponse, FaceVerifyResponse, FaceGroupVerifyResponse, GroupFaceResult, FaceBulkEnrollResponse,
+    FaceDuplicateAuditResponse
+)
 
 router = APIRouter(prefix="/face", tags=["face"])
 face_service = FaceService()
+enrollment_service = EnrollmentService()
+audit_service = AuditService()
 class_service = ClassService()
-attendance_service = AttendanceService()
 
 @router.post("/register", response_model=FaceRegisterResponse)
 async def register_face(
     student_id: int = Form(...),
+    replace: bool = Form(False),
     file: UploadFile = File(...),
     db: Session = Depends(get_db),
     current_user: dict = Depends(require_teacher)
 ):
-    """Register a face for a student"""
+    """Register a face for a student (adds a template; replace=true drops the existing ones)"""
     # Validate file type - be lenient since camera captures may not have proper MIME type
     allowed_extensions = ['.jpg', '.jpeg', '.png', '.webp']
     is_image_type = file.content_type and file.content_type.startswith('image/')
@@ -39,7 +57,7 @@ async def register_face(
         image_data = await file.read()
         
         # Register face
-        success, message = await face_service.register_face(image_data, student_id, db)
+        success, message = await face_service.register_face(image_data, student_id, db, replace)
         
         return FaceRegisterResponse(
             success=success,
@@ -53,6 +71,38 @@ async def register_face(
             detail=f"Error processing face registration: {str(e)}"
         )
 
+@router.post("/register-bulk", response_model=FaceBulkEnrollResponse)
+async def register_faces_bulk(
+    replace: bool = Form(False),
+    file: UploadFile = File(...),
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(require_admin)
+):
+    """Enroll a ZIP of student photos named by student ID (STU001.jpg, STU001_2.jpg, ...)"""
+    # The upload is spooled to disk; members are read one at a time while embedding
+    if not zipfile.is_zipfile(file.file):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="File must be a ZIP archive")
+    
+    try:
+        with zipfile.ZipFile(file.file) as archive:
+            success, message, report = await enrollment_service.enroll_bulk(zip_entries(archive), db, replace)
+    except zipfile.BadZipFile as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid ZIP archive: {str(e)}")
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error processing bulk enrollment: {str(e)}"
+        )
+    
+    return FaceBulkEnrollResponse(
+        success=success,
+        message=message,
+        enrolled=sum(1 for entry in report if entry["status"] == "enrolled"),
+        duplicates=sum(1 for entry in report if entry["status"] == "duplicate"),
+        failed=sum(1 for entry in report if entry["status"] not in ("enrolled", "duplicate")),
+        files=report
+    )
+
 @router.post("/verify", response_model=FaceVerifyResponse)
 async def verify_face(
     class_id: Optional[int] = Form(None),
@@ -84,54 +134,256 @@ async def verify_face(
         # Read image data
         image_data = await file.read()
         
-        # Verify face
-        success, message, student_id, confidence_score = await face_service.verify_face(image_data, db, class_id)
-        
-        attendance_marked = False
-        student_name = None
-        photo_path = None
-        target_class_id = None
+        # Verify face, then look up the student and mark attendance, all on the face executor
+        success, message, details = await face_service.verify_face(image_data, db, class_id, auto_mark)
+        return FaceVerifyResponse(success=success, message=message, **details)
         
-        if success and student_id:
-            from ..db import crud
-            student = crud.get_student_by_id(db, student_id)
-            if student:
-                student_name = student.full_name
-                photo_path = student.photo_path
-                
-                # Determine class_id if not provided
-                target_class_id = class_id if class_id else student.class_id
-                
-                # Check status
-                is_marked = crud.check_attendance_exists(db, student_id, target_class_id)
-                attendance_marked = is_marked
-                
-                if auto_mark and not is_marked:
-                    try:
-                        # Mark attendance
-                        await attendance_service.mark_attendance(student_id, target_class_id, confidence_score, db)
-                        attendance_marked = True
-                        message += " (Attendance marked)"
-                    except ValueError as e:
-                         # Should not happen given check above, but safe to catch
-                         pass
-                elif is_marked:
-                    message = f"Face recognized: {student_name} (Already present)"
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error processing face verification: {str(e)}"
+        )
 
+@router.post("/verify-group", response_model=FaceGroupVerifyResponse)
+async def verify_group(
+    class_id: int = Form(...),
+    auto_mark: bool = Form(True),
+    files: List[UploadFile] = File(...),
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(require_teacher)
+):
+    """Recognize every student in one or a few classroom photos and mark attendance in bulk"""
+    has_access = await class_service.check_teacher_access(class_id, current_user["user_id"], db)
+    if not has_access:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied to this class")
+    
+    if len(files) > settings.group_max_photos:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {settings.group_max_photos} photos per request"
+        )
+    
+    allowed_extensions = ['.jpg', '.jpeg', '.png', '.webp']
+    for file in files:
+        is_image_type = file.content_type and file.content_type.startswith('image/')
+        has_image_ext = any(file.filename.lower().endswith(ext) for ext in allowed_extensions) if file.filename else False
+        is_octet_stream = file.content_type == 'application/octet-stream'
+        if not (is_image_type or has_image_ext or is_octet_stream):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"File must be an image. Got: {file.content_type}, filename: {file.filename}"
+            )
+    
+    try:
+        images_data = [await file.read() for file in files]
+        success, message, faces = await face_service.verify_group(images_data, class_id, db, auto_mark)
         
-        return FaceVerifyResponse(
+        results = [GroupFaceResult(**face) for face in faces]
+        return FaceGroupVerifyResponse(
             success=success,
             message=message,
-            student_id=student_id,
-            student_name=student_name,
-            confidence_score=confidence_score,
-            attendance_marked=attendance_marked,
-            photo_path=photo_path,
-            class_id=target_class_id
+            class_id=class_id,
+            faces_detected=len(results),
+            students_recognized=sum(1 for face in results if face.student_id is not None),
+            attendance_marked=sum(1 for face in results if face.attendance_marked and not face.already_present),
+            faces=results
         )
-        
+    
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Error processing face verification: {str(e)}"
-        )
\ No newline at end of file
+            detail=f"Error processing group verification: {str(e)}"
+        )
+
+@router.websocket("/stream")
+async def recognition_stream(
+    websocket: WebSocket,
+    class_id: int,
+    token: Optional[str] = None,
+    auto_mark: bool = False
+):
+    """Continuous recognition for kiosks: binary JPEG frames in, JSON events out
+    
+    The token (query param) and class access are checked once, and the class
+    gallery is pinned for the connection. Faces are tracked across frames and
+    a recognized track keeps its identity without re-embedding until it is
+    refreshed. Only the newest frame is processed:
+    frames arriving while one is being recognized replace each other and are
+    counted as dropped, so latency never builds up.
+    """
+    current_user = decode_access_token(token)
+    if current_user is None or current_user["role"] not in ["admin", "teacher"]:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    
+    db = SessionLocal()
+    try:
+        has_access = await class_service.check_teacher_access(class_id, current_user["user_id"], db)
+        if has_access:
+            ensure_face_gallery(db)
+            student_names = {student.id: student.full_name for student in crud.get_students(db, class_id=class_id)}
+            present = {record.student_id for record in crud.get_attendance_today(db, class_id=class_id)}
+    finally:
+        db.close()
+    if not has_access:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    
+    await websocket.accept()
+    gallery_matrix, student_ids = face_gallery.snapshot(class_id)
+    await websocket.send_json({"type": "ready", "class_id": class_id, "enrolled": len(student_ids)})
+    
+    tracker = FaceTracker(
+        iou_threshold=settings.tracker_iou_threshold,
+        max_missed=settings.tracker_max_missed,
+        refresh_s=settings.tracker_refresh_s,
+        retry_s=settings.tracker_retry_s
+    )
+    latest = {"frame": None, "received": 0, "dropped": 0}
+    frame_ready = asyncio.Event()
+    
+    async def process_frames():
+        while True:
+            await frame_ready.wait()
+            frame_ready.clear()
+            frame, latest["frame"] = latest["frame"], None
+            frame_number = latest["received"]
+            started = time.perf_counter()
+            
+            success, message, faces = await face_executor.run(face_service.recognize_frame, frame, gallery_matrix, student_ids, tracker)
+            
+            to_mark = []
+            for face in faces:
+                student_id = face.get("student_id")
+                if student_id not in student_names:
+                    face["student_id"] = None
+                    continue
+                face["student_name"] = student_names[student_id]
+                face["already_present"] = student_id in present
+                if auto_mark and not face["already_present"]:
+                    to_mark.append((student_id, class_id, face["confidence_score"]))
+                    present.add(student_id)
+                face["attendance_marked"] = student_id in present
+            if to_mark:
+                # Students marked elsewhere since the connection opened are skipped by the insert
+                newly_marked = set(await face_executor.run(mark_attendance_bulk, to_mark))
+                for face in faces:
+                    if face.get("student_id") in present and not face["already_present"] and face["student_id"] not in newly_marked:
+                        face["already_present"] = True
+            
+            await websocket.send_json({
+                "type": "result",
+                "success": success,
+                "message": message,
+                "frame": frame_number,
+                "faces": faces,
+                "dropped": latest["dropped"],
+                "latency_ms": round((time.perf_counter() - started) * 1000, 1)
+            })
+    
+    processor = asyncio.create_task(process_frames())
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect" or processor.done():
+                break
+            frame = message.get("bytes")
+            if frame is None:
+                # Text messages are ignored, frames are binary
+                continue
+            if len(frame) > settings.stream_max_frame_bytes:
+                await websocket.send_json({"type": "error", "message": "Frame too large"})
+                continue
+            latest["received"] += 1
+            if latest["frame"] is not None:
+                latest["dropped"] += 1
+            latest["frame"] = frame
+            frame_ready.set()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        processor.cancel()
+    
+    # The processor stopped on its own (e.g. a failed send): surface the error and close
+    if processor.done() and not processor.cancelled() and processor.exception() is not None:
+        print(f"❌ ERROR in recognition stream: {processor.exception()}")
+        await websocket.close(code=status.WS_1011_INTERNAL_ERROR)
+
+@router.get("/stats")
+async def get_pipeline_stats(
+    current_user: dict = Depends(require_admin)
+):
+    """Face pipeline statistics: gallery size, batching histograms, session pool, latency, embedding cache and model startup report"""
+    return {
+        "gallery_size": len(face_gallery),
+        "gallery_students": face_gallery.student_count,
+        "recognition_batching": face_model.get_batcher().stats(),
+        "session_pool": face_model.get_pool().stats(),
+        "latency": {task: window.stats() for task, window in face_model.latency.items()},
+        "embedding_cache": embedding_cache.stats(),
+        "model": face_model.startup_report
+    }
+
+@router.get("/duplicates", response_model=FaceDuplicateAuditResponse)
+async def audit_duplicate_identities(
+    threshold: Optional[float] = Query(None, description="Similarity threshold, default FACE_SIMILARITY_THRESHOLD"),
+    full: bool = Query(False, description="Compare every pair again instead of only changed students"),
+    limit: int = Query(500, description="Most similar pairs returned"),
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(require_admin)
+):
+    """Pairs of students whose registered faces match each other (twins, re-enrollments under a new ID, mix-ups)"""
+    try:
+        pairs, summary = await audit_service.audit_duplicate_identities(db, threshold, full, limit)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error auditing duplicate identities: {str(e)}"
+        )
+    
+    return FaceDuplicateAuditResponse(
+        success=True,
+        message=f"Found {summary['duplicate_pairs']} pair(s) of students with matching faces",
+        mode=summary["mode"],
+        students=summary["students"],
+        compared_students=summary["compared_students"],
+        threshold=summary["threshold"],
+        seconds=summary["seconds"],
+        pairs=pairs
+    )
+
+@router.post("/reembed")
+async def start_reembedding(
+    target_pack: str = Form(...),
+    force: bool = Form(False),
+    current_user: dict = Depends(require_admin)
+):
+    """Re-compute every face template with the recognizer of another model pack in the background
+    
+    Matching keeps using the current templates until the job completes, then
+    switches to the new recognizer and templates at once. Posting the same
+    pack again resumes a stopped or failed job. If some students could not be
+    re-embedded the job ends "incomplete" without switching; force=true
+    switches anyway.
+    """
+    success, message = reembedding_job.start(target_pack, force)
+    if not success:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=message)
+    return {"success": True, "message": message}
+
+@router.get("/reembed")
+async def get_reembedding_status(
+    current_user: dict = Depends(require_admin)
+):
+    """Re-embedding job progress, throughput and ETA"""
+    return reembedding_job.status()
+
+@router.delete("/reembed")
+async def stop_reembedding(
+    current_user: dict = Depends(require_admin)
+):
+    """Stop the re-embedding job after its current batch"""
+    if not reembedding_job.running:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="No re-embedding job is running")
+    reembedding_job.stop()
+    return {"success": True, "message": "Re-embedding job stopping after the current batch"}
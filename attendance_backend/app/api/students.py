@@ -6,6 +6,7 @@ from ..core.security import require_teacher
 from ..db.base import get_db
 from ..services.student_service import StudentService
 from ..services.class_service import ClassService
+from ..utils.photo_utils import thumbnail_path
 from ..schemas.student import StudentCreate, StudentUpdate, StudentResponse, StudentWithClass
 
 router = APIRouter(prefix="/students", tags=["students"])
@@ -80,6 +81,7 @@ async def get_students(
                 "class_id": student.class_id,
                 "face_enrolled": student.face_enrolled,
                 "photo_path": student.photo_path,
+                "thumbnail_path": thumbnail_path(student.photo_path),
                 "class_name": student.class_obj.class_name if student.class_obj else None
             })
         
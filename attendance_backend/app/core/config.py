@@ -14,6 +14,102 @@ class Settings(BaseSettings):
     # Face Recognition
     face_similarity_threshold: float = 0.6
     insightface_model_name: str = "buffalo_l"
+    insightface_allowed_modules: str = "detection,recognition"  # Comma-separated, empty = every module in the pack
+    insightface_detector_pack: str = ""  # e.g. buffalo_s for kiosks, empty = insightface_model_name
+    insightface_recognizer_pack: str = ""  # Empty = insightface_model_name
+    insightface_int8: bool = False  # Use the <pack>_int8 models produced by quantize_models.py
+    insightface_startup_report: bool = True  # Log memory and per-module latency after loading
+    insightface_stub_model: bool = False  # Serve the deterministic stub model (app/ai/stub_model.py) instead of the weights, for load tests only
+    insightface_stub_detection_ms: float = 0.0  # Simulated inference time of the stub detector per image
+    insightface_stub_recognition_ms: float = 0.0  # Simulated inference time of the stub recognizer per face
+    embedding_storage_dtype: str = "float32"  # float32 or float16 (half the size)
+    
+    # ONNX Runtime sessions
+    onnx_intra_op_threads: int = 0  # Threads across the session pool, 0 = CPUs available to the container
+    onnx_inter_op_threads: int = 1  # Only used by the parallel execution mode
+    onnx_execution_mode: str = "sequential"  # sequential or parallel (only helps branchy graphs)
+    onnx_graph_optimization_level: str = "all"  # disable, basic, extended or all
+    onnx_cpu_mem_arena: bool = True  # Faster allocations; the arena keeps its peak size
+    onnx_mem_pattern: bool = True  # Pre-plan allocations per input shape
+    onnx_session_pool_size: int = 1  # Model copies running inferences in parallel, each with 1/N of the threads and its own weights in memory
+    onnx_optimized_model_dir: str = "~/.insightface/optimized"  # Optimized graphs reused across starts, empty = optimize at every start
+    
+    # Approximate nearest-neighbour index (school-wide verify without class_id)
+    ann_enabled: bool = True
+    ann_min_gallery_size: int = 5000  # Exhaustive search below this many students
+    ann_nlist: int = 0  # Coarse clusters, 0 = about sqrt(gallery size)
+    ann_nprobe: int = 8  # Clusters scanned per query: higher = better recall, slower
+    ann_retrain_growth: float = 2.0  # Retrain once the gallery grows by this factor
+    ann_index_path: str = "data/ann_index.npz"
+    
+    # Duplicate identity audit (GET /face/duplicates and audit_duplicates.py)
+    duplicate_audit_path: str = "data/duplicate_audit.npz"  # Last audit, so later runs only compare changed students
+    
+    # Adaptive detection: try each detector input size in turn, escalating on no or tiny faces
+    detection_sizes: str = "320,640"  # Enrollment and verify close-ups, multiples of 32
+    detection_min_face_size: int = 40  # Smallest face (px at detector resolution) accepted without escalating
+    image_decode_max_size: int = 1280  # Larger JPEGs are decoded at 1/2, 1/4 or 1/8 scale, never below this
+    
+    # Face quality gate before recognition (enrollment and verify), measured on the detection
+    quality_check_enabled: bool = True
+    quality_min_face_size: int = 48  # Shortest side of the face box in image pixels
+    quality_min_det_score: float = 0.6
+    quality_min_blur: float = 25.0  # Laplacian variance of the 112x112 face patch, lower is blurrier
+    quality_min_brightness: float = 40.0  # Mean gray level of the face patch, 0-255
+    quality_max_brightness: float = 220.0
+    quality_max_yaw: float = 45.0  # Approximate degrees from the 5 landmarks
+    quality_max_pitch: float = 40.0
+    
+    # Student photos, written in the background after a successful enrollment
+    photo_max_size: int = 1024  # Longest side of the stored photo
+    photo_jpeg_quality: int = 85
+    
+    # Face templates: several embeddings per student
+    max_templates_per_student: int = 5  # Older auto-added templates are pruned first
+    template_scoring: str = "max"  # max (best template) or centroid (mean template)
+    template_auto_add: bool = True  # Add templates from confident verifies
+    template_auto_add_threshold: float = 0.7  # Minimum verify similarity to learn from
+    template_redundancy_threshold: float = 0.9  # Skip probes this close to an existing template
+    
+    # Embedding cache for retried uploads
+    embedding_cache_size: int = 256
+    embedding_cache_ttl_s: float = 300.0
+    embedding_cache_perceptual: bool = False  # Also match re-encodes by image hash; whole-frame hash, unsafe for shared kiosk backgrounds
+    
+    # Recognition micro-batching across concurrent requests
+    recognition_max_batch_size: int = 16
+    recognition_max_wait_ms: float = 5.0
+    
+    # Group photo roll call
+    group_max_photos: int = 5
+    group_detection_sizes: str = "640,1280"  # Distant faces escalate to the larger size
+    group_image_decode_max_size: int = 2560  # Keep more pixels for distant faces
+    
+    # Bulk enrollment (POST /face/register-bulk and bulk_enroll.py)
+    bulk_enroll_max_files: int = 5000
+    bulk_enroll_max_file_bytes: int = 15_000_000
+    bulk_enroll_workers: int = 0  # Photos decoded and embedded at once on the face executor, 0 = its worker count
+    
+    # Re-embedding job for recognizer upgrades (POST /face/reembed and reembed_faces.py)
+    reembed_batch_size: int = 64  # Student photos decoded and embedded per batch and transaction
+    reembed_workers: int = 0  # Photos decoded and detected at once, 0 = CPUs available to the container
+    reembed_state_path: str = "data/reembed_job.json"  # Progress and the completed switch, kept across restarts
+    
+    # Live camera stream (WebSocket /face/stream)
+    stream_max_frame_bytes: int = 2_000_000
+    tracker_iou_threshold: float = 0.3  # Box overlap that continues a track in the next frame
+    tracker_max_missed: int = 5  # Frames a track survives without a detection
+    tracker_refresh_s: float = 3.0  # Re-recognize identified tracks this often
+    tracker_retry_s: float = 0.5  # Retry unmatched faces this often
+    
+    # Face pipeline executor (decode, inference and DB work off the event loop)
+    face_executor_workers: int = 0  # 0 = CPUs available to the container
+    face_max_concurrency: int = 0  # Face requests in the pipeline at once, 0 = 2x workers
+    
+    # Warm-up and readiness (/ready)
+    insightface_warmup_runs: int = 2  # Synthetic inferences per detection size and batch shape at startup, 0 = off
+    ready_max_waiting_requests: int = 8  # Face requests queued for a pipeline slot before /ready reports saturated
+    ready_max_p95_ms: float = 0  # Recent detection or recognition p95 above this reports not ready, 0 = off
     
     # App
     app_name: str = "Face Recognition Attendance System"
@@ -22,6 +118,11 @@ class Settings(BaseSettings):
     # Cloudinary (optional)
     cloudinary_url: Optional[str] = None
     
+    @property
+    def recognition_model_name(self) -> str:
+        """Pack whose recognition model produces the stored embeddings"""
+        return self.insightface_recognizer_pack or self.insightface_model_name
+    
     class Config:
         env_file = ".env"
 
@@ -0,0 +1,95 @@
+"""Bounded executor for blocking face pipeline work"""
+import asyncio
+import functools
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from .config import settings
+
+def available_cpus() -> int:
+    """CPUs this process may use: affinity mask capped by the container CPU quota
+    
+    os.cpu_count() reports the host, so on a 1-vCPU container slice of a
+    64-core VM thread pools sized from it oversubscribe the quota.
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    quota = period = None
+    try:
+        # cgroup v2: "<quota> <period>", quota "max" when unlimited
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()[:2]
+    except (OSError, ValueError):
+        try:
+            # cgroup v1: quota -1 when unlimited
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f, open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as g:
+                quota, period = f.read().strip(), g.read().strip()
+        except OSError:
+            pass
+    if quota not in (None, "max", "-1"):
+        cpus = min(cpus, max(1, int(quota) // int(period)))
+    return cpus
+
+class FaceExecutor:
+    """Run image decoding, inference and their DB calls off the event loop.
+    
+    Work runs on a dedicated thread pool (NumPy, OpenCV and ONNX Runtime
+    release the GIL), and an asyncio semaphore caps how many face requests
+    are in the pipeline at once; the rest wait on the loop without holding
+    a thread, so /health, login and dashboard requests stay responsive.
+    """
+    
+    def __init__(self, workers: int = 0, max_concurrency: int = 0):
+        self.workers = workers or available_cpus()
+        self.max_concurrency = max_concurrency or self.workers * 2
+        self._pool = None
+        self._semaphore = None
+        self._background_pool = None
+        self.in_flight = 0
+    
+    def _get_pool(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="face-worker")
+        return self._pool
+    
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # Created lazily so it binds to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+    
+    async def run(self, fn, *args, **kwargs):
+        """Run a blocking function on the face pool, respecting the concurrency limit"""
+        # Only touched on the event loop thread, so no lock is needed
+        self.in_flight += 1
+        try:
+            async with self._get_semaphore():
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self._get_pool(), functools.partial(fn, *args, **kwargs))
+        finally:
+            self.in_flight -= 1
+    
+    @property
+    def waiting(self) -> int:
+        """Face requests queued for a pipeline slot"""
+        return max(0, self.in_flight - self.max_concurrency)
+    
+    def submit_background(self, fn, *args, **kwargs) -> Future:
+        """Run fire-and-forget work (e.g. photo writes) after the response, one task at a time"""
+        if self._background_pool is None:
+            self._background_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="face-background")
+        return self._background_pool.submit(fn, *args, **kwargs)
+    
+    def shutdown(self):
+        """Wait for running and background work and release the threads"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+        if self._background_pool is not None:
+            self._background_pool.shutdown(wait=True)
+            self._background_pool = None
+        self._semaphore = None
+
+# Global singleton instance
+face_executor = FaceExecutor(settings.face_executor_workers, settings.face_max_concurrency)
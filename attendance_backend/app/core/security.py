@@ -51,6 +51,24 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
     except JWTError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
 
+def decode_access_token(token: Optional[str]) -> Optional[dict]:
+    """Decode a token passed outside the Authorization header (e.g. a WebSocket query param)"""
+    # 🔧 DEV MODE: Skip authentication
+    if DEV_MODE:
+        return {"user_id": 1, "role": "admin"}
+    
+    if not token:
+        return None
+    
+    try:
+        payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
+    except JWTError:
+        return None
+    user_id = payload.get("sub")
+    if user_id is None:
+        return None
+    return {"user_id": int(user_id), "role": payload.get("role")}
+
 def require_admin(current_user: dict = Depends(verify_token)):
     # 🔧 DEV MODE: Always return admin
     if DEV_MODE:
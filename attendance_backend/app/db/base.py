@@ -1,5 +1,6 @@
 """Database connection setup"""
-from sqlalchemy import create_engine
+from typing import List
+from sqlalchemy import create_engine, inspect
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from ..core.config import settings
@@ -8,6 +9,44 @@ engine = create_engine(settings.database_url)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# Script that upgrades a database created before each column existed, in the order to run them
+COLUMN_MIGRATIONS = {
+    ("teachers", "status"): "migrate_add_status.py",
+    ("face_embeddings", "embedding_blob"): "migrate_embedding_blob.py",
+    ("face_embeddings", "source"): "migrate_face_templates.py",
+}
+
+def missing_columns(bind=None) -> List[str]:
+    """Columns of the models absent from existing tables, as "table.column"
+    
+    create_all() only creates missing tables, so a database from an older
+    version keeps its old columns and the first query on a new one fails.
+    """
+    from . import models  # noqa: F401 - registers the tables on Base.metadata
+    inspector = inspect(bind if bind is not None else engine)
+    tables = set(inspector.get_table_names())
+    missing = []
+    for table in Base.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        missing.extend(f"{table.name}.{column.name}" for column in table.columns if column.name not in existing)
+    return missing
+
+def check_schema(bind=None):
+    """Fail with the migration scripts to run when the database predates the models"""
+    missing = missing_columns(bind)
+    if not missing:
+        return
+    scripts = [script for (table, column), script in COLUMN_MIGRATIONS.items() if f"{table}.{column}" in missing]
+    unknown = [name for name in missing if tuple(name.split(".", 1)) not in COLUMN_MIGRATIONS]
+    message = f"Database schema is out of date, missing column(s): {', '.join(missing)}."
+    if scripts:
+        message += f" Run {', then '.join(f'python {script}' for script in scripts)} and restart."
+    if unknown:
+        message += f" No migration script adds {', '.join(unknown)}."
+    raise RuntimeError(message)
+
 def get_db():
     db = SessionLocal()
     try:
@@ -1,5 +1,5 @@
 """Database CRUD operations"""
-from typing import List, Optional
+from typing import Callable, List, Optional, Tuple
 from sqlalchemy.orm import Session
 from sqlalchemy import and_, func, Date
 from datetime import datetime, date
@@ -67,6 +67,24 @@ def get_student_by_id(db: Session, student_id: int) -> Optional[models.Student]:
 def get_student_by_student_id(db: Session, student_id: str) -> Optional[models.Student]:
     return db.query(models.Student).filter(models.Student.student_id == student_id).first()
 
+def get_students_by_student_ids(db: Session, student_ids: List[str]) -> List[models.Student]:
+    """Students by school student ID, queried in chunks to stay under SQLite's parameter limit"""
+    student_ids = list(set(student_ids))
+    students = []
+    for start in range(0, len(student_ids), 500):
+        chunk = student_ids[start:start + 500]
+        students.extend(db.query(models.Student).filter(models.Student.student_id.in_(chunk)).all())
+    return students
+
+def get_students_with_classes(db: Session, ids: List[int]) -> List[Tuple[models.Student, models.Class]]:
+    """(student, class) pairs by primary key, queried in chunks to stay under SQLite's parameter limit"""
+    ids = list(set(ids))
+    rows = []
+    for start in range(0, len(ids), 500):
+        chunk = ids[start:start + 500]
+        rows.extend(db.query(models.Student, models.Class).join(models.Class).filter(models.Student.id.in_(chunk)).all())
+    return rows
+
 def get_students(db: Session, class_id: Optional[int] = None) -> List[models.Student]:
     query = db.query(models.Student)
     if class_id:
@@ -151,19 +169,111 @@ def delete_class(db: Session, class_id: int) -> bool:
     return False
 
 # Face Embedding CRUD
-def create_face_embedding(db: Session, student_id: int, embedding: str) -> models.FaceEmbedding:
-    # Delete existing embedding if any
-    db.query(models.FaceEmbedding).filter(models.FaceEmbedding.student_id == student_id).delete()
+def create_face_embedding(db: Session, student_id: int, embedding_blob: bytes, source: str = "enrollment", replace: bool = False) -> models.FaceEmbedding:
+    """Add a face template for a student, optionally replacing all existing ones"""
+    if replace:
+        db.query(models.FaceEmbedding).filter(models.FaceEmbedding.student_id == student_id).delete()
     
     db_embedding = models.FaceEmbedding(
         student_id=student_id,
-        embedding=embedding
+        embedding_blob=embedding_blob,
+        source=source
     )
     db.add(db_embedding)
     db.commit()
     db.refresh(db_embedding)
     return db_embedding
 
+def get_face_embeddings(db: Session, student_id: int) -> List[models.FaceEmbedding]:
+    """All face templates of a student, oldest first"""
+    return db.query(models.FaceEmbedding).filter(
+        models.FaceEmbedding.student_id == student_id
+    ).order_by(models.FaceEmbedding.created_at, models.FaceEmbedding.id).all()
+
+def prune_face_embeddings(db: Session, student_id: int, max_templates: int, commit: bool = True,
+                          counted: Optional[Callable[[Optional[bytes]], bool]] = None) -> int:
+    """Keep at most max_templates per student
+    
+    Auto-added (verify) templates go first, oldest first, then the oldest
+    enrollments; the newest enrollment is dropped last. With `counted`, only
+    templates whose embedding_blob it accepts count and can be dropped (the
+    services pass the serving-recognizer check, leaving a re-embedding job's
+    rows alone).
+    """
+    templates = [template for template in get_face_embeddings(db, student_id) if counted is None or counted(template.embedding_blob)]
+    excess = len(templates) - max_templates
+    if excess <= 0:
+        return 0
+    # Stable sort keeps oldest-first order within each source
+    victims = sorted(templates, key=lambda template: template.source == "enrollment")[:excess]
+    for template in victims:
+        db.delete(template)
+    if commit:
+        db.commit()
+    return excess
+
+def enroll_face_templates_bulk(db: Session, templates: List[Tuple[int, bytes]], photo_paths: dict,
+                               replace: bool = False, max_templates: int = None,
+                               counted: Optional[Callable[[Optional[bytes]], bool]] = None) -> dict:
+    """Add enrollment templates for many students and mark them enrolled in one transaction
+    
+    Args:
+        templates: (student_id, embedding_blob) pairs; a student may have several
+        photo_paths: student_id -> new profile photo path
+        replace: Drop the existing templates of these students first
+        max_templates: Prune each student to this many templates
+        counted: Which templates count towards max_templates, see prune_face_embeddings
+    
+    Returns:
+        student_id -> previous photo path, for photos that were replaced
+    """
+    student_ids = list({student_id for student_id, _ in templates})
+    try:
+        if replace:
+            db.query(models.FaceEmbedding).filter(
+                models.FaceEmbedding.student_id.in_(student_ids)
+            ).delete(synchronize_session=False)
+        db.add_all([
+            models.FaceEmbedding(student_id=student_id, embedding_blob=blob, source="enrollment")
+            for student_id, blob in templates
+        ])
+        db.flush()
+        
+        previous_photos = {}
+        for student in db.query(models.Student).filter(models.Student.id.in_(student_ids)).all():
+            student.face_enrolled = True
+            if student.id in photo_paths:
+                previous_photos[student.id] = student.photo_path
+                student.photo_path = photo_paths[student.id]
+        if max_templates:
+            for student_id in student_ids:
+                prune_face_embeddings(db, student_id, max_templates, commit=False, counted=counted)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return previous_photos
+
+def get_reembedding_sources(db: Session) -> List[Tuple[int, Optional[str], Optional[bytes]]]:
+    """Get (student_id, photo_path, embedding_blob) for every face template in one query"""
+    return db.query(
+        models.Student.id,
+        models.Student.photo_path,
+        models.FaceEmbedding.embedding_blob
+    ).join(models.FaceEmbedding).all()
+
+def add_face_embeddings(db: Session, templates: List[Tuple[int, bytes]], source: str = "enrollment"):
+    """Insert (student_id, embedding_blob) templates in one transaction"""
+    try:
+        db.add_all([
+            models.FaceEmbedding(student_id=student_id, embedding_blob=blob, source=source)
+            for student_id, blob in templates
+        ])
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
 def get_face_embedding(db: Session, student_id: int) -> Optional[models.FaceEmbedding]:
     return db.query(models.FaceEmbedding).filter(models.FaceEmbedding.student_id == student_id).first()
 
@@ -175,6 +285,18 @@ def get_all_face_embeddings_by_class(db: Session, class_id: int) -> List[models.
 def get_all_face_embeddings(db: Session) -> List[models.FaceEmbedding]:
     return db.query(models.FaceEmbedding).all()
 
+def get_face_embedding_rows(db: Session, student_ids: Optional[List[int]] = None) -> List[Tuple[int, int, Optional[bytes], Optional[str]]]:
+    """Get (student_id, class_id, embedding_blob, legacy_json) for every face template (or those of some students) in one query"""
+    query = db.query(
+        models.FaceEmbedding.student_id,
+        models.Student.class_id,
+        models.FaceEmbedding.embedding_blob,
+        models.FaceEmbedding.embedding
+    ).join(models.Student)
+    if student_ids is not None:
+        query = query.filter(models.FaceEmbedding.student_id.in_(student_ids))
+    return query.all()
+
 
 # Attendance CRUD
 def create_attendance(db: Session, student_id: int, class_id: int, confidence_score: float = None) -> models.Attendance:
@@ -188,6 +310,34 @@ def create_attendance(db: Session, student_id: int, class_id: int, confidence_sc
     db.refresh(db_attendance)
     return db_attendance
 
+def create_attendance_bulk(db: Session, records: List[Tuple[int, int, Optional[float]]]) -> List[models.Attendance]:
+    """Insert (student_id, class_id, confidence_score) attendance rows in one transaction
+    
+    Students already marked today in that class (e.g. by another kiosk or
+    /face/verify since the caller last looked) are skipped, as are repeats
+    within `records`. Returns the rows actually inserted.
+    """
+    if not records:
+        return []
+    start_of_day = datetime.combine(date.today(), datetime.min.time())
+    end_of_day = datetime.combine(date.today(), datetime.max.time())
+    marked = set(db.query(models.Attendance.student_id, models.Attendance.class_id).filter(
+        models.Attendance.student_id.in_({student_id for student_id, _, _ in records}),
+        models.Attendance.marked_at >= start_of_day,
+        models.Attendance.marked_at <= end_of_day
+    ).all())
+    db_records = []
+    for student_id, class_id, confidence_score in records:
+        if (student_id, class_id) in marked:
+            continue
+        marked.add((student_id, class_id))
+        db_records.append(models.Attendance(student_id=student_id, class_id=class_id, confidence_score=confidence_score))
+    if not db_records:
+        return []
+    db.add_all(db_records)
+    db.commit()
+    return db_records
+
 def get_attendance_today(db: Session, class_id: Optional[int] = None) -> List[models.Attendance]:
     today = date.today()
     query = db.query(models.Attendance).filter(
@@ -1,5 +1,5 @@
 """Database ORM models"""
-from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, Boolean, Float
+from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, Boolean, Float, LargeBinary
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from .base import Base
@@ -45,20 +45,22 @@ class Student(Base):
     
     # Relationships
     class_obj = relationship("Class", back_populates="students")
-    face_embedding = relationship("FaceEmbedding", back_populates="student", uselist=False)
+    face_embeddings = relationship("FaceEmbedding", back_populates="student", order_by="FaceEmbedding.created_at")
     attendance_records = relationship("Attendance", back_populates="student")
 
 class FaceEmbedding(Base):
     __tablename__ = "face_embeddings"
     
     id = Column(Integer, primary_key=True, index=True)
-    student_id = Column(Integer, ForeignKey("students.id"), unique=True, nullable=False)
-    embedding = Column(Text, nullable=False)  # JSON serialized embedding
+    student_id = Column(Integer, ForeignKey("students.id"), index=True, nullable=False)  # Several templates per student
+    embedding = Column(Text, nullable=True)  # Legacy JSON serialized embedding (until migrated)
+    embedding_blob = Column(LargeBinary, nullable=True)  # Binary float32/float16 embedding with header
+    source = Column(String, nullable=False, default="enrollment")  # enrollment or verify (auto-added)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
     
     # Relationships
-    student = relationship("Student", back_populates="face_embedding")
+    student = relationship("Student", back_populates="face_embeddings")
 
 class Attendance(Base):
     __tablename__ = "attendance"
@@ -1,12 +1,17 @@
 """App entry point"""
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager
 import os
 from .core.config import settings
-from .db.base import engine, Base
+from .db.base import engine, Base, SessionLocal, check_schema
 from .ai.insightface_model import face_model
+from .ai.gallery import face_gallery
+from .core.executor import face_executor
+from .services.face_service import load_face_gallery
+from .services.reembedding_service import reembedding_job
 from .api import auth, teachers, classes, students, attendance, face, dashboard, reports
 
 # Create database tables
@@ -19,13 +24,34 @@ os.makedirs(os.path.join(UPLOADS_DIR, "students"), exist_ok=True)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    # Startup: Refuse to serve a database from an older version until it is migrated
+    try:
+        check_schema()
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        raise
+    # Startup: Serve the recognizer of a completed re-embedding job
+    reembedding_job.apply_completed_switch()
     # Startup: Load InsightFace model
     print("Loading InsightFace model...")
     face_model.load_model()
     print("InsightFace model loaded successfully")
+    if settings.insightface_warmup_runs > 0:
+        face_model.warm_up(settings.insightface_warmup_runs)
+    # Startup: Build the in-memory face gallery
+    db = SessionLocal()
+    try:
+        load_face_gallery(db)
+    finally:
+        db.close()
+    reembedding_job.resume()
     yield
     # Shutdown: cleanup if needed
     print("Shutting down...")
+    reembedding_job.shutdown()
+    face_gallery.save_ann_index()
+    face_executor.shutdown()
+    face_model.get_batcher().stop()
 
 app = FastAPI(
     title=settings.app_name,
@@ -66,4 +92,31 @@ def root():
 
 @app.get("/health")
 def health_check():
-    return {"status": "healthy"}
\ No newline at end of file
+    return {"status": "healthy"}
+
+@app.get("/ready")
+def readiness_check():
+    """Whether this instance should receive face traffic: model warm, gallery loaded, pipeline not saturated
+    
+    Returns 503 when not ready, so load balancers route to warm instances only.
+    """
+    latency = {task: window.stats() for task, window in face_model.latency.items()}
+    checks = {
+        "model_loaded": face_model.loaded,
+        "model_warmed_up": face_model.warmed_up or settings.insightface_warmup_runs <= 0,
+        "gallery_loaded": face_gallery.loaded,
+        "pipeline_not_saturated": face_executor.waiting <= settings.ready_max_waiting_requests,
+        "latency_within_limit": settings.ready_max_p95_ms <= 0 or all(
+            stats["p95_ms"] is None or stats["p95_ms"] <= settings.ready_max_p95_ms for stats in latency.values()
+        ),
+    }
+    ready = all(checks.values())
+    body = {
+        "status": "ready" if ready else "not_ready",
+        "checks": checks,
+        "face_requests_in_flight": face_executor.in_flight,
+        "face_requests_waiting": face_executor.waiting,
+        "recognition_queue_depth": face_model.get_batcher().stats()["queue_depth"] if face_model.loaded else 0,
+        "latency": latency,
+    }
+    return JSONResponse(body, status_code=200 if ready else 503)
\ No newline at end of file
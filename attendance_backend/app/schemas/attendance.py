@@ -17,6 +17,7 @@ class AttendanceResponse(BaseModel):
 class AttendanceWithDetails(AttendanceResponse):
     student_name: Optional[str] = None
     student_student_id: Optional[str] = None
+    student_thumbnail_path: Optional[str] = None
     class_name: Optional[str] = None
 
 class AttendanceSummary(BaseModel):
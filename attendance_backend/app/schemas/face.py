@@ -1,12 +1,49 @@
 """Face recognition request/response schemas"""
 from pydantic import BaseModel
-from typing import Optional
+from typing import Optional, List
 
 class FaceRegisterResponse(BaseModel):
     success: bool
     message: str
     student_id: Optional[int] = None
 
+class BulkEnrollFileResult(BaseModel):
+    filename: str
+    student_id: Optional[int] = None
+    status: str  # enrolled, duplicate, unknown_student, invalid_image, rejected or error
+    message: str
+
+class FaceBulkEnrollResponse(BaseModel):
+    success: bool
+    message: str
+    enrolled: int = 0
+    duplicates: int = 0
+    failed: int = 0
+    files: List[BulkEnrollFileResult] = []
+
+class DuplicateStudent(BaseModel):
+    id: int
+    student_id: Optional[str] = None
+    full_name: Optional[str] = None
+    class_id: Optional[int] = None
+    class_name: Optional[str] = None
+
+class DuplicateIdentityPair(BaseModel):
+    similarity: float
+    centroid_similarity: float
+    student_a: DuplicateStudent
+    student_b: DuplicateStudent
+
+class FaceDuplicateAuditResponse(BaseModel):
+    success: bool
+    message: str
+    mode: str  # full or incremental
+    students: int = 0
+    compared_students: int = 0
+    threshold: float
+    seconds: float = 0.0
+    pairs: List[DuplicateIdentityPair] = []
+
 class FaceVerifyResponse(BaseModel):
     success: bool
     message: str
@@ -15,7 +52,27 @@ class FaceVerifyResponse(BaseModel):
     confidence_score: Optional[float] = None
     attendance_marked: Optional[bool] = None
     photo_path: Optional[str] = None
+    thumbnail_path: Optional[str] = None
     class_id: Optional[int] = None
 
+class GroupFaceResult(BaseModel):
+    image_index: int
+    bbox: List[float]  # x1, y1, x2, y2 in original image pixels
+    det_score: float
+    student_id: Optional[int] = None
+    student_name: Optional[str] = None
+    confidence_score: Optional[float] = None
+    attendance_marked: bool = False
+    already_present: bool = False
+
+class FaceGroupVerifyResponse(BaseModel):
+    success: bool
+    message: str
+    class_id: int
+    faces_detected: int = 0
+    students_recognized: int = 0
+    attendance_marked: int = 0
+    faces: List[GroupFaceResult] = []
+
 class FaceVerifyRequest(BaseModel):
     class_id: int
\ No newline at end of file
@@ -0,0 +1,83 @@
+"""Duplicate identity audit: the same face registered under several students"""
+import threading
+from typing import List, Optional, Tuple
+import numpy as np
+from sqlalchemy.orm import Session
+from ..ai.duplicate_audit import DuplicateAudit
+from ..ai.gallery import face_gallery
+from ..ai.matcher import normalize_embeddings
+from ..core.config import settings
+from ..core.executor import face_executor
+from ..db import crud
+from .face_service import ensure_face_gallery
+
+duplicate_audit = DuplicateAudit(settings.duplicate_audit_path)
+
+# One audit at a time, so runs never interleave their saved state
+_audit_lock = threading.Lock()
+
+def _student_details(student, class_) -> dict:
+    return {
+        "id": student.id,
+        "student_id": student.student_id,
+        "full_name": student.full_name,
+        "class_id": class_.id,
+        "class_name": class_.class_name,
+    }
+
+def _centroid(matrix: np.ndarray, owner_ids: np.ndarray, student_id: int) -> np.ndarray:
+    return normalize_embeddings(matrix[owner_ids == student_id].sum(axis=0))
+
+def audit_duplicate_identities(db: Session, threshold: float = None, full: bool = False,
+                               limit: Optional[int] = None) -> Tuple[List[dict], dict]:
+    """Find pairs of students whose faces match each other
+    
+    Every pair of gallery scoring rows is compared in blocks (incrementally
+    after the first run), so pairs are scored exactly as verify scores them:
+    best template pair with "max" template scoring, centroids with "centroid".
+    
+    Returns:
+        Tuple[pairs sorted by similarity, summary]
+    """
+    if threshold is None:
+        threshold = settings.face_similarity_threshold
+    ensure_face_gallery(db)
+    matrix, owner_ids = face_gallery.snapshot()
+    with _audit_lock:
+        pair_a, pair_b, similarities, summary = duplicate_audit.run(
+            matrix, owner_ids, threshold, settings.recognition_model_name, settings.template_scoring, full
+        )
+    
+    order = np.argsort(-similarities, kind="stable")
+    pair_a, pair_b, similarities = pair_a[order], pair_b[order], similarities[order]
+    summary.update(threshold=threshold, duplicate_pairs=len(pair_a))
+    if limit:
+        pair_a, pair_b, similarities = pair_a[:limit], pair_b[:limit], similarities[:limit]
+    
+    # Centroid similarity alongside, from the same snapshot, to tell one near-identical photo from overall resemblance
+    centroid_sims = np.array([
+        float(_centroid(matrix, owner_ids, a) @ _centroid(matrix, owner_ids, b)) for a, b in zip(pair_a.tolist(), pair_b.tolist())
+    ], dtype=np.float32)
+    matches = list(zip(pair_a.tolist(), pair_b.tolist(), similarities.tolist(), centroid_sims.tolist()))
+    
+    details = {
+        student.id: _student_details(student, class_)
+        for student, class_ in crud.get_students_with_classes(db, [a for a, _, _, _ in matches] + [b for _, b, _, _ in matches])
+    }
+    pairs = [
+        {
+            "similarity": round(similarity, 4),
+            "centroid_similarity": round(centroid_sim, 4),
+            "student_a": details.get(a, {"id": a}),
+            "student_b": details.get(b, {"id": b}),
+        }
+        for a, b, similarity, centroid_sim in matches
+    ]
+    print(f"🔎 Duplicate audit ({summary['mode']}): {len(matches)} pair(s) over {summary['students']} student(s) in {summary['seconds']}s")
+    return pairs, summary
+
+class AuditService:
+    async def audit_duplicate_identities(self, db: Session, threshold: float = None, full: bool = False,
+                                         limit: Optional[int] = None) -> Tuple[List[dict], dict]:
+        """Run the duplicate audit on the face executor, keeping the event loop free"""
+        return await face_executor.run(audit_duplicate_identities, db, threshold, full, limit)
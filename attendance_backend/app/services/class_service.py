@@ -1,6 +1,7 @@
 """Class business logic"""
 from typing import List, Optional
 from sqlalchemy.orm import Session
+from ..ai.gallery import face_gallery
 from ..db import crud, models
 from ..schemas.class_schema import ClassCreate
 
@@ -24,6 +25,13 @@ class ClassService:
         class_dict = class_data.model_dump()
         return crud.create_class(db, class_dict)
     
+    async def delete_class(self, class_id: int, db: Session) -> bool:
+        """Delete a class with its students, and drop their faces from the gallery"""
+        deleted = crud.delete_class(db, class_id)
+        if deleted:
+            face_gallery.remove_class(class_id)
+        return deleted
+    
     async def get_classes(self, db: Session, teacher_id: Optional[int] = None) -> List[models.Class]:
         """Get all classes, optionally filtered by teacher"""
         return crud.get_classes(db, teacher_id=teacher_id)
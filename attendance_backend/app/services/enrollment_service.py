@@ -0,0 +1,219 @@
+"""Bulk face enrollment from an archive of student photos"""
+import asyncio
+from typing import List, Optional, Tuple
+import numpy as np
+from sqlalchemy.orm import Session
+from ..ai.embedding import generate_embedding, embedding_to_bytes, is_current_model
+from ..ai.gallery import face_gallery
+from ..ai.matcher import normalize_embeddings
+from ..core.config import settings
+from ..core.executor import face_executor
+from ..db import crud
+from ..utils.archive_utils import ArchiveEntry, student_id_candidates
+from ..utils.image_utils import load_image
+from ..utils.photo_utils import save_student_photo, delete_student_photo
+from .face_service import ensure_face_gallery, load_face_gallery
+
+def _embed_entry(entry: ArchiveEntry) -> dict:
+    """Decode and embed the photo of one file; runs on the face executor"""
+    name, size, read = entry
+    if size > settings.bulk_enroll_max_file_bytes:
+        return {"status": "invalid_image", "message": f"File too large ({size} bytes)"}
+    try:
+        image, message = load_image(read(), max_size=settings.image_decode_max_size)
+        if image is None:
+            return {"status": "invalid_image", "message": message}
+        # Read before inference, as in embed_upload: the template is tagged with it
+        model_name = settings.recognition_model_name
+        embedding, message = generate_embedding(image)
+        if embedding is None:
+            return {"status": "rejected", "message": message}
+        return {"embedding": embedding, "model_name": model_name}
+    except Exception as e:
+        return {"status": "error", "message": f"Error processing {name}: {str(e)}"}
+
+def _save_entry_photo(entry: ArchiveEntry, student_id: int) -> Optional[str]:
+    """Store an accepted file as the student's profile photo, reading it again from the archive
+    
+    Decoded images are not kept through the duplicate check, so a large
+    archive never holds more than a few in memory.
+    """
+    name, _, read = entry
+    try:
+        image, message = load_image(read(), max_size=settings.image_decode_max_size)
+        if image is None:
+            raise ValueError(message)
+        return save_student_photo(image, student_id)
+    except Exception as e:
+        print(f"⚠️ Could not store the photo {name}: {e}")
+        return None
+
+async def _map_on_face_executor(fn, items: list) -> list:
+    """fn(*item) for every item on the shared face executor, at most `bulk_enroll_workers` at a time
+    
+    Bounding the queued calls keeps the executor's waiting line short, so
+    verify requests arriving during a bulk upload are not stuck behind the
+    whole archive.
+    """
+    results = [None] * len(items)
+    positions = iter(range(len(items)))
+    
+    async def worker():
+        for position in positions:
+            results[position] = await face_executor.run(fn, *items[position])
+    
+    workers = settings.bulk_enroll_workers or face_executor.workers
+    await asyncio.gather(*(worker() for _ in range(min(workers, len(items)))))
+    return results
+
+def _resolve_students(entries: List[ArchiveEntry], db: Session) -> list:
+    """Student of every file, resolved with one query (None for unknown student IDs)"""
+    candidates = [student_id_candidates(name) for name, _, _ in entries]
+    students = {student.student_id: student for student in crud.get_students_by_student_ids(db, [c for names in candidates for c in names])}
+    return [next((students[c] for c in names if c in students), None) for names in candidates]
+
+def _find_duplicates(embeddings: np.ndarray, owners: np.ndarray) -> List[Tuple[str, int, float]]:
+    """Check a batch against the gallery and against itself with one similarity matrix each
+    
+    A student's own templates never count, so re-enrollment works. Within
+    the batch, files are accepted in order and a later face matching an
+    accepted face of another student is the duplicate.
+    
+    Returns:
+        Per row: ("gallery", student_id, similarity), ("batch", row, similarity) or (None, None, best similarity)
+    """
+    threshold = settings.face_similarity_threshold
+    probes = normalize_embeddings(embeddings)
+    matrix, student_ids = face_gallery.snapshot()
+    if len(matrix):
+        gallery_sims = probes @ matrix.T
+        gallery_sims[student_ids[None, :] == owners[:, None]] = -1.0
+        gallery_best = np.argmax(gallery_sims, axis=1)
+        gallery_best_sims = gallery_sims[np.arange(len(probes)), gallery_best]
+    batch_sims = probes @ probes.T
+    
+    results, accepted = [], []
+    for row in range(len(probes)):
+        if len(matrix) and gallery_best_sims[row] >= threshold:
+            results.append(("gallery", int(student_ids[gallery_best[row]]), float(gallery_best_sims[row])))
+            continue
+        others = [other for other in accepted if owners[other] != owners[row]]
+        if others:
+            best = others[int(np.argmax(batch_sims[row, others]))]
+            if batch_sims[row, best] >= threshold:
+                results.append(("batch", best, float(batch_sims[row, best])))
+                continue
+        accepted.append(row)
+        results.append((None, None, float(gallery_best_sims[row]) if len(matrix) else 0.0))
+    return results
+
+def _check_duplicates(entries: List[ArchiveEntry], owners: list, embedded: list, report: List[dict], db: Session) -> list:
+    """Report duplicates of the embedded files and return the accepted (index, student_id, embedding) rows"""
+    ensure_face_gallery(db)
+    accepted = []
+    if not embedded:
+        return accepted
+    embeddings = np.stack([embedding for _, embedding in embedded])
+    owner_ids = np.array([owners[index].id for index, _ in embedded], dtype=np.int64)
+    for (index, embedding), (kind, match, similarity) in zip(embedded, _find_duplicates(embeddings, owner_ids)):
+        if kind == "gallery":
+            existing = crud.get_student_by_id(db, match)
+            name = existing.full_name if existing else match
+            report[index].update(status="duplicate", message=f"Face already registered for student: {name} (Similarity: {similarity:.2f})")
+        elif kind == "batch":
+            other = entries[embedded[match][0]][0]
+            report[index].update(status="duplicate", message=f"Same face as {other} in this upload (Similarity: {similarity:.2f})")
+        else:
+            accepted.append((index, owners[index].id, embedding))
+            report[index].update(status="enrolled", message="Face registered successfully")
+    return accepted
+
+def _save_enrollments(templates: List[Tuple[int, bytes]], photo_paths: dict, report: List[dict], db: Session, replace: bool) -> Optional[str]:
+    """Write every template and enrollment flag in one transaction, then rebuild the gallery once
+    
+    Returns:
+        The error message if the transaction failed, else None
+    """
+    try:
+        previous_photos = crud.enroll_face_templates_bulk(
+            db, templates, photo_paths, replace=replace, max_templates=settings.max_templates_per_student,
+            counted=is_current_model
+        )
+    except Exception as e:
+        for photo_path in photo_paths.values():
+            delete_student_photo(photo_path)
+        for entry in report:
+            if entry["status"] == "enrolled":
+                entry.update(status="error", message="Not saved: the enrollment transaction failed")
+        return f"Error saving enrollments: {str(e)}"
+    load_face_gallery(db)
+    for photo_path in previous_photos.values():
+        if photo_path:
+            face_executor.submit_background(delete_student_photo, photo_path)
+    return None
+
+async def enroll_bulk(entries: List[ArchiveEntry], db: Session, replace: bool = False) -> Tuple[bool, str, List[dict]]:
+    """Enroll every photo of an archive, named by student ID
+    
+    Photos are decoded and embedded in parallel on the shared face executor
+    (recognition shares the micro-batcher), duplicates are checked for the
+    whole batch at once, profile photos are written only for accepted
+    students, and all templates and enrollment flags are written in a
+    single transaction. Blocking steps run on the face executor.
+    
+    Args:
+        entries: Archive photos, see archive_utils
+        db: Database session
+        replace: Drop the existing templates of the enrolled students
+    
+    Returns:
+        Tuple[success, message, per-file report]
+    """
+    if not entries:
+        return False, "No photos found (expected .jpg, .jpeg, .png or .webp files named by student ID)", []
+    if len(entries) > settings.bulk_enroll_max_files:
+        return False, f"Too many photos: {len(entries)} (limit {settings.bulk_enroll_max_files})", []
+    print(f"\n📦 BULK ENROLLMENT: {len(entries)} photo(s)")
+    
+    owners = await face_executor.run(_resolve_students, entries, db)
+    report = [
+        {"filename": name, "student_id": None, "status": "unknown_student", "message": "No student with this student ID"}
+        for name, _, _ in entries
+    ]
+    
+    # Decode and embed photos in parallel
+    pending = [index for index, student in enumerate(owners) if student is not None]
+    outcomes = await _map_on_face_executor(_embed_entry, [(entries[index],) for index in pending])
+    embedded, model_names = [], {}
+    for index, outcome in zip(pending, outcomes):
+        report[index]["student_id"] = owners[index].id
+        if "embedding" in outcome:
+            embedded.append((index, outcome["embedding"]))
+            model_names[index] = outcome["model_name"]
+        else:
+            report[index].update(status=outcome["status"], message=outcome["message"])
+    
+    # Duplicate check for the whole batch
+    accepted = await face_executor.run(_check_duplicates, entries, owners, embedded, report, db)
+    
+    # The first accepted photo of a student becomes their profile photo; nothing is written for rejected files
+    first_photos = {}
+    for index, student_id, _ in accepted:
+        first_photos.setdefault(student_id, index)
+    saved = await _map_on_face_executor(_save_entry_photo, [(entries[index], student_id) for student_id, index in first_photos.items()])
+    photo_paths = {student_id: photo_path for student_id, photo_path in zip(first_photos, saved) if photo_path}
+    
+    if accepted:
+        templates = [(student_id, embedding_to_bytes(embedding, model_name=model_names[index])) for index, student_id, embedding in accepted]
+        error = await face_executor.run(_save_enrollments, templates, photo_paths, report, db, replace)
+        if error:
+            return False, error, report
+    
+    enrolled = sum(1 for entry in report if entry["status"] == "enrolled")
+    print(f"✅ Bulk enrollment: {enrolled}/{len(entries)} photo(s) enrolled for {len(first_photos)} student(s)")
+    return True, f"Enrolled {enrolled} of {len(entries)} photo(s) for {len(first_photos)} student(s)", report
+
+class EnrollmentService:
+    async def enroll_bulk(self, entries: List[ArchiveEntry], db: Session, replace: bool = False) -> Tuple[bool, str, List[dict]]:
+        """Bulk-enroll an archive on the face executor, keeping the event loop free"""
+        return await enroll_bulk(entries, db, replace)
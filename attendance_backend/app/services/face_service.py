@@ -1,29 +1,173 @@
 """Face recognition business logic using InsightFace"""
-from typing import Tuple, Optional
+from typing import Tuple, Optional, List
 from sqlalchemy.orm import Session
-from ..ai.embedding import generate_embedding, embedding_from_json
-from ..ai.matcher import find_best_match
+from ..ai.embedding import generate_embedding, embedding_to_bytes, embedding_from_storage, is_current_model
+from ..ai.embedding_cache import embedding_cache
+from ..ai.gallery import face_gallery
+from ..ai.insightface_model import face_model, parse_detection_sizes
+from ..ai.matcher import assign_faces_to_students, normalize_embeddings
+from ..ai.tracker import FaceTracker
+from ..core.config import settings
+from ..core.executor import face_executor
 from ..db import crud
-from ..utils.image_utils import preprocess_image, validate_image_format, resize_image_if_needed
+from ..db.base import SessionLocal
+from ..utils.image_utils import load_image
+from ..utils.photo_utils import save_student_photo, delete_student_photo, thumbnail_path
 import numpy as np
-import os
-import uuid
 
-# Directory to save student photos
-UPLOAD_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "uploads", "students")
+def gallery_rows(db: Session, model_name: str = None, student_ids: Optional[List[int]] = None) -> List[Tuple[int, int, np.ndarray]]:
+    """Decode the stored embeddings of one recognizer (the serving one by default), optionally of some students only"""
+    return [
+        (student_id, class_id, embedding_from_storage(embedding_blob, embedding_json))
+        for student_id, class_id, embedding_blob, embedding_json in crud.get_face_embedding_rows(db, student_ids)
+        if is_current_model(embedding_blob, model_name)
+    ]
+
+def load_face_gallery(db: Session):
+    """Decode every stored embedding of the serving recognizer once into the in-memory gallery
+    
+    Templates of another recognizer (an unfinished re-embedding job) are
+    skipped, since their similarities are meaningless against this one.
+    """
+    face_gallery.load(gallery_rows(db))
+
+def refresh_gallery_students(db: Session, student_ids: List[int]):
+    """Reload the serving recognizer's templates of some students into the gallery, in one rebuild"""
+    students = {}
+    for student_id, class_id, embedding in gallery_rows(db, student_ids=student_ids):
+        students.setdefault(student_id, (class_id, []))[1].append(embedding)
+    # Students left without a template of the serving recognizer drop out
+    for student_id in student_ids:
+        students.setdefault(student_id, (0, []))
+    face_gallery.set_students(students)
+
+def ensure_face_gallery(db: Session):
+    """Load the gallery lazily when running outside the app lifespan (scripts, tests)"""
+    if not face_gallery.loaded:
+        load_face_gallery(db)
+
+def store_face_template(db: Session, student_id: int, class_id: int, embedding: np.ndarray, source: str = "enrollment",
+                        replace: bool = False, model_name: str = None):
+    """Save a template tagged with the recognizer that produced it, prune the student to the template cap and refresh their gallery rows"""
+    crud.create_face_embedding(db, student_id, embedding_to_bytes(embedding, model_name=model_name), source=source, replace=replace)
+    crud.prune_face_embeddings(db, student_id, settings.max_templates_per_student, counted=is_current_model)
+    templates = crud.get_face_embeddings(db, student_id)
+    face_gallery.set_templates(
+        student_id, class_id,
+        [embedding_from_storage(template.embedding_blob, template.embedding) for template in templates if is_current_model(template.embedding_blob)]
+    )
+
+def learn_face_template(student_id: int, embedding: np.ndarray, model_name: str = None):
+    """Add a confidently verified probe as a new template, unless it duplicates an existing one
+    
+    Runs in the background after the verify response, with its own session.
+    """
+    try:
+        own = face_gallery.student_templates(student_id)
+        if len(own) and float(np.max(own @ normalize_embeddings(embedding))) >= settings.template_redundancy_threshold:
+            return
+        db = SessionLocal()
+        try:
+            student = crud.get_student_by_id(db, student_id)
+            if student is not None:
+                store_face_template(db, student_id, student.class_id, embedding, source="verify", model_name=model_name)
+                print(f"🧩 Added verify template for student {student_id}")
+        finally:
+            db.close()
+    except Exception as e:
+        print(f"⚠️ Failed to add template for student {student_id}: {e}")
+
+def persist_student_photo(image: np.ndarray, student_id: int):
+    """Store the enrollment photo and thumbnails, then point the student at them
+    
+    Runs in the background after the enrollment response, with its own session.
+    """
+    try:
+        photo_path = save_student_photo(image, student_id)
+        db = SessionLocal()
+        try:
+            student = crud.get_student_by_id(db, student_id)
+            if student is None:
+                delete_student_photo(photo_path)
+                return
+            previous_photo = student.photo_path
+            crud.update_student_face_enrolled(db, student_id, student.face_enrolled, photo_path=photo_path)
+        finally:
+            db.close()
+        if previous_photo and previous_photo != photo_path:
+            delete_student_photo(previous_photo)
+    except Exception as e:
+        print(f"⚠️ Failed to store photo for student {student_id}: {e}")
+
+def embed_upload(image_data: bytes) -> Tuple[Optional[np.ndarray], Optional[np.ndarray], str, str]:
+    """Decode and embed an upload, reusing the embedding of an identical earlier upload
+    
+    The serving pack is read before inference and tags the embedding. A
+    re-embedding switch swaps the recognizers before it renames the pack,
+    so an embedding of the old recognizer is never tagged with the new one.
+    Cache keys carry the pack too, so old results are not served after it.
+    
+    Returns:
+        Tuple[embedding, image, message, model_name]; image is None when the
+        exact-bytes cache hit made decoding unnecessary, model_name tags the
+        embedding when it is stored
+    """
+    model_name = settings.recognition_model_name
+    exact_key = f"{model_name}/{embedding_cache.key_for_bytes(image_data)}"
+    cached = embedding_cache.get(exact_key)
+    if cached is not None:
+        print("♻️ Embedding cache hit (identical upload)")
+        return cached[0], None, cached[1], model_name
+    
+    # Validate and decode the image in one pass
+    image, message = load_image(image_data, max_size=settings.image_decode_max_size)
+    if image is None:
+        return None, None, message, model_name
+    
+    perceptual_key = f"{model_name}/{embedding_cache.key_for_image(image)}" if settings.embedding_cache_perceptual else None
+    if perceptual_key is not None:
+        cached = embedding_cache.get(perceptual_key)
+        if cached is not None:
+            print("♻️ Embedding cache hit (re-encoded upload)")
+            embedding_cache.put(exact_key, *cached)
+            return cached[0], image, cached[1], model_name
+    
+    # Generate embedding (detection is sized adaptively, the crop comes from the full image)
+    embedding, message = generate_embedding(image)
+    if embedding is not None:
+        embedding_cache.put(exact_key, embedding, message)
+        if perceptual_key is not None:
+            embedding_cache.put(perceptual_key, embedding, message)
+    return embedding, image, message, model_name
+
+def mark_attendance_bulk(records: List[Tuple[int, int, float]]) -> List[int]:
+    """Insert attendance rows in one transaction with a short-lived session (for long-lived streams)
+    
+    Returns the IDs of the students newly marked; the others were already present.
+    """
+    db = SessionLocal()
+    try:
+        return [record.student_id for record in crud.create_attendance_bulk(db, records)]
+    finally:
+        db.close()
 
 class FaceService:
-    def __init__(self):
-        # Ensure upload directory exists
-        os.makedirs(UPLOAD_DIR, exist_ok=True)
+    async def register_face(self, image_data: bytes, student_id: int, db: Session, replace: bool = False) -> Tuple[bool, str]:
+        """Register a face for a student on the face executor, keeping the event loop free"""
+        return await face_executor.run(self._register_face, image_data, student_id, db, replace)
+    
+    async def verify_face(self, image_data: bytes, db: Session, class_id: Optional[int] = None, auto_mark: bool = False) -> Tuple[bool, str, dict]:
+        """Verify a face and mark attendance on the face executor, keeping the event loop free"""
+        return await face_executor.run(self._verify_face, image_data, db, class_id, auto_mark)
     
-    async def register_face(self, image_data: bytes, student_id: int, db: Session) -> Tuple[bool, str]:
-        """Register a face for a student
+    def _register_face(self, image_data: bytes, student_id: int, db: Session, replace: bool = False) -> Tuple[bool, str]:
+        """Register a face template for a student
         
         Args:
             image_data: Raw image bytes
             student_id: Student ID to register face for
             db: Database session
+            replace: Drop the student's existing templates instead of adding to them
             
         Returns:
             Tuple[success, message]
@@ -34,135 +178,247 @@ class FaceService:
             if not student:
                 return False, "Student not found"
             
-            # Validate image format
-            is_valid, message = validate_image_format(image_data)
-            if not is_valid:
-                return False, message
-            
-            # Save the photo as student profile picture
-            photo_filename = f"{student_id}_{uuid.uuid4().hex[:8]}.jpg"
-            photo_path = os.path.join(UPLOAD_DIR, photo_filename)
-            with open(photo_path, 'wb') as f:
-                f.write(image_data)
-            
-            # Preprocess image
-            image = preprocess_image(image_data)
-            if image is None:
-                return False, "Failed to process image"
-            
-            # Resize if needed
-            image = resize_image_if_needed(image)
-            
-            # Generate embedding
-            embedding_json, embed_message = generate_embedding(image)
-            if embedding_json is None:
+            # Decode and embed, or reuse the result of a retried upload
+            target_embedding, image, embed_message, model_name = embed_upload(image_data)
+            if target_embedding is None:
                 return False, embed_message
             
             # Check if face is already registered
-            target_embedding = embedding_from_json(embedding_json)
-            all_embeddings = crud.get_all_face_embeddings(db)
-            
-            candidates = []
-            for face_embed in all_embeddings:
-                # Skip checking against the student's own previous embedding if it exists (re-enrollment)
-                if face_embed.student_id == student_id:
-                    continue
-                candidate_embedding = embedding_from_json(face_embed.embedding)
-                candidates.append((face_embed.student_id, candidate_embedding))
-            
-            if candidates:
-                best_id, best_sim, is_match = find_best_match(target_embedding, candidates)
-                if is_match:
-                    existing_student = crud.get_student_by_id(db, best_id)
-                    return False, f"Face already registered for student: {existing_student.full_name} (Similarity: {best_sim:.2f})"
+            # Skip checking against the student's own previous embedding if it exists (re-enrollment)
+            ensure_face_gallery(db)
+            best_id, best_sim, is_match = face_gallery.search(target_embedding, exclude_student_id=student_id)
+            if is_match:
+                existing_student = crud.get_student_by_id(db, best_id)
+                return False, f"Face already registered for student: {existing_student.full_name} (Similarity: {best_sim:.2f})"
             
-            # Save embedding to database
-            crud.create_face_embedding(db, student_id, embedding_json)
+            # Save the template to the database and the in-memory gallery
+            store_face_template(db, student_id, student.class_id, target_embedding, replace=replace, model_name=model_name)
             
-            # Update student face_enrolled status and photo_path
-            crud.update_student_face_enrolled(db, student_id, True, photo_path=f"students/{photo_filename}")
+            # Update student face_enrolled status; the profile photo is written in the background
+            crud.update_student_face_enrolled(db, student_id, True)
+            if image is None:
+                image, _ = load_image(image_data, max_size=settings.image_decode_max_size)
+            face_executor.submit_background(persist_student_photo, image, student_id)
             
             return True, "Face registered successfully"
             
         except Exception as e:
             return False, f"Error registering face: {str(e)}"
     
-    async def verify_face(self, image_data: bytes, db: Session, class_id: Optional[int] = None) -> Tuple[bool, str, Optional[int], Optional[float]]:
-        """Verify a face against enrolled students, optionally filtered by class
+    def _verify_face(self, image_data: bytes, db: Session, class_id: Optional[int] = None, auto_mark: bool = False) -> Tuple[bool, str, dict]:
+        """Verify a face against enrolled students, optionally filtered by class, and mark attendance
         
         Args:
             image_data: Raw image bytes
             db: Database session
             class_id: Optional Class ID to search within
+            auto_mark: Mark the recognized student present unless already marked today
             
         Returns:
-            Tuple[success, message, student_id, confidence_score]
+            Tuple[success, message, details] where details holds student_id,
+            confidence_score, student_name, photo_path, thumbnail_path,
+            class_id and attendance_marked
         """
+        details = {"student_id": None, "confidence_score": None, "attendance_marked": False}
         try:
             print(f"\n{'='*60}")
             print(f"🔍 FACE VERIFICATION STARTED {'for class ' + str(class_id) if class_id else 'GLOBAL SEARCH'}")
             print(f"{'='*60}")
             
-            # Validate image format
-            is_valid, message = validate_image_format(image_data)
-            if not is_valid:
-                print(f"❌ Image validation failed: {message}")
-                return False, message, None, None
-            
-            # Preprocess image
-            image = preprocess_image(image_data)
-            if image is None:
-                print("❌ Image preprocessing failed")
-                return False, "Failed to process image", None, None
-            
-            # Resize if needed
-            image = resize_image_if_needed(image)
-            
-            # Generate embedding for input image
+            # Decode and embed the input image, or reuse the result of a retried upload
             print("📊 Generating embedding for captured face...")
-            embedding_json, embed_message = generate_embedding(image)
-            if embedding_json is None:
+            target_embedding, _, embed_message, model_name = embed_upload(image_data)
+            if target_embedding is None:
                 print(f"❌ Embedding generation failed: {embed_message}")
-                return False, embed_message, None, None
-            
-            print(f"✅ Embedding generated successfully (length: {len(embedding_json)} chars)")
-            target_embedding = embedding_from_json(embedding_json)
+                return False, embed_message, details
             
-            # Get face embeddings
-            if class_id:
-                print(f"📚 Fetching enrolled faces for class {class_id}...")
-                face_embeddings = crud.get_all_face_embeddings_by_class(db, class_id)
-            else:
-                print(f"📚 Fetching ALL enrolled faces...")
-                face_embeddings = crud.get_all_face_embeddings(db)
+            print(f"✅ Embedding generated successfully (dimension: {target_embedding.size})")
             
-            if not face_embeddings:
+            # Match against the in-memory gallery (whole school or one class slice)
+            ensure_face_gallery(db)
+            _, enrolled_ids = face_gallery.snapshot(class_id)
+            if len(enrolled_ids) == 0:
                 print(f"⚠️ No enrolled faces found")
-                return False, "No enrolled faces found", None, None
-            
-            print(f"✅ Found {len(face_embeddings)} enrolled face(s)")
-            
-            # Prepare candidate embeddings
-            candidates = []
-            for face_embed in face_embeddings:
-                candidate_embedding = embedding_from_json(face_embed.embedding)
-                candidates.append((face_embed.student_id, candidate_embedding))
+                return False, "No enrolled faces found", details
             
-            # Find best match
-            print("\n🎯 Starting face matching...")
-            best_student_id, best_similarity, is_match = find_best_match(target_embedding, candidates)
+            print(f"\n🎯 Matching against {len(enrolled_ids)} enrolled face(s)...")
+            best_student_id, best_similarity, is_match = face_gallery.search(target_embedding, class_id=class_id)
             
             if is_match:
                 student = crud.get_student_by_id(db, best_student_id)
                 print(f"\n✅ MATCH FOUND: {student.full_name} (ID: {best_student_id})")
                 print(f"{'='*60}\n")
-                return True, f"Face recognized: {student.full_name}", best_student_id, best_similarity
+                
+                # Learn appearance changes (glasses, lighting, growth) from confident matches
+                if settings.template_auto_add and best_similarity >= settings.template_auto_add_threshold:
+                    face_executor.submit_background(learn_face_template, best_student_id, target_embedding, model_name)
+                
+                target_class_id = class_id if class_id else student.class_id
+                details.update(
+                    student_id=best_student_id,
+                    confidence_score=best_similarity,
+                    student_name=student.full_name,
+                    photo_path=student.photo_path,
+                    thumbnail_path=thumbnail_path(student.photo_path, "md"),
+                    class_id=target_class_id
+                )
+                message = f"Face recognized: {student.full_name}"
+                if auto_mark:
+                    # Skipped by the insert if another request marked the student first
+                    if crud.create_attendance_bulk(db, [(best_student_id, target_class_id, best_similarity)]):
+                        details["attendance_marked"] = True
+                        return True, message + " (Attendance marked)", details
+                if crud.check_attendance_exists(db, best_student_id, target_class_id):
+                    details["attendance_marked"] = True
+                    message = f"Face recognized: {student.full_name} (Already present)"
+                return True, message, details
             else:
                 print(f"\n❌ NO MATCH: Best similarity {best_similarity:.4f} below threshold")
                 print(f"{'='*60}\n")
-                return False, "Face not recognized", None, best_similarity
+                details["confidence_score"] = best_similarity
+                return False, "Face not recognized", details
                 
         except Exception as e:
             print(f"\n❌ ERROR in verify_face: {str(e)}")
             print(f"{'='*60}\n")
-            return False, f"Error verifying face: {str(e)}", None, None
\ No newline at end of file
+            return False, f"Error verifying face: {str(e)}", details
+    
+    def recognize_frame(self, image_data: bytes, gallery_matrix: np.ndarray, student_ids: np.ndarray, tracker: Optional[FaceTracker] = None) -> Tuple[bool, str, List[dict]]:
+        """Recognize every face in one camera frame against a pinned class gallery
+        
+        Runs on the face executor. No DB access: the caller holds the gallery
+        snapshot and student names for the whole stream. With a tracker, faces
+        continuing an already-recognized track keep its identity and skip
+        recognition, so a stationary student costs detection only.
+        
+        Returns:
+            Tuple[success, message, faces] where each face is a dict with
+            bbox, det_score, track_id, tracked, student_id and confidence_score
+        """
+        try:
+            image, message = load_image(image_data, max_size=settings.image_decode_max_size)
+            if image is None:
+                return False, message, []
+            
+            tracks = {}
+            def select(detected):
+                if tracker is None or len(student_ids) == 0:
+                    return detected if len(student_ids) else []
+                for face, track in zip(detected, tracker.update([face.bbox for face in detected])):
+                    tracks[id(face)] = track
+                return [face for face in detected if tracker.needs_recognition(tracks[id(face)])]
+            
+            detected = face_model.detect_faces(image, select=select)
+            if not detected:
+                return True, "No face detected", []
+            
+            faces = []
+            for face in detected:
+                track = tracks.get(id(face))
+                faces.append({
+                    "bbox": [float(v) for v in face.bbox],
+                    "det_score": float(face.det_score),
+                    "track_id": track.track_id if track else None,
+                    "tracked": face.embedding is None and track is not None,
+                    "student_id": track.student_id if track else None,
+                    "confidence_score": track.confidence if track else None,
+                })
+            if len(student_ids) == 0:
+                return True, "No enrolled faces found", faces
+            
+            # Recognize only the faces that were embedded this frame
+            pending = [i for i, face in enumerate(detected) if face.embedding is not None]
+            if pending:
+                embeddings = np.stack([detected[i].embedding for i in pending])
+                for i, (student_id, similarity) in zip(pending, assign_faces_to_students(embeddings, gallery_matrix, student_ids)):
+                    faces[i].update(student_id=student_id, confidence_score=similarity)
+                    if tracker is not None:
+                        tracker.set_identity(tracks[id(detected[i])], student_id, similarity)
+            return True, f"{len(faces)} face(s) detected", faces
+        
+        except Exception as e:
+            print(f"❌ ERROR in recognize_frame: {str(e)}")
+            return False, f"Error recognizing frame: {str(e)}", []
+    
+    async def verify_group(self, images_data: List[bytes], class_id: int, db: Session, auto_mark: bool = True) -> Tuple[bool, str, List[dict]]:
+        """Recognize every face in classroom photos on the face executor"""
+        return await face_executor.run(self._verify_group, images_data, class_id, db, auto_mark)
+    
+    def _verify_group(self, images_data: List[bytes], class_id: int, db: Session, auto_mark: bool = True) -> Tuple[bool, str, List[dict]]:
+        """Recognize every face in one or more classroom photos and mark attendance in bulk
+        
+        Args:
+            images_data: Raw image bytes of each photo
+            class_id: Class whose gallery the faces are matched against
+            db: Database session
+            auto_mark: Mark attendance for every recognized student
+        
+        Returns:
+            Tuple[success, message, faces] where each face is a dict with
+            image_index, bbox, det_score, student_id, confidence_score,
+            attendance_marked and already_present
+        """
+        try:
+            print(f"\n👥 GROUP VERIFICATION for class {class_id}: {len(images_data)} photo(s)")
+            
+            # Detect every face in every photo; boxes and crops are in original pixels
+            detection_sizes = parse_detection_sizes(settings.group_detection_sizes)
+            faces, crops = [], []
+            for image_index, image_data in enumerate(images_data):
+                image, message = load_image(image_data, max_size=settings.group_image_decode_max_size)
+                if image is None:
+                    return False, f"Photo {image_index + 1}: {message}", []
+                
+                for face in face_model.detect_adaptive(image, detection_sizes):
+                    crops.append(face_model.align(image, face))
+                    faces.append({
+                        "image_index": image_index,
+                        "bbox": [float(v) for v in face.bbox],
+                        "det_score": float(face.det_score),
+                    })
+            
+            if not faces:
+                return False, "No faces detected in photo", []
+            
+            # One recognition pass for all faces, one matrix product against the class
+            embeddings = face_model.embed_crops(crops)
+            ensure_face_gallery(db)
+            gallery_matrix, student_ids = face_gallery.snapshot(class_id)
+            if len(student_ids) == 0:
+                return False, "No enrolled faces found", faces
+            assignments = assign_faces_to_students(embeddings, gallery_matrix, student_ids)
+            
+            students = {student.id: student for student in crud.get_students(db, class_id=class_id)}
+            present = {record.student_id for record in crud.get_attendance_today(db, class_id=class_id)}
+            to_mark = []
+            for face, (student_id, similarity) in zip(faces, assignments):
+                face["confidence_score"] = similarity
+                face["attendance_marked"] = False
+                face["already_present"] = False
+                if student_id is None or student_id not in students:
+                    face["student_id"] = None
+                    continue
+                face["student_id"] = student_id
+                face["student_name"] = students[student_id].full_name
+                if student_id in present:
+                    face["already_present"] = True
+                    face["attendance_marked"] = True
+                elif auto_mark:
+                    to_mark.append((student_id, class_id, similarity))
+                    face["attendance_marked"] = True
+            
+            # All new attendance rows in a single transaction
+            if to_mark:
+                newly_marked = {record.student_id for record in crud.create_attendance_bulk(db, to_mark)}
+                for face in faces:
+                    if face["attendance_marked"] and not face["already_present"] and face["student_id"] not in newly_marked:
+                        face["already_present"] = True
+                to_mark = newly_marked
+            
+            recognized = sum(1 for face in faces if face["student_id"] is not None)
+            print(f"✅ {len(faces)} face(s), {recognized} recognized, {len(to_mark)} newly marked")
+            return True, f"Recognized {recognized} of {len(faces)} face(s)", faces
+        
+        except Exception as e:
+            print(f"\n❌ ERROR in verify_group: {str(e)}")
+            return False, f"Error verifying group photo: {str(e)}", []
@@ -0,0 +1,315 @@
+"""Background re-embedding of face templates for a recognition model upgrade"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import List, Optional, Tuple
+import numpy as np
+from insightface.utils import face_align
+from ..ai.embedding import embedding_to_bytes, is_current_model
+from ..ai.embedding_cache import embedding_cache
+from ..ai.gallery import face_gallery
+from ..ai.insightface_model import face_model, load_pack_modules, parse_detection_sizes, resolve_pack
+from ..core.config import settings
+from ..core.executor import available_cpus
+from ..db import crud
+from ..db.base import SessionLocal
+from ..utils.image_utils import load_image
+from ..utils.photo_utils import UPLOADS_DIR
+from .face_service import gallery_rows, refresh_gallery_students
+
+# Failure messages kept in the job state; the count covers the rest
+MAX_REPORTED_FAILURES = 200
+
+def _aligned_photo_crop(photo_path: Optional[str], crop_size: int) -> Tuple[Optional[np.ndarray], str]:
+    """Aligned crop of the single face in a stored student photo; runs on the job's worker threads"""
+    if not photo_path:
+        return None, "No stored photo"
+    try:
+        with open(os.path.join(UPLOADS_DIR, photo_path), 'rb') as f:
+            image, message = load_image(f.read(), max_size=settings.image_decode_max_size)
+        if image is None:
+            return None, message
+        faces = face_model.detect_adaptive(image, parse_detection_sizes(settings.detection_sizes))
+        if len(faces) != 1:
+            return None, "No face detected in photo" if not faces else "Multiple faces detected in photo"
+        return face_align.norm_crop(image, landmark=faces[0].kps, image_size=crop_size), ""
+    except Exception as e:
+        return None, f"Error reading {photo_path}: {str(e)}"
+
+def pending_students(db, target_pack: str) -> Tuple[int, List[Tuple[int, Optional[str]]]]:
+    """Enrolled students, and the (student_id, photo_path) of those without a template of the target pack"""
+    photos, done = {}, set()
+    for student_id, photo_path, embedding_blob in crud.get_reembedding_sources(db):
+        photos[student_id] = photo_path
+        if is_current_model(embedding_blob, target_pack):
+            done.add(student_id)
+    return len(photos), [(student_id, photo) for student_id, photo in photos.items() if student_id not in done]
+
+class ReembeddingJob:
+    """Resumable job that re-computes every student's template with another recognizer.
+    
+    Templates are recomputed from the stored student photos in batches:
+    photos are decoded and detected on a worker per core, the target
+    recognizer embeds each batch in one call, and the batch is written in
+    one transaction, tagged with the target pack. The gallery keeps serving
+    the current templates meanwhile. Students that already have a template
+    of the target pack are skipped, so a stopped or interrupted job picks up
+    where it left off. Once every student is done the recognizer and the
+    gallery are switched together, and the switch is recorded in the state
+    file so later starts serve the target pack as well. Students caught up
+    once the target pack is served (enrolled just before the switch, or
+    since a completed job) go into the gallery batch by batch. Students
+    without a usable photo would have no template of the new model, so the
+    job stops as "incomplete" instead of switching unless it was started
+    with `force`.
+    
+    Only one enrollment photo is stored per student, so each student ends up
+    with a single template of the new model; learned verify templates are
+    not carried over. Templates of the old model stay in the database.
+    """
+    
+    def __init__(self, state_path: str):
+        self.state_path = state_path
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._stop_status = "stopped"
+        self._thread = None
+        self._run_started = None
+        self._run_processed = 0
+        self._recognizer = None
+        self.state = self._load_state()
+    
+    def _load_state(self) -> dict:
+        try:
+            with open(self.state_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"status": "idle"}
+    
+    def _save_state(self):
+        """Write the state atomically, so an interrupted write never loses progress"""
+        directory = os.path.dirname(self.state_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            self.state["updated_at"] = datetime.utcnow().isoformat()
+            state = dict(self.state)
+        with open(self.state_path + ".tmp", 'w') as f:
+            json.dump(state, f, indent=2)
+        os.replace(self.state_path + ".tmp", self.state_path)
+    
+    def _update(self, **fields):
+        with self._lock:
+            self.state.update(fields)
+        self._save_state()
+    
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+    
+    def start(self, target_pack: str, force: bool = False) -> Tuple[bool, str]:
+        """Start (or resume) re-embedding with the recognizer of `target_pack` on a background thread
+        
+        `force` switches even if some students could not be re-embedded;
+        they stay enrolled but are not recognized until re-enrolled.
+        """
+        if self.running:
+            return False, f"A re-embedding job to {self.state.get('target_pack')} is already running"
+        resuming = self.state.get("target_pack") == target_pack and "source_pack" in self.state
+        source_pack = self.state["source_pack"] if resuming else settings.recognition_model_name
+        with self._lock:
+            self.state = {
+                "status": "running",
+                "target_pack": target_pack,
+                "source_pack": source_pack,
+                "started_at": self.state.get("started_at") if resuming else datetime.utcnow().isoformat(),
+                "total": 0,
+                "done": 0,
+                "failed": 0,
+                "failures": {},
+                "remaining": None,
+                "force": force,
+                "switched_at": self.state.get("switched_at") if resuming else None,
+            }
+        self._save_state()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(target_pack, force), name="reembed", daemon=True)
+        self._thread.start()
+        return True, f"{'Resumed' if resuming else 'Started'} re-embedding with {target_pack}"
+    
+    def stop(self, status: str = "stopped", wait: bool = False):
+        """Stop after the current batch; `start` with the same pack resumes"""
+        self._stop_status = status
+        self._stop.set()
+        if wait and self.running:
+            self._thread.join()
+    
+    def shutdown(self):
+        """Stop for an app shutdown, leaving the job to resume at the next start"""
+        if self.running:
+            self.stop(status="running", wait=True)
+    
+    def apply_completed_switch(self):
+        """Serve the target pack of a completed job; call before loading the model
+        
+        Only applied while the configured recognizer is still the job's
+        source pack; set INSIGHTFACE_RECOGNIZER_PACK to the target to make it
+        permanent.
+        """
+        target_pack = self.state.get("target_pack")
+        if self.state.get("status") == "completed" and settings.recognition_model_name == self.state.get("source_pack") != target_pack:
+            settings.insightface_recognizer_pack = target_pack
+            print(f"🔁 Serving recognizer {target_pack} from the completed re-embedding job; set INSIGHTFACE_RECOGNIZER_PACK={target_pack}")
+    
+    def resume(self):
+        """Resume a job interrupted by a shutdown, or catch up on students enrolled since it completed"""
+        target_pack = self.state.get("target_pack")
+        if self.state.get("status") == "running" or (
+            self.state.get("status") == "completed" and target_pack == settings.recognition_model_name
+        ):
+            self.start(target_pack)
+    
+    def _get_recognizer(self, target_pack: str):
+        """The target recognizer, loaded on first use with every core for its batches"""
+        if self._recognizer is None:
+            loaded = load_pack_modules(
+                resolve_pack(target_pack), ['recognition'],
+                intra_op_threads=settings.onnx_intra_op_threads or available_cpus()
+            )
+            if 'recognition' not in loaded:
+                raise ValueError(f"No recognition model found in pack {target_pack}")
+            self._recognizer = loaded['recognition'][0]
+            self._recognizer.prepare(ctx_id=-1)
+        return self._recognizer
+    
+    def _run(self, target_pack: str, force: bool = False):
+        """Re-embed every pending student, then switch to the target pack"""
+        with self._lock:
+            self._run_started, self._run_processed = time.perf_counter(), 0
+        try:
+            print(f"\n🔄 RE-EMBEDDING: {self.state['source_pack']} -> {target_pack}")
+            # Students enrolled while a pass runs are picked up by the next one
+            skipped = set()
+            while not self._stop.is_set():
+                if not self._run_pass(target_pack, skipped):
+                    break
+            if self._stop.is_set():
+                self._update(status=self._stop_status)
+                print(f"⏸️ Re-embedding {self._stop_status} at {self.state['done']}/{self.state['total']} student(s)")
+                return
+            
+            if target_pack != settings.recognition_model_name:
+                db = SessionLocal()
+                try:
+                    _, remaining = pending_students(db, target_pack)
+                finally:
+                    db.close()
+                self._update(remaining=len(remaining))
+                if remaining and not force:
+                    message = (f"{len(remaining)} student(s) have no template of {target_pack}; "
+                               f"re-enroll them and start again, or force the switch")
+                    self._update(status="incomplete", message=message)
+                    print(f"⚠️ Re-embedding not switched: {message}")
+                    return
+                self._switch(target_pack)
+                # Catch up on students enrolled with the old recognizer just before the switch
+                self._run_pass(target_pack, skipped)
+            self._update(status="completed", finished_at=datetime.utcnow().isoformat())
+            print(f"✅ Re-embedding completed: {self.state['done']} student(s), {self.state['failed']} failed")
+        except Exception as e:
+            self._update(status="failed", message=str(e))
+            print(f"❌ Re-embedding failed: {e}")
+        finally:
+            # Free the second recognizer; the switch loaded its own copies into the pool
+            self._recognizer = None
+    
+    def _run_pass(self, target_pack: str, skipped: set) -> bool:
+        """Embed the students still pending in batches; False once none are left"""
+        db = SessionLocal()
+        try:
+            total, pending = pending_students(db, target_pack)
+            self._update(total=total, done=total - len(pending))
+            pending = [(student_id, photo) for student_id, photo in pending if student_id not in skipped]
+            if not pending:
+                return False
+            recognizer = self._get_recognizer(target_pack)
+            
+            batch_size = max(1, settings.reembed_batch_size)
+            workers = settings.reembed_workers or available_cpus()
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="reembed") as pool:
+                for start in range(0, len(pending), batch_size):
+                    if self._stop.is_set():
+                        break
+                    batch = pending[start:start + batch_size]
+                    crops = list(pool.map(lambda item: _aligned_photo_crop(item[1], recognizer.input_size[0]), batch))
+                    
+                    failures = {student_id: message for (student_id, _), (crop, message) in zip(batch, crops) if crop is None}
+                    embedded = [(student_id, crop) for (student_id, _), (crop, _) in zip(batch, crops) if crop is not None]
+                    if embedded:
+                        embeddings = recognizer.get_feat([crop for _, crop in embedded])
+                        crud.add_face_embeddings(db, [
+                            (student_id, embedding_to_bytes(embedding.flatten(), model_name=target_pack))
+                            for (student_id, _), embedding in zip(embedded, embeddings)
+                        ])
+                        # Already serving the target (catch-up after the switch, or a resumed completed
+                        # job): make the new templates matchable now rather than at the next start
+                        if target_pack == settings.recognition_model_name:
+                            refresh_gallery_students(db, [student_id for student_id, _ in embedded])
+                    skipped.update(failures)
+                    self._record_batch(len(embedded), failures)
+            return True
+        finally:
+            db.close()
+    
+    def _record_batch(self, embedded: int, failures: dict):
+        with self._lock:
+            self._run_processed += embedded + len(failures)
+            self.state["done"] += embedded
+            self.state["failed"] += len(failures)
+            reported = self.state["failures"]
+            for student_id, message in failures.items():
+                if len(reported) < MAX_REPORTED_FAILURES:
+                    reported[str(student_id)] = message
+        self._save_state()
+    
+    def _switch(self, target_pack: str):
+        """Serve the target recognizer and its templates from the same instant"""
+        db = SessionLocal()
+        try:
+            rows = gallery_rows(db, target_pack)
+        finally:
+            db.close()
+        
+        def swap_gallery():
+            settings.insightface_recognizer_pack = target_pack
+            face_gallery.load(rows)
+            # Cached embeddings come from the old recognizer
+            embedding_cache.clear()
+        
+        if face_model.loaded:
+            face_model.switch_recognizer(target_pack, swap_gallery)
+        else:
+            swap_gallery()
+        self._update(switched_at=datetime.utcnow().isoformat())
+    
+    def status(self) -> dict:
+        """Job state with progress, throughput of the current run and ETA"""
+        with self._lock:
+            state = dict(self.state)
+            elapsed = time.perf_counter() - self._run_started if self._run_started else 0.0
+            processed = self._run_processed
+        total, finished = state.get("total", 0), state.get("done", 0) + state.get("failed", 0)
+        throughput = processed / elapsed if self.running and elapsed > 0 else 0.0
+        state.update(
+            running=self.running,
+            progress=round(finished / total, 4) if total else None,
+            throughput_per_s=round(throughput, 2),
+            eta_s=round((total - finished) / throughput, 1) if throughput > 0 else None,
+        )
+        return state
+
+# Global singleton instance
+reembedding_job = ReembeddingJob(settings.reembed_state_path)
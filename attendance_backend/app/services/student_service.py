@@ -1,6 +1,7 @@
 """Student business logic"""
 from typing import List, Optional
 from sqlalchemy.orm import Session
+from ..ai.gallery import face_gallery
 from ..db import crud, models
 from ..schemas.student import StudentCreate, StudentUpdate, StudentResponse
 
@@ -53,8 +54,13 @@ class StudentService:
             if not class_obj:
                 raise ValueError("Class not found")
         
+        previous_class_id = student.class_id
         update_dict = student_data.model_dump(exclude_unset=True)
-        return crud.update_student(db, student_id, update_dict)
+        updated = crud.update_student(db, student_id, update_dict)
+        # Keep the in-memory gallery filed under the student's current class
+        if updated.class_id != previous_class_id:
+            face_gallery.move(updated.id, updated.class_id)
+        return updated
     
     async def delete_student(self, student_id: int, db: Session) -> bool:
         """Delete a student"""
@@ -62,4 +68,7 @@ class StudentService:
         if not student:
             raise ValueError("Student not found")
         
-        return crud.delete_student(db, student_id)
\ No newline at end of file
+        deleted = crud.delete_student(db, student_id)
+        if deleted:
+            face_gallery.remove(student_id)
+        return deleted
\ No newline at end of file
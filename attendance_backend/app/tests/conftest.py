@@ -0,0 +1,30 @@
+"""Shared fixtures for the face and gallery tests"""
+import pytest
+
+@pytest.fixture
+def stub_face_model(monkeypatch):
+    """The global face model served by the stub modules, restored after the test"""
+    from app.ai.insightface_model import face_model
+    from app.ai.stub_model import install_stub_model
+    for attr in ("_pool", "_model", "_batcher"):
+        monkeypatch.setattr(face_model, attr, None)
+    install_stub_model(face_model)
+    yield face_model
+    face_model._batcher.stop()
+
+@pytest.fixture
+def seeded_db(tmp_path):
+    """Engine of a temporary SQLite database with an admin teacher, class 1 and students 1 and 2 in it"""
+    from sqlalchemy import create_engine
+    from app.db import models
+    from app.db.base import Base
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(models.Teacher.__table__.insert(), [{"id": 1, "teacher_id": "T1", "full_name": "Admin", "email": "admin@example.com", "password_hash": "-", "role": "admin"}])
+        connection.execute(models.Class.__table__.insert(), [{"id": 1, "class_name": "Class 1", "class_code": "C1", "teacher_id": 1}])
+        connection.execute(models.Student.__table__.insert(), [
+            {"id": student_id, "student_id": f"S{student_id}", "full_name": f"Student {student_id}", "class_id": 1} for student_id in (1, 2)
+        ])
+    yield engine
+    engine.dispose()
@@ -1,6 +1,6 @@
 """Face recognition unit tests"""
 import pytest
-from app.ai.embedding import generate_embedding
+from app.ai.embedding import generate_embedding, embedding_to_bytes, embedding_from_bytes, embedding_from_storage, read_embedding_header
 from app.ai.matcher import match_faces, cosine_similarity
 from app.ai.validator import validate_single_face
 
@@ -20,4 +20,773 @@ def test_match_faces():
     
     is_match, similarity = match_faces(embedding1, embedding2)
     assert is_match == True
-    assert similarity > 0.9
\ No newline at end of file
+    assert similarity > 0.9
+
+def test_embedding_binary_roundtrip():
+    """Test binary embedding storage for float32 and float16"""
+    import numpy as np
+    embedding = np.random.rand(512).astype(np.float32)
+    
+    blob = embedding_to_bytes(embedding, dtype="float32", model_name="buffalo_l")
+    assert read_embedding_header(blob)[1:] == (512, "buffalo_l")
+    assert np.array_equal(embedding_from_bytes(blob), embedding)
+    
+    half_blob = embedding_to_bytes(embedding, dtype="float16")
+    assert len(half_blob) < len(blob)
+    assert np.allclose(embedding_from_bytes(half_blob), embedding, atol=1e-3)
+
+def test_embedding_legacy_json_fallback():
+    """Test that rows not yet migrated still decode from JSON"""
+    import json
+    import numpy as np
+    embedding = np.random.rand(512).astype(np.float32)
+    decoded = embedding_from_storage(None, json.dumps(embedding.tolist()))
+    assert np.allclose(decoded, embedding)
+
+def test_assign_faces_one_to_one():
+    """Test that two faces can never claim the same student"""
+    import numpy as np
+    from app.ai.matcher import assign_faces_to_students, normalize_embeddings
+    gallery = normalize_embeddings(np.random.rand(5, 512) - 0.5)
+    student_ids = np.array([10, 11, 12, 13, 14])
+    probes = np.stack([gallery[2], gallery[2] * 0.95 + gallery[3] * 0.05, gallery[4]])
+    
+    results = assign_faces_to_students(probes, gallery, student_ids, threshold=0.6)
+    assert results[0][0] == 12
+    assert results[1][0] is None
+    assert results[2][0] == 14
+
+def test_detect_adaptive_escalates_on_tiny_faces(monkeypatch):
+    """Test that detection stops at the small size for close-ups and escalates for distant faces"""
+    import numpy as np
+    from types import SimpleNamespace
+    from app.ai.insightface_model import face_model
+    from app.ai.session_pool import SessionPool
+    
+    calls = []
+    def fake_detect(image, input_size=None, max_num=0, metric='default'):
+        calls.append(input_size[0])
+        return np.array([[0, 0, face_size, face_size, 0.9]], dtype=np.float32), np.zeros((1, 5, 2), dtype=np.float32)
+    monkeypatch.setattr(face_model, "_pool", SessionPool([SimpleNamespace(det_model=SimpleNamespace(detect=fake_detect))]))
+    image = np.zeros((960, 1280, 3), dtype=np.uint8)
+    
+    face_size = 400
+    assert len(face_model.detect_adaptive(image, [320, 640], min_face_size=40)) == 1
+    assert calls == [320]
+    
+    calls.clear()
+    face_size = 60
+    face_model.detect_adaptive(image, [320, 640], min_face_size=40)
+    assert calls == [320, 640]
+
+def test_load_image_reduced_jpeg_decode():
+    """Test that large JPEGs are decoded at reduced scale straight to RGB"""
+    import cv2
+    import numpy as np
+    from app.utils.image_utils import load_image
+    bgr = np.zeros((1600, 2000, 3), dtype=np.uint8)
+    bgr[:, :, 2] = 255
+    ok, encoded = cv2.imencode(".jpg", bgr)
+    
+    image, message = load_image(encoded.tobytes(), max_size=640)
+    assert image is not None, message
+    assert image.shape == (800, 1000, 3)
+    assert image[400, 500, 0] > 200 and image[400, 500, 2] < 50
+    
+    full, _ = load_image(encoded.tobytes())
+    assert full.shape == (1600, 2000, 3)
+
+def test_save_student_photo_thumbnails(tmp_path, monkeypatch):
+    """Test that enrollment photos are stored with small and medium thumbnails"""
+    import cv2
+    import numpy as np
+    from app.utils import photo_utils
+    monkeypatch.setattr(photo_utils, "UPLOADS_DIR", str(tmp_path))
+    monkeypatch.setattr(photo_utils, "STUDENT_PHOTO_DIR", str(tmp_path / "students"))
+    
+    photo_path = photo_utils.save_student_photo(np.zeros((1500, 2000, 3), dtype=np.uint8), 7)
+    assert max(cv2.imread(str(tmp_path / photo_path)).shape[:2]) == 1024
+    small = photo_utils.thumbnail_path(photo_path)
+    assert small == photo_path.replace("_full.jpg", "_sm.jpg")
+    assert min(cv2.imread(str(tmp_path / small)).shape[:2]) == 96
+    
+    # Photos stored before thumbnails existed are served as they are
+    assert photo_utils.thumbnail_path("students/7_ab34cd56.jpg") == "students/7_ab34cd56.jpg"
+    
+    photo_utils.delete_student_photo(photo_path)
+    assert not (tmp_path / photo_path).exists()
+    assert not (tmp_path / small).exists()
+
+def test_tracker_carries_identity_forward():
+    """Test that a stationary recognized face is not sent for recognition again until refresh"""
+    import numpy as np
+    from app.ai.tracker import FaceTracker
+    tracker = FaceTracker(iou_threshold=0.3, max_missed=1, refresh_s=3.0, retry_s=0.5)
+    
+    track = tracker.update([np.array([100, 100, 200, 200])])[0]
+    assert tracker.needs_recognition(track, now=0.0)
+    tracker.set_identity(track, 12, 0.8, now=0.0)
+    
+    moved = tracker.update([np.array([105, 102, 205, 202]), np.array([400, 100, 500, 200])])
+    assert moved[0] is track and moved[1] is not track
+    assert not tracker.needs_recognition(track, now=1.0)
+    assert tracker.needs_recognition(track, now=3.5)
+    assert tracker.needs_recognition(moved[1], now=1.0)
+    
+    tracker.update([])
+    tracker.update([])
+    assert tracker.tracks == []
+
+def test_embedding_cache_lru_and_ttl(monkeypatch):
+    """Test that the embedding cache evicts least recently used entries and expires old ones"""
+    import numpy as np
+    from app.ai import embedding_cache as cache_module
+    cache = cache_module.EmbeddingCache(max_entries=2, ttl_s=10.0)
+    clock = [0.0]
+    monkeypatch.setattr(cache_module.time, "monotonic", lambda: clock[0])
+    
+    for name in ["a", "b"]:
+        cache.put(cache.key_for_bytes(name.encode()), np.zeros(512, dtype=np.float32), "ok")
+    assert cache.get(cache.key_for_bytes(b"a")) is not None
+    cache.put(cache.key_for_bytes(b"c"), np.zeros(512, dtype=np.float32), "ok")
+    assert cache.get(cache.key_for_bytes(b"b")) is None
+    
+    clock[0] = 11.0
+    assert cache.get(cache.key_for_bytes(b"a")) is None
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["evictions"] == 1 and stats["expirations"] == 1
+
+def test_optimized_graph_cache_reused(tmp_path, monkeypatch):
+    """Test that the optimized graph is saved once, then loaded with the original preprocessing"""
+    import numpy as np
+    import onnx
+    from onnx import helper, numpy_helper, TensorProto
+    from app.ai.insightface_model import load_onnx_model
+    from app.core.config import settings
+    # Recognition-shaped graph whose leading Sub/Mul tells insightface the input is pre-normalized
+    nodes = [
+        helper.make_node('Sub', ['data', 'c'], ['sub'], name='Sub_0'),
+        helper.make_node('Mul', ['sub', 'c'], ['mul'], name='Mul_1'),
+        helper.make_node('Flatten', ['mul'], ['flat']),
+        helper.make_node('Gemm', ['flat', 'w'], ['out'], transB=1),
+    ]
+    graph = helper.make_graph(
+        nodes, 'rec',
+        [helper.make_tensor_value_info('data', TensorProto.FLOAT, ['N', 3, 112, 112])],
+        [helper.make_tensor_value_info('out', TensorProto.FLOAT, ['N', 512])],
+        [numpy_helper.from_array(np.float32(127.5), 'c'), numpy_helper.from_array(np.ones((512, 3 * 112 * 112), np.float32), 'w')]
+    )
+    model_file = str(tmp_path / "rec.onnx")
+    proto = helper.make_model(graph, opset_imports=[helper.make_opsetid('', 13)])
+    proto.ir_version = 8
+    onnx.save(proto, model_file)
+    monkeypatch.setattr(settings, "onnx_optimized_model_dir", str(tmp_path / "optimized"))
+    
+    first, first_status = load_onnx_model(model_file)
+    second, second_status = load_onnx_model(model_file)
+    assert (first_status, second_status) == ("written", "hit")
+    assert second.model_file != model_file
+    assert (second.input_mean, second.input_std) == (first.input_mean, first.input_std)
+
+def test_latency_window_expires_old_samples(monkeypatch):
+    """Test that readiness latency only reflects recent inferences"""
+    from app.ai import latency
+    from app.ai.latency import LatencyWindow
+    now = [1000.0]
+    monkeypatch.setattr(latency.time, "monotonic", lambda: now[0])
+    window = LatencyWindow(max_age_s=60)
+    for milliseconds in range(1, 101):
+        window.record(float(milliseconds))
+    assert window.stats()["samples"] == 100
+    assert window.stats()["p95_ms"] == 95.05
+    
+    now[0] += 61
+    assert window.stats() == {"samples": 0, "p50_ms": None, "p95_ms": None}
+
+def test_session_pool_runs_inferences_in_parallel():
+    """Test that each concurrent caller gets its own copy and callers wait when all are busy"""
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    from app.ai.session_pool import SessionPool
+    pool = SessionPool(["a", "b"])
+    both_busy = threading.Barrier(2, timeout=5)
+    
+    def infer(_):
+        with pool.checkout() as session:
+            both_busy.wait()
+            return session
+    
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        assert sorted(executor.map(infer, range(2))) == ["a", "b"]
+    
+    single = SessionPool(["only"])
+    def borrow():
+        with single.checkout():
+            pass
+    
+    with single.checkout():
+        waiter = threading.Thread(target=borrow)
+        waiter.start()
+        waiter.join(timeout=0.1)
+        assert waiter.is_alive()
+    waiter.join(timeout=5)
+    assert single.stats()["contended_checkouts"] == 1
+
+def test_face_executor_limits_concurrency():
+    """Test that at most max_concurrency calls run at once and the rest are counted as waiting"""
+    import asyncio
+    import threading
+    from app.core.executor import FaceExecutor
+    executor = FaceExecutor(workers=4, max_concurrency=2)
+    release = threading.Event()
+    lock = threading.Lock()
+    running = {"now": 0, "peak": 0}
+    
+    def work(value):
+        with lock:
+            running["now"] += 1
+            running["peak"] = max(running["peak"], running["now"])
+        release.wait(timeout=5)
+        with lock:
+            running["now"] -= 1
+        return value * 2
+    
+    async def main():
+        tasks = [asyncio.create_task(executor.run(work, value)) for value in range(5)]
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if running["now"] == 2:
+                break
+        counters = (executor.in_flight, executor.waiting, running["now"])
+        release.set()
+        return counters, await asyncio.gather(*tasks)
+    
+    try:
+        counters, results = asyncio.run(main())
+    finally:
+        executor.shutdown()
+    assert counters == (5, 3, 2) and running["peak"] == 2
+    assert results == [0, 2, 4, 6, 8] and executor.in_flight == 0 and executor.waiting == 0
+
+def test_recognition_batcher_batches_concurrent_requests():
+    """Test that requests share a batch, a lone request is not delayed, errors reach every caller and stop() joins the workers"""
+    import threading
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    import numpy as np
+    from app.ai.batcher import RecognitionBatcher
+    batches = []
+    def embed(crops):
+        batches.append(len(crops))
+        if any(crop[0] < 0 for crop in crops):
+            raise ValueError("bad crop")
+        return np.stack(crops) * 2
+    batcher = RecognitionBatcher(embed, max_batch_size=16, max_wait_ms=2000)
+    
+    def request(crops, delay=0.0):
+        time.sleep(delay)
+        try:
+            return batcher.embed([np.full(2, value, dtype=np.float32) for value in crops])
+        finally:
+            batcher.request_finished()
+    
+    try:
+        # A lone request is embedded at once, not after max_wait
+        batcher.request_started()
+        started = time.perf_counter()
+        assert request([1, 2, 3])[:, 0].tolist() == [2, 4, 6]
+        assert time.perf_counter() - started < 1 and batches == [3]
+        
+        # A batch holding more crops than there are requests still waits for the request yet to submit
+        batches.clear()
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            for _ in range(4):
+                batcher.request_started()
+            results = list(executor.map(request, [[1, 2, 3], [4], [5], [6]], [0, 0.05, 0.1, 0.15]))
+        assert batches == [6] and [result[:, 0].tolist() for result in results] == [[2, 4, 6], [8], [10], [12]]
+        
+        # A failed batch fails every request in it
+        batches.clear()
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            for _ in range(2):
+                batcher.request_started()
+            futures = [executor.submit(request, crops, delay) for crops, delay in (([1], 0), ([-1], 0.05))]
+            for future in futures:
+                with pytest.raises(ValueError, match="bad crop"):
+                    future.result(timeout=5)
+        assert batches == [2] and batcher.stats()["active_requests"] == 0
+        
+        threads = list(batcher._threads)
+        batcher.stop()
+        assert batcher._threads == [] and not any(thread.is_alive() for thread in threads)
+        # The next submit starts fresh workers
+        assert batcher.embed([np.ones(2, dtype=np.float32)])[0, 0] == 2
+    finally:
+        batcher.stop()
+
+def test_bulk_enrollment_duplicate_check(monkeypatch):
+    """Test that a batch is checked against the gallery and itself, ignoring a student's own faces"""
+    import numpy as np
+    from app.ai.gallery import face_gallery
+    from app.ai.matcher import normalize_embeddings
+    from app.services.enrollment_service import _find_duplicates
+    from app.utils.archive_utils import student_id_candidates
+    assert student_id_candidates("photos/STU001_2.jpg") == ["STU001_2", "STU001"]
+    
+    faces = normalize_embeddings(np.random.rand(4, 512) - 0.5)
+    monkeypatch.setattr(face_gallery, "snapshot", lambda class_id=None: (faces[:2], np.array([1, 2])))
+    # Student 1 re-enrolls, 3 reuses student 2's face, 4 and 5 share a new face, 6 is new
+    batch = np.stack([faces[0], faces[1], faces[2], faces[2], faces[3]])
+    results = _find_duplicates(batch, np.array([1, 3, 4, 5, 6]))
+    assert [kind for kind, _, _ in results] == [None, "gallery", None, "batch", None]
+    assert results[1][1] == 2 and results[3][1] == 2
+
+def test_bulk_enrollment_writes_photos_only_for_accepted_students(tmp_path, monkeypatch, stub_face_model, seeded_db):
+    """Test that bulk enrollment runs on the shared face executor and stores one profile photo per accepted student"""
+    import asyncio
+    import os
+    from sqlalchemy.orm import sessionmaker
+    from app.ai.gallery import FaceGallery
+    from app.ai.stub_model import synthetic_jpeg
+    from app.core.executor import FaceExecutor
+    from app.db import models
+    from app.services import enrollment_service, face_service
+    from app.utils import photo_utils
+    gallery = FaceGallery()
+    for module in (enrollment_service, face_service):
+        monkeypatch.setattr(module, "face_gallery", gallery)
+    executor = FaceExecutor(2, 4)
+    monkeypatch.setattr(enrollment_service, "face_executor", executor)
+    monkeypatch.setattr(photo_utils, "UPLOADS_DIR", str(tmp_path))
+    monkeypatch.setattr(photo_utils, "STUDENT_PHOTO_DIR", str(tmp_path / "students"))
+    
+    # S2 reuses the face of S1, S1_2 is a second photo of student 1
+    photos = {"S1.jpg": synthetic_jpeg(1), "S2.jpg": synthetic_jpeg(1), "S1_2.jpg": synthetic_jpeg(3), "S9.jpg": synthetic_jpeg(4)}
+    entries = [(name, len(data), lambda data=data: data) for name, data in photos.items()]
+    db = sessionmaker(bind=seeded_db)()
+    try:
+        success, message, report = asyncio.run(enrollment_service.enroll_bulk(entries, db))
+        assert success and [entry["status"] for entry in report] == ["enrolled", "duplicate", "enrolled", "unknown_student"]
+        student = db.get(models.Student, 1)
+        assert student.face_enrolled and not db.get(models.Student, 2).face_enrolled
+        assert len(db.query(models.FaceEmbedding).filter_by(student_id=1).all()) == 2
+        # The profile photo and its thumbnails, nothing for the duplicate
+        assert sorted(os.listdir(tmp_path / "students")) == sorted(
+            os.path.basename(path) for path in (student.photo_path, photo_utils.thumbnail_path(student.photo_path, "sm"), photo_utils.thumbnail_path(student.photo_path, "md"))
+        )
+        assert gallery.student_count == 1 and executor.in_flight == 0
+    finally:
+        db.close()
+        executor.shutdown()
+
+def test_reembedding_templates_filtered_by_model(monkeypatch):
+    """Test that only templates of the serving recognizer count, so a re-embedding job's rows wait for the switch"""
+    import numpy as np
+    from app.ai.embedding import is_current_model
+    from app.core.config import settings
+    monkeypatch.setattr(settings, "insightface_model_name", "buffalo_l")
+    monkeypatch.setattr(settings, "insightface_recognizer_pack", "")
+    embedding = np.random.rand(512).astype(np.float32)
+    current, upgraded = embedding_to_bytes(embedding), embedding_to_bytes(embedding, model_name="antelopev2")
+    assert is_current_model(current) and is_current_model(None)  # Legacy JSON rows belong to the default pack
+    assert not is_current_model(upgraded) and is_current_model(upgraded, "antelopev2")
+    
+    # After the switch the old templates drop out
+    monkeypatch.setattr(settings, "insightface_recognizer_pack", "antelopev2")
+    assert is_current_model(upgraded) and not is_current_model(current) and not is_current_model(None)
+
+def test_reembedding_refuses_switch_with_failures(tmp_path, monkeypatch):
+    """Test that a job with students left without a new template does not switch unless forced"""
+    from app.core.config import settings
+    from app.services import reembedding_service
+    monkeypatch.setattr(settings, "insightface_recognizer_pack", "")
+    monkeypatch.setattr(reembedding_service, "SessionLocal", lambda: type("Db", (), {"close": lambda self: None})())
+    monkeypatch.setattr(reembedding_service, "pending_students", lambda db, pack: (2, [(7, None)]))
+    
+    for force, expected in ((False, "incomplete"), (True, "completed")):
+        job = reembedding_service.ReembeddingJob(str(tmp_path / f"job_{force}.json"))
+        switched = []
+        
+        def run_pass(pack, skipped, job=job):
+            # One student embedded, one without a photo, then nothing left
+            job._record_batch(1, {7: "No stored photo"})
+            return False
+        
+        monkeypatch.setattr(job, "_run_pass", run_pass)
+        monkeypatch.setattr(job, "_switch", switched.append)
+        job.state = {"status": "running", "source_pack": "buffalo_l", "target_pack": "antelopev2", "done": 0, "failed": 0, "failures": {}}
+        job._recognizer = object()
+        job._run("antelopev2", force)
+        state = job.status()
+        assert state["status"] == expected and state["failed"] >= 1 and state["remaining"] == 1
+        assert switched == ([] if expected == "incomplete" else ["antelopev2"])
+        assert job._recognizer is None
+
+def test_reembedding_catch_up_reaches_the_gallery(tmp_path, monkeypatch, stub_face_model, seeded_db):
+    """Test that students re-embedded once the target pack is served are matchable without a restart"""
+    from sqlalchemy.orm import sessionmaker
+    from app.ai import insightface_model
+    from app.ai.gallery import FaceGallery
+    from app.ai.stub_model import StubRecognizer, synthetic_jpeg
+    from app.core.config import settings
+    from app.db import crud, models
+    from app.services import face_service, reembedding_service
+    from app.utils.image_utils import load_image
+    session_factory = sessionmaker(bind=seeded_db)
+    gallery = FaceGallery()
+    for module in (face_service, reembedding_service):
+        monkeypatch.setattr(module, "face_gallery", gallery)
+    monkeypatch.setattr(reembedding_service, "SessionLocal", session_factory)
+    monkeypatch.setattr(reembedding_service, "UPLOADS_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "insightface_model_name", "buffalo_l")
+    monkeypatch.setattr(settings, "insightface_recognizer_pack", "")
+    monkeypatch.setattr(stub_face_model, "packs", None)
+    # The target pack's recognizer is another stub projection
+    target_recognizer = lambda pack, tasknames, **kwargs: {'recognition': (StubRecognizer(seed=1), 'off')}
+    for module in (insightface_model, reembedding_service):
+        monkeypatch.setattr(module, "load_pack_modules", target_recognizer)
+    with seeded_db.begin() as connection:
+        connection.execute(models.Student.__table__.insert(), [{"id": 3, "student_id": "S3", "full_name": "Student 3", "class_id": 1}])
+    
+    def enroll(db, student_id):
+        # A template of the old recognizer and the photo the job re-embeds
+        with open(tmp_path / f"{student_id}.jpg", 'wb') as f:
+            f.write(synthetic_jpeg(student_id))
+        image, _ = load_image(synthetic_jpeg(student_id))
+        crud.add_face_embeddings(db, [(student_id, embedding_to_bytes(generate_embedding(image)[0], model_name="buffalo_l"))])
+        crud.update_student_face_enrolled(db, student_id, True, photo_path=f"{student_id}.jpg")
+    
+    def probe(student_id):
+        image, _ = load_image(synthetic_jpeg(student_id))
+        return gallery.search(generate_embedding(image)[0])
+    
+    db = session_factory()
+    try:
+        enroll(db, 1)
+        job = reembedding_service.ReembeddingJob(str(tmp_path / "job.json"))
+        switch = job._switch
+        
+        def switch_after_late_enrollment(pack):
+            # Student 2 is enrolled with the old recognizer after the last pass
+            enroll(db, 2)
+            switch(pack)
+        
+        monkeypatch.setattr(job, "_switch", switch_after_late_enrollment)
+        job.state = {"status": "running", "source_pack": "buffalo_l", "target_pack": "antelopev2", "done": 0, "failed": 0, "failures": {}}
+        job._run("antelopev2")
+        assert job.state["status"] == "completed" and settings.recognition_model_name == "antelopev2"
+        assert probe(2)[0] == 2 and probe(2)[2] and probe(1)[0] == 1
+        
+        # A completed job catches up on a start, after the gallery was loaded
+        enroll(db, 3)
+        job.resume()
+        job._thread.join()
+        assert job.state["status"] == "completed"
+        student_id, _, is_match = probe(3)
+        assert student_id == 3 and is_match and gallery.student_count == 3
+    finally:
+        db.close()
+
+def test_template_tagged_with_the_recognizer_that_produced_it(monkeypatch, seeded_db):
+    """Test that an enrollment in flight across a recognizer switch keeps the old pack's tag and cache keys"""
+    import numpy as np
+    from sqlalchemy.orm import sessionmaker
+    from app.ai.embedding import embedding_model_tag
+    from app.ai.embedding_cache import EmbeddingCache
+    from app.ai.gallery import FaceGallery
+    from app.ai.stub_model import synthetic_jpeg
+    from app.core.config import settings
+    from app.db import models
+    from app.services import face_service
+    monkeypatch.setattr(settings, "insightface_model_name", "buffalo_l")
+    monkeypatch.setattr(settings, "insightface_recognizer_pack", "")
+    monkeypatch.setattr(face_service, "face_gallery", FaceGallery())
+    monkeypatch.setattr(face_service, "embedding_cache", EmbeddingCache())
+    monkeypatch.setattr(face_service.face_executor, "submit_background", lambda *args: None)
+    
+    def embed_during_switch(image):
+        # The re-embedding job switches while the old recognizer is embedding this upload
+        settings.insightface_recognizer_pack = "antelopev2"
+        return np.random.default_rng(0).standard_normal(512).astype(np.float32), "ok"
+    
+    monkeypatch.setattr(face_service, "generate_embedding", embed_during_switch)
+    db = sessionmaker(bind=seeded_db)()
+    try:
+        success, message = face_service.FaceService()._register_face(synthetic_jpeg(1), 1, db)
+        assert success, message
+        assert [embedding_model_tag(row.embedding_blob) for row in db.query(models.FaceEmbedding).all()] == ["buffalo_l"]
+        assert len(face_service.face_gallery) == 0
+        # The old recognizer's cached result is not reused for the new one
+        assert face_service.embed_upload(synthetic_jpeg(1))[3] == "antelopev2" and face_service.embedding_cache.hits == 0
+    finally:
+        db.close()
+
+def test_duplicate_audit_blocks_match_brute_force(tmp_path):
+    """Test that blocked all-pairs search finds every pair once, and incremental runs only recompare changed students"""
+    import numpy as np
+    from app.ai.duplicate_audit import DuplicateAudit, similar_pairs
+    from app.ai.matcher import normalize_embeddings
+    rng = np.random.default_rng(0)
+    matrix = normalize_embeddings(rng.normal(size=(50, 8)).astype(np.float32))
+    sims = matrix @ matrix.T
+    expected = {(i, j) for i in range(50) for j in range(i + 1, 50) if sims[i, j] >= 0.5}
+    found = [(i, j) for rows, cols, _ in similar_pairs(matrix, 0.5, block_size=7) for i, j in zip(rows.tolist(), cols.tolist())]
+    assert len(found) == len(set(found)) and set(found) == expected
+    changed = [(min(i, j), max(i, j)) for rows, cols, _ in similar_pairs(matrix, 0.5, rows=np.array([3, 9]), block_size=7)
+               for i, j in zip(rows.tolist(), cols.tolist())]
+    assert len(changed) == len(set(changed)) and set(changed) == {pair for pair in expected if 3 in pair or 9 in pair}
+    
+    audit = DuplicateAudit(str(tmp_path / "audit.npz"))
+    student_ids = np.arange(100, 150, dtype=np.int64)
+    assert audit.run(matrix, student_ids, 0.5, "buffalo_l")[3]["mode"] == "full"
+    matrix[3] = matrix[40]
+    pair_a, pair_b, _, summary = audit.run(matrix, student_ids, 0.5, "buffalo_l")
+    assert summary["mode"] == "incremental" and summary["compared_students"] == 1
+    assert (103, 140) in set(zip(pair_a.tolist(), pair_b.tolist()))
+
+    # "max" scoring: one shared photo makes a duplicate even when the centroids are far apart
+    templates = normalize_embeddings(rng.normal(size=(12, 8)).astype(np.float32))
+    templates[5] = templates[0]
+    owners = np.repeat(np.arange(1, 5, dtype=np.int64), 3)
+    centroid_of = lambda student: normalize_embeddings(templates[owners == student].sum(axis=0))
+    assert float(centroid_of(1) @ centroid_of(2)) < 0.9
+    audit = DuplicateAudit(str(tmp_path / "templates.npz"))
+    pair_a, pair_b, sims, summary = audit.run(templates, owners, 0.99, "buffalo_l", "max")
+    assert list(zip(pair_a.tolist(), pair_b.tolist())) == [(1, 2)] and sims[0] > 0.99 and summary["students"] == 4
+    templates[11] = templates[3]
+    pair_a, pair_b, _, summary = audit.run(templates, owners, 0.99, "buffalo_l", "max")
+    assert summary["compared_students"] == 1 and list(zip(pair_a.tolist(), pair_b.tolist())) == [(1, 2), (2, 4)]
+
+def test_validate_single_face():
+    """Test that enrollment and verify photos need exactly one detected face"""
+    from types import SimpleNamespace
+    face = SimpleNamespace(bbox=[0, 0, 10, 10], det_score=0.9)
+    assert validate_single_face([]) == (False, "No face detected in image")
+    ok, message = validate_single_face([face, face])
+    assert not ok and "Multiple faces" in message
+    assert validate_single_face([face])[0]
+
+def test_quality_gate_rejects_before_recognition(monkeypatch):
+    """Test that blurry or turned faces are rejected on the detection, without running the recognition model"""
+    import cv2
+    import numpy as np
+    from types import SimpleNamespace
+    from insightface.utils import face_align
+    from app.ai.insightface_model import face_model
+    from app.ai.session_pool import SessionPool
+    from app.ai.validator import estimate_pose
+    
+    yaw, pitch = estimate_pose(face_align.arcface_dst)
+    assert abs(yaw) < 1 and abs(pitch) < 1
+    turned = face_align.arcface_dst.copy()
+    turned[2, 0] += 15  # Nose towards one eye
+    assert abs(estimate_pose(turned)[0]) > 45
+    
+    kps = face_align.arcface_dst * 2 + np.array([200.0, 120.0])
+    def fake_detect(image, input_size=None, max_num=0, metric='default'):
+        return np.array([[200, 100, 400, 340, 0.9]], dtype=np.float32), kps[None].astype(np.float32)
+    embedded = []
+    batcher = SimpleNamespace(
+        request_started=lambda: None, request_finished=lambda: None,
+        embed=lambda crops: embedded.append(len(crops)) or np.ones((len(crops), 512), dtype=np.float32)
+    )
+    monkeypatch.setattr(face_model, "_pool", SessionPool([SimpleNamespace(
+        det_model=SimpleNamespace(detect=fake_detect), models={'recognition': SimpleNamespace(input_size=(112, 112))}
+    )]))
+    monkeypatch.setattr(face_model, "_model", face_model._pool.sessions[0])
+    monkeypatch.setattr(face_model, "_batcher", batcher)
+    image = cv2.GaussianBlur(np.random.default_rng(0).integers(0, 255, (480, 640, 3), dtype=np.uint8), (3, 3), 0)
+    
+    embedding, message = generate_embedding(cv2.GaussianBlur(image, (31, 31), 0))
+    assert embedding is None and "blurry" in message and embedded == []
+    embedding, message = generate_embedding(image)
+    assert embedding is not None and embedded == [1]
+
+def test_stub_model_embeds_without_weights(stub_face_model):
+    """Test that the stub model runs the real pipeline and the same synthetic photo matches itself"""
+    from app.ai.stub_model import synthetic_jpeg
+    from app.utils.image_utils import load_image
+    
+    embeddings = []
+    for seed, quality in ((1, 90), (1, 70), (2, 90)):
+        image, _ = load_image(synthetic_jpeg(seed, quality=quality))
+        embedding, message = generate_embedding(image)
+        assert embedding is not None, message
+        embeddings.append(embedding)
+    
+    assert cosine_similarity(embeddings[0], embeddings[1]) > 0.9
+    assert abs(cosine_similarity(embeddings[0], embeddings[2])) < 0.3
+
+def test_stub_model_setting_skips_weights(monkeypatch):
+    """Test that INSIGHTFACE_STUB_MODEL makes load_model serve the stub, as the load test server does"""
+    import numpy as np
+    from app.ai.insightface_model import face_model
+    from app.ai.stub_model import StubRecognizer
+    from app.core.config import settings
+    
+    for attribute in ("_pool", "_model", "_batcher"):
+        monkeypatch.setattr(face_model, attribute, None)
+    monkeypatch.setattr(settings, "insightface_stub_model", True)
+    monkeypatch.setattr(settings, "insightface_stub_recognition_ms", 1.0)
+    face_model.load_model()
+    try:
+        recognizer = face_model.get_model().models['recognition']
+        assert isinstance(recognizer, StubRecognizer) and recognizer.latency_ms == 1.0
+        assert face_model.embed_crops([np.zeros((112, 112, 3), dtype=np.uint8)]).shape == (1, 512)
+    finally:
+        face_model._batcher.stop()
+
+def test_recognition_stream_auth_dropping_and_auto_mark(monkeypatch, stub_face_model, seeded_db):
+    """Test the kiosk stream: token rejection, newest-frame-only processing, and no duplicate attendance on auto-mark"""
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from starlette.websockets import WebSocketDisconnect
+    from sqlalchemy.orm import sessionmaker
+    from app.ai.embedding import embedding_to_bytes, generate_embedding
+    from app.ai.gallery import FaceGallery
+    from app.ai.stub_model import install_stub_model, synthetic_jpeg, synthetic_photo
+    from app.api import face as face_api
+    from app.core import security
+    from app.core.executor import FaceExecutor
+    from app.db import models
+    from app.services import face_service
+    engine = seeded_db
+    session_factory = sessionmaker(bind=engine)
+    gallery = FaceGallery()
+    for module in (face_api, face_service):
+        monkeypatch.setattr(module, "SessionLocal", session_factory)
+        monkeypatch.setattr(module, "face_gallery", gallery)
+    monkeypatch.setattr(face_api, "face_executor", FaceExecutor(2, 4))
+    install_stub_model(stub_face_model, detection_ms=100)
+    
+    # The stub finds one face in the middle of the frame: two frame sizes keep the two students' tracks apart
+    sizes = {1: (320, 240), 2: (640, 480)}
+    with engine.begin() as connection:
+        connection.execute(models.Student.__table__.update().values(face_enrolled=True))
+        connection.execute(models.FaceEmbedding.__table__.insert(), [
+            {"student_id": student_id, "embedding_blob": embedding_to_bytes(generate_embedding(synthetic_photo(student_id, *size))[0]), "source": "enrollment"}
+            for student_id, size in sizes.items()
+        ])
+    app = FastAPI()
+    app.include_router(face_api.router)
+    client = TestClient(app)
+    try:
+        monkeypatch.setattr(security, "DEV_MODE", False)
+        with pytest.raises(WebSocketDisconnect) as rejected:
+            with client.websocket_connect("/face/stream?class_id=1") as ws:
+                ws.receive_json()
+        assert rejected.value.code == 1008
+        monkeypatch.setattr(security, "DEV_MODE", True)
+        
+        with client.websocket_connect("/face/stream?class_id=1") as ws:
+            assert ws.receive_json() == {"type": "ready", "class_id": 1, "enrolled": 2}
+            for _ in range(4):
+                ws.send_bytes(synthetic_jpeg(2, *sizes[2]))
+            results = [ws.receive_json()]
+            while results[-1]["frame"] < 4:
+                results.append(ws.receive_json())
+            # Frames arriving during the 100 ms detection replaced each other
+            assert len(results) < 4 and results[-1]["dropped"] >= 1
+            assert results[0]["faces"][0]["student_id"] == 2 and not results[0]["faces"][0]["attendance_marked"]
+        
+        with client.websocket_connect("/face/stream?class_id=1&auto_mark=true") as ws:
+            ws.receive_json()
+            # Student 1 is marked by another kiosk after this stream loaded today's attendance
+            with engine.begin() as connection:
+                connection.execute(models.Attendance.__table__.insert(), [{"student_id": 1, "class_id": 1, "confidence_score": 0.9}])
+            for student_id in (2, 1):
+                ws.send_bytes(synthetic_jpeg(student_id, *sizes[student_id]))
+                face = ws.receive_json()["faces"][0]
+                assert face["student_id"] == student_id and face["attendance_marked"]
+                assert face["already_present"] == (student_id == 1)
+        
+        db = session_factory()
+        try:
+            marked = [record.student_id for record in db.query(models.Attendance).all()]
+        finally:
+            db.close()
+        assert sorted(marked) == [1, 2]
+    finally:
+        face_api.face_executor.shutdown()
+
+def test_schema_check_and_legacy_embedding_migration(tmp_path, monkeypatch):
+    """Test that an old database fails startup with the migration to run, and migrated JSON rows keep the default pack tag"""
+    import json
+    import sqlite3
+    import numpy as np
+    from sqlalchemy import create_engine
+    from app.ai.embedding import embedding_model_tag
+    from app.core.config import settings
+    from app.db.base import check_schema
+    import migrate_embedding_blob
+    path = str(tmp_path / "old.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE face_embeddings (id INTEGER NOT NULL, student_id INTEGER NOT NULL, embedding TEXT NOT NULL, "
+                 "created_at DATETIME, updated_at DATETIME, PRIMARY KEY (id), UNIQUE (student_id))")
+    conn.execute("INSERT INTO face_embeddings (id, student_id, embedding) VALUES (1, 1, ?)", (json.dumps(np.random.rand(512).tolist()),))
+    conn.commit()
+    engine = create_engine(f"sqlite:///{path}")
+    with pytest.raises(RuntimeError, match="migrate_embedding_blob.py, then python migrate_face_templates.py"):
+        check_schema(engine)
+    
+    # A later recognizer is configured, but the JSON rows came from the default pack
+    monkeypatch.setattr(settings, "insightface_recognizer_pack", "antelopev2")
+    migrate_embedding_blob.upgrade_schema(conn.cursor())
+    assert migrate_embedding_blob.convert_rows(conn) == 1
+    blob = conn.execute("SELECT embedding_blob FROM face_embeddings").fetchone()[0]
+    assert embedding_model_tag(blob) == settings.insightface_model_name
+    conn.close()
+    with pytest.raises(RuntimeError, match="face_embeddings.source") as error:
+        check_schema(engine)
+    assert "migrate_embedding_blob" not in str(error.value)
+    engine.dispose()
+
+def test_threshold_evaluation_matches_brute_force():
+    """Test the histogram FAR/FRR, EER and rank-1 accuracy against scoring every pair in a loop"""
+    import numpy as np
+    import evaluate_threshold
+    from app.ai.matcher import normalize_embeddings
+    rng = np.random.default_rng(0)
+    labels = np.repeat(np.arange(30), 4)
+    centers = rng.standard_normal((30, 64))
+    embeddings = normalize_embeddings(centers[labels] + 0.9 * rng.standard_normal((120, 64)))
+    # A duplicate photo: float32 rounding can score it just above 1.0
+    embeddings[1] = embeddings[0] * np.float32(1.0001)
+    
+    genuine_scores, impostor_scores = [], []
+    for i in range(120):
+        for j in range(i + 1, 120):
+            score = min(max(float(embeddings[i] @ embeddings[j]), -1.0), 1.0)
+            (genuine_scores if labels[i] == labels[j] else impostor_scores).append(score)
+    genuine_scores, impostor_scores = np.array(genuine_scores), np.array(impostor_scores)
+    
+    genuine, impostor = evaluate_threshold.score_histograms(labels, embeddings)
+    assert genuine.sum() == len(genuine_scores) and impostor.sum() == len(impostor_scores)
+    thresholds, far, frr = evaluate_threshold.error_rates(genuine, impostor)
+    # Scores within one bin of an edge may fall either side of it in float32
+    width = evaluate_threshold.SCORE_BINS[1] - evaluate_threshold.SCORE_BINS[0]
+    for index in range(0, len(thresholds), 50):
+        t = thresholds[index]
+        assert np.mean(impostor_scores >= t + width) - 1e-9 <= far[index] <= np.mean(impostor_scores >= t - width) + 1e-9
+        assert np.mean(genuine_scores < t - width) - 1e-9 <= frr[index] <= np.mean(genuine_scores < t + width) + 1e-9
+    
+    brute_far = np.array([np.mean(impostor_scores >= t) for t in thresholds])
+    brute_frr = np.array([np.mean(genuine_scores < t) for t in thresholds])
+    brute_index = int(np.argmin(np.abs(brute_far - brute_frr)))
+    eer, eer_threshold = evaluate_threshold.equal_error_rate(thresholds, far, frr)
+    assert abs(eer - (brute_far[brute_index] + brute_frr[brute_index]) / 2) < 0.01
+    assert abs(eer_threshold - thresholds[brute_index]) <= 0.01
+    
+    gallery_rows, probe_rows = list(range(0, 120, 4)), [row for row in range(120) if row % 4]
+    rates = evaluate_threshold.identification_rates(labels, embeddings, gallery_rows, probe_rows, 0.5)
+    correct = accepted_correct = accepted_wrong = 0
+    for probe in probe_rows:
+        best = max(gallery_rows, key=lambda row: float(embeddings[probe] @ embeddings[row]))
+        hit, accepted = labels[best] == labels[probe], float(embeddings[probe] @ embeddings[best]) >= 0.5
+        correct += hit
+        accepted_correct += hit and accepted
+        accepted_wrong += accepted and not hit
+    assert rates["rank1_accuracy"] == round(correct / len(probe_rows), 4)
+    assert rates["identification_rate"] == round(accepted_correct / len(probe_rows), 4)
+    assert rates["false_identification_rate"] == round(accepted_wrong / len(probe_rows), 4)
+    assert evaluate_threshold.rank1_accuracy(labels, embeddings, 30, 0.5)["probes"] == 90
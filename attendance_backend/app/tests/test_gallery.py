@@ -0,0 +1,132 @@
+"""In-memory face gallery unit tests"""
+import numpy as np
+from app.ai.gallery import FaceGallery
+
+def _random_embeddings(count, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.standard_normal((count, 512)).astype(np.float32)
+
+def test_search_finds_enrolled_student():
+    """Test that a probe matches its own enrolled embedding"""
+    embeddings = _random_embeddings(20)
+    gallery = FaceGallery()
+    gallery.load((100 + i, i % 3, embeddings[i]) for i in range(20))
+    
+    student_id, similarity, is_match = gallery.search(embeddings[7] * 3.0)
+    assert student_id == 107
+    assert is_match
+    assert similarity > 0.99
+
+def test_class_slices_and_moves():
+    """Test class filtering, class moves and removals"""
+    embeddings = _random_embeddings(6, seed=1)
+    gallery = FaceGallery()
+    gallery.load((i, 1 if i < 3 else 2, embeddings[i]) for i in range(6))
+    
+    assert sorted(gallery.snapshot(1)[1].tolist()) == [0, 1, 2]
+    student_id, _, is_match = gallery.search(embeddings[4], class_id=1)
+    assert student_id != 4 and not is_match
+    
+    gallery.move(4, 1)
+    student_id, _, is_match = gallery.search(embeddings[4], class_id=1)
+    assert student_id == 4 and is_match
+    
+    gallery.remove_class(1)
+    assert len(gallery) == 2
+    assert len(gallery.snapshot(1)[1]) == 0
+
+def test_set_templates_replaces_and_exclude():
+    """Test replacing a student's templates and excluding them from search"""
+    embeddings = _random_embeddings(3, seed=2)
+    gallery = FaceGallery()
+    gallery.load([(1, 1, embeddings[0])])
+    gallery.set_templates(1, 1, [embeddings[1]])
+    gallery.set_templates(2, 1, [embeddings[2]])
+    assert len(gallery) == 2
+    
+    student_id, _, _ = gallery.search(embeddings[1])
+    assert student_id == 1
+    student_id, _, _ = gallery.search(embeddings[1], exclude_student_id=1)
+    assert student_id == 2
+    
+    gallery.remove(1)
+    assert gallery.snapshot()[1].tolist() == [2]
+
+def test_ann_index_search_and_persistence(tmp_path, monkeypatch):
+    """Test IVF-backed school-wide search, incremental updates and reload from disk"""
+    from app.core.config import settings
+    rng = np.random.default_rng(3)
+    centers = rng.standard_normal((20, 512))
+    embeddings = (centers[rng.integers(0, 20, 2000)] + 0.8 * rng.standard_normal((2000, 512))).astype(np.float32)
+    
+    monkeypatch.setattr(settings, "ann_min_gallery_size", 1000)
+    monkeypatch.setattr(settings, "ann_index_path", str(tmp_path / "ann_index.npz"))
+    gallery = FaceGallery()
+    gallery.load((i, i % 10, embeddings[i]) for i in range(2000))
+    assert gallery.ann_index is not None
+    assert (tmp_path / "ann_index.npz").exists()
+        
+    student_id, _, is_match = gallery.search(embeddings[42])
+    assert student_id == 42 and is_match
+    assert 42 in gallery.ann_index.probe(embeddings[42], 0)
+        
+    gallery.set_templates(5000, 1, [embeddings[7]])
+    gallery.remove(7)
+    assert gallery.search(embeddings[7])[0] == 5000
+        
+    # Student 3 was re-enrolled with another face while the index was on disk
+    reloaded = FaceGallery()
+    reloaded.load((i, i % 10, embeddings[1500 if i == 3 else i]) for i in range(1500))
+    assert len(reloaded.ann_index) == 1500
+    nearest = int(np.argmax(reloaded.ann_index.centroids @ embeddings[1500] / np.linalg.norm(embeddings[1500])))
+    assert reloaded.ann_index._list_of[3] == nearest
+    assert reloaded.search(embeddings[1500])[0] == 3
+
+def test_ann_index_trained_outside_lock_and_dropped_on_removal(tmp_path, monkeypatch):
+    """Test that k-means runs without the gallery lock, changes made meanwhile reach the new index, and removals drop it"""
+    from app.ai import gallery as gallery_module
+    from app.core.config import settings
+    embeddings = _random_embeddings(120, seed=5)
+    monkeypatch.setattr(settings, "ann_min_gallery_size", 100)
+    monkeypatch.setattr(settings, "ann_index_path", str(tmp_path / "ann_index.npz"))
+    gallery = FaceGallery()
+    train = gallery_module.IVFIndex.train
+    
+    def train_during_enrollment(matrix, student_ids, nlist):
+        # Searches and enrollments are not blocked by the training
+        assert gallery._lock.acquire(blocking=False)
+        gallery._lock.release()
+        gallery.set_templates(1000, 2, [embeddings[110]])
+        gallery.remove(3)
+        return train(matrix, student_ids, nlist)
+    
+    monkeypatch.setattr(gallery_module.IVFIndex, "train", train_during_enrollment)
+    gallery.load((i, i % 2, embeddings[i]) for i in range(105))
+    assert gallery.ann_index is not None
+    indexed = set(gallery.ann_index.student_ids().tolist())
+    assert 1000 in indexed and 3 not in indexed and len(indexed) == gallery.student_count == 105
+    assert gallery.search(embeddings[110])[0] == 1000
+    
+    gallery.remove(1000)
+    gallery.remove_class(1)
+    assert gallery.student_count < 100 and gallery.ann_index is None
+
+def test_multiple_templates_max_and_centroid_scoring(monkeypatch):
+    """Test that a student matches through any template, or through the mean template"""
+    from app.core.config import settings
+    embeddings = _random_embeddings(4, seed=4)
+    rows = [(1, 1, embeddings[0]), (2, 1, embeddings[1]), (1, 1, embeddings[2]), (3, 2, embeddings[3])]
+    
+    gallery = FaceGallery()
+    gallery.load(rows)
+    assert len(gallery) == 4 and gallery.student_count == 3
+    assert gallery.search(embeddings[2])[0] == 1
+    assert len(gallery.student_templates(1)) == 2
+    
+    monkeypatch.setattr(settings, "template_scoring", "centroid")
+    gallery = FaceGallery()
+    gallery.load(rows)
+    matrix, student_ids = gallery.snapshot(1)
+    assert sorted(student_ids.tolist()) == [1, 2]
+    student_id, similarity, _ = gallery.search(embeddings[0] + embeddings[2])
+    assert student_id == 1 and similarity > 0.99
@@ -0,0 +1,49 @@
+"""Enrollment archives: student photos named by student ID, in a ZIP file or a folder"""
+import os
+import re
+import zipfile
+from typing import Callable, List, Tuple
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+# (file name, size in bytes, reader returning the file's bytes)
+ArchiveEntry = Tuple[str, int, Callable[[], bytes]]
+
+def _is_photo(name: str) -> bool:
+    base = os.path.basename(name)
+    # Skip macOS resource forks and other hidden files
+    return not base.startswith('.') and '__MACOSX' not in name and base.lower().endswith(IMAGE_EXTENSIONS)
+
+def zip_entries(archive: zipfile.ZipFile) -> List[ArchiveEntry]:
+    """Photos in a ZIP archive, read lazily so the whole archive is never held in memory"""
+    return [
+        (info.filename, info.file_size, lambda info=info: archive.read(info))
+        for info in archive.infolist()
+        if not info.is_dir() and _is_photo(info.filename)
+    ]
+
+def folder_entries(folder: str) -> List[ArchiveEntry]:
+    """Photos anywhere under a folder, read lazily"""
+    entries = []
+    for root, _, files in os.walk(folder):
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            if _is_photo(path):
+                entries.append((os.path.relpath(path, folder), os.path.getsize(path), lambda path=path: _read_file(path)))
+    return sorted(entries, key=lambda entry: entry[0])
+
+def _read_file(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
+
+def student_id_candidates(filename: str) -> List[str]:
+    """Student IDs a photo may belong to: the file name, then without a _2 / -2 photo counter
+    
+    STU001.jpg and STU001_2.jpg both enroll student STU001.
+    """
+    stem = os.path.splitext(os.path.basename(filename))[0].strip()
+    candidates = [stem]
+    without_counter = re.sub(r'[_-]\d+$', '', stem)
+    if without_counter and without_counter != stem:
+        candidates.append(without_counter)
+    return candidates
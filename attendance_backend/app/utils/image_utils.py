@@ -5,6 +5,13 @@ from typing import Optional, Tuple
 from PIL import Image
 import io
 
+# libjpeg can decode JPEGs directly at 1/2, 1/4 or 1/8 scale (DCT scaling)
+JPEG_REDUCED_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
 def preprocess_image(image_bytes: bytes) -> Optional[np.ndarray]:
     """Convert image bytes to OpenCV format"""
     try:
@@ -31,23 +38,62 @@ def validate_image_format(image_bytes: bytes) -> Tuple[bool, str]:
     try:
         # Try to open with PIL to validate format
         image = Image.open(io.BytesIO(image_bytes))
+        return _validate_header(image)
         
-        # Check if format is supported
-        if image.format not in ['JPEG', 'PNG', 'JPG']:
-            return False, "Unsupported image format. Please use JPEG or PNG"
+    except Exception as e:
+        return False, f"Invalid image file: {str(e)}"
+
+def _validate_header(image: Image.Image) -> Tuple[bool, str]:
+    """Check format and dimensions from an opened (not yet decoded) PIL image"""
+    # Check if format is supported
+    if image.format not in ['JPEG', 'PNG', 'JPG']:
+        return False, "Unsupported image format. Please use JPEG or PNG"
         
-        # Check image size
-        width, height = image.size
-        if width < 100 or height < 100:
-            return False, "Image too small. Minimum size is 100x100 pixels"
+    # Check image size
+    width, height = image.size
+    if width < 100 or height < 100:
+        return False, "Image too small. Minimum size is 100x100 pixels"
         
-        if width > 4000 or height > 4000:
-            return False, "Image too large. Maximum size is 4000x4000 pixels"
+    if width > 4000 or height > 4000:
+        return False, "Image too large. Maximum size is 4000x4000 pixels"
         
-        return True, "Image format is valid"
+    return True, "Image format is valid"
         
+def load_image(image_bytes: bytes, max_size: Optional[int] = None) -> Tuple[Optional[np.ndarray], str]:
+    """Validate and decode an upload in one pass into a single RGB buffer
+    
+    The format and dimensions are read from the header only. JPEGs larger
+    than needed are decoded directly at 1/2, 1/4 or 1/8 scale, never below
+    `max_size` on the longest side, and the BGR->RGB swap is done in place.
+    
+    Returns:
+        Tuple[image, message]: (RGB image or None, status message)
+    """
+    try:
+        # PIL parses the header lazily, no pixel data is decoded here
+        header = Image.open(io.BytesIO(image_bytes))
+        is_valid, message = _validate_header(header)
+        if not is_valid:
+            return None, message
+        
+        flags = cv2.IMREAD_COLOR
+        if max_size and header.format == 'JPEG':
+            longest = max(header.size)
+            for factor, reduced_flag in JPEG_REDUCED_FLAGS:
+                if longest // factor >= max_size:
+                    flags = reduced_flag
+                    break
+        
+        image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), flags)
+        if image is None:
+            return None, "Failed to process image"
+        
+        # Convert BGR to RGB in place (InsightFace expects RGB)
+        cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=image)
+        return image, "Image loaded successfully"
+    
     except Exception as e:
-        return False, f"Invalid image file: {str(e)}"
+        return None, f"Invalid image file: {str(e)}"
 
 def resize_image_if_needed(image: np.ndarray, max_size: int = 1024) -> np.ndarray:
     """Resize image if it's too large while maintaining aspect ratio"""
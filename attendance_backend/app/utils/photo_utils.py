@@ -0,0 +1,76 @@
+"""Student photo storage: normalized JPEG plus avatar thumbnails"""
+import os
+import uuid
+import cv2
+import numpy as np
+from typing import Optional
+from ..core.config import settings
+
+# Served by the /uploads StaticFiles mount; stored paths are relative to it
+UPLOADS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "uploads")
+STUDENT_PHOTO_DIR = os.path.join(UPLOADS_DIR, "students")
+
+# Thumbnail name suffix -> shortest side in pixels (enough for list avatars with BoxFit.cover)
+THUMBNAIL_SIZES = {"sm": 96, "md": 256}
+
+# Marks photos written with thumbnails, so their names can be derived without a filesystem check
+PHOTO_SUFFIX = "_full"
+
+def _resize_shortest_side(image: np.ndarray, size: int) -> np.ndarray:
+    height, width = image.shape[:2]
+    scale = size / min(height, width)
+    if scale >= 1:
+        return image
+    return cv2.resize(image, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+
+def _write_jpeg(path: str, image_bgr: np.ndarray):
+    ok, encoded = cv2.imencode(".jpg", image_bgr, [cv2.IMWRITE_JPEG_QUALITY, settings.photo_jpeg_quality])
+    if not ok:
+        raise ValueError(f"Failed to encode {path}")
+    with open(path, 'wb') as f:
+        f.write(encoded.tobytes())
+
+def save_student_photo(image: np.ndarray, student_id: int) -> str:
+    """Write a normalized JPEG and its thumbnails from a decoded RGB image
+    
+    Returns:
+        Photo path relative to the uploads directory, e.g. students/12_ab34cd56_full.jpg
+    """
+    os.makedirs(STUDENT_PHOTO_DIR, exist_ok=True)
+    name = f"{student_id}_{uuid.uuid4().hex[:8]}"
+    
+    # Longest side capped, EXIF rotation already applied by the decoder
+    height, width = image.shape[:2]
+    scale = settings.photo_max_size / max(height, width)
+    if scale < 1:
+        image = cv2.resize(image, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+    image_bgr = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+    
+    _write_jpeg(os.path.join(STUDENT_PHOTO_DIR, f"{name}{PHOTO_SUFFIX}.jpg"), image_bgr)
+    for suffix, size in THUMBNAIL_SIZES.items():
+        _write_jpeg(os.path.join(STUDENT_PHOTO_DIR, f"{name}_{suffix}.jpg"), _resize_shortest_side(image_bgr, size))
+    return f"students/{name}{PHOTO_SUFFIX}.jpg"
+
+def _thumbnail_name(photo_path: str, size: str) -> str:
+    base, ext = os.path.splitext(photo_path)
+    if base.endswith(PHOTO_SUFFIX):
+        base = base[:-len(PHOTO_SUFFIX)]
+    return f"{base}_{size}{ext}"
+
+def thumbnail_path(photo_path: Optional[str], size: str = "sm") -> Optional[str]:
+    """Thumbnail for a stored photo, or the photo itself if it predates thumbnails"""
+    if not photo_path:
+        return None
+    if os.path.splitext(photo_path)[0].endswith(PHOTO_SUFFIX):
+        return _thumbnail_name(photo_path, size)
+    return photo_path
+
+def delete_student_photo(photo_path: Optional[str]):
+    """Remove a stored photo and its thumbnails"""
+    if not photo_path:
+        return
+    for path in [photo_path] + [_thumbnail_name(photo_path, suffix) for suffix in THUMBNAIL_SIZES]:
+        try:
+            os.remove(os.path.join(UPLOADS_DIR, path))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,45 @@
+"""Find students registered with the same face (twins, re-enrollments under new IDs, data-entry mistakes)
+
+Only students whose templates changed since the last audit are compared
+again; --full compares every pair.
+
+    python audit_duplicates.py
+    python audit_duplicates.py --threshold 0.5 --full --output duplicates.json
+"""
+import argparse
+import json
+import os
+import sys
+
+# Add the app directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.db.base import SessionLocal
+from app.services.audit_service import audit_duplicate_identities
+
+def describe(student: dict) -> str:
+    return f"{student.get('student_id')} {student.get('full_name')} ({student.get('class_name')})"
+
+def main(threshold: float = None, full: bool = False, output: str = None):
+    db = SessionLocal()
+    try:
+        pairs, summary = audit_duplicate_identities(db, threshold, full)
+    finally:
+        db.close()
+    
+    for pair in pairs:
+        print(f"  {pair['similarity']:.3f}  {describe(pair['student_a'])}  <->  {describe(pair['student_b'])}")
+    print(f"✅ {len(pairs)} pair(s) at similarity >= {summary['threshold']} "
+          f"({summary['mode']} audit of {summary['compared_students']}/{summary['students']} student(s) in {summary['seconds']}s)")
+    if output:
+        with open(output, 'w') as f:
+            json.dump({"summary": summary, "pairs": pairs}, f, indent=2)
+        print(f"Report written to {output}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threshold", type=float, help="Similarity threshold (default FACE_SIMILARITY_THRESHOLD)")
+    parser.add_argument("--full", action="store_true", help="Compare every pair, not only changed students")
+    parser.add_argument("--output", help="Write the pairs as JSON")
+    args = parser.parse_args()
+    main(args.threshold, args.full, args.output)
@@ -0,0 +1,234 @@
+"""Micro-benchmarks of each recognition pipeline stage, runnable without model weights
+
+Stages run on synthetic photos and embeddings, with the stub face model
+(app/ai/stub_model.py) standing in for the InsightFace modules, so the
+numbers measure this code rather than ONNX Runtime. Save a baseline, then
+compare later runs against it: a stage slower than its baseline by more
+than the tolerance is flagged and the exit code is 1.
+
+    python benchmark_pipeline.py --output baseline.json
+    python benchmark_pipeline.py --compare baseline.json --tolerance 0.2 --output current.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+# Add the app directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.ai.embedding import embedding_to_bytes, embedding_from_bytes, generate_embedding
+from app.ai.gallery import EMBEDDING_DIM, FaceGallery
+from app.ai.matcher import find_best_match, find_best_match_vectorized, normalize_embeddings
+from app.ai.stub_model import install_stub_model, synthetic_jpeg
+from app.core.config import settings
+from app.core.executor import available_cpus
+from app.db import models
+from app.db.base import Base
+from app.services.face_service import gallery_rows
+from app.utils.image_utils import load_image, preprocess_image, resize_image_if_needed, validate_image_format
+
+# Students per class in the synthetic galleries
+STUDENTS_PER_CLASS = 40
+
+def measure(fn, min_seconds: float, min_runs: int = 3, max_runs: int = 100000) -> dict:
+    """Time `fn` after one warm-up call, repeating until `min_seconds` and `min_runs` are reached
+    
+    The stages print per call (the legacy matcher once per candidate), so
+    stdout is discarded while timing.
+    """
+    times = []
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        fn()
+        started = time.perf_counter()
+        while len(times) < max_runs and (len(times) < min_runs or time.perf_counter() - started < min_seconds):
+            call_started = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - call_started)
+    times_us = np.array(times) * 1e6
+    return {
+        "runs": len(times),
+        "median_us": round(float(np.median(times_us)), 2),
+        "p95_us": round(float(np.percentile(times_us, 95)), 2),
+        "min_us": round(float(times_us.min()), 2),
+    }
+
+def random_embeddings(count: int, seed: int = 0) -> np.ndarray:
+    return normalize_embeddings(np.random.default_rng(seed).standard_normal((count, EMBEDDING_DIM)))
+
+def image_stages(min_seconds: float) -> dict:
+    """Upload decoding and the stub-backed embedding of one 1280x960 photo"""
+    upload = synthetic_jpeg(0, 1280, 960)
+    decoded = preprocess_image(upload)
+    image, _ = load_image(upload, max_size=settings.image_decode_max_size)
+    return {
+        "validate_image_format": measure(lambda: validate_image_format(upload), min_seconds),
+        "preprocess_image": measure(lambda: preprocess_image(upload), min_seconds),
+        "load_image": measure(lambda: load_image(upload, max_size=settings.image_decode_max_size), min_seconds),
+        "resize_image_if_needed": measure(lambda: resize_image_if_needed(decoded), min_seconds),
+        "generate_embedding[stub]": measure(lambda: generate_embedding(image), min_seconds),
+    }
+
+def serialization_stages(min_seconds: float) -> dict:
+    embedding = random_embeddings(1)[0]
+    stages = {}
+    for dtype in ("float32", "float16"):
+        blob = embedding_to_bytes(embedding, dtype=dtype)
+        stages[f"embedding_to_bytes[{dtype}]"] = measure(lambda: embedding_to_bytes(embedding, dtype=dtype), min_seconds)
+        stages[f"embedding_from_bytes[{dtype}]"] = measure(lambda: embedding_from_bytes(blob), min_seconds)
+    return stages
+
+def seed_gallery_db(path: str, students: int):
+    """SQLite database with one teacher, classes of STUDENTS_PER_CLASS and one template per student"""
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    classes = (students + STUDENTS_PER_CLASS - 1) // STUDENTS_PER_CLASS
+    embeddings = random_embeddings(students, seed=1)
+    with engine.begin() as connection:
+        connection.execute(models.Teacher.__table__.insert(), [
+            {"id": 1, "teacher_id": "T1", "full_name": "Benchmark", "email": "benchmark@example.com", "password_hash": "-"}
+        ])
+        connection.execute(models.Class.__table__.insert(), [
+            {"id": i + 1, "class_name": f"Class {i + 1}", "class_code": f"C{i + 1}", "teacher_id": 1} for i in range(classes)
+        ])
+        connection.execute(models.Student.__table__.insert(), [
+            {"id": i + 1, "student_id": f"S{i + 1}", "full_name": f"Student {i + 1}",
+             "class_id": i // STUDENTS_PER_CLASS + 1, "face_enrolled": True} for i in range(students)
+        ])
+        connection.execute(models.FaceEmbedding.__table__.insert(), [
+            {"student_id": i + 1, "embedding_blob": embedding_to_bytes(embedding), "source": "enrollment"}
+            for i, embedding in enumerate(embeddings)
+        ])
+    return engine
+
+def gallery_load_stages(students: int, workdir: str, min_seconds: float) -> dict:
+    """Startup gallery load: the embedding query and decode, then building the in-memory gallery"""
+    engine = seed_gallery_db(os.path.join(workdir, "gallery.db"), students)
+    db = sessionmaker(bind=engine)()
+    try:
+        rows = gallery_rows(db)
+        return {
+            f"gallery_rows[{students}]": measure(lambda: gallery_rows(db), min_seconds),
+            f"gallery_load[{students}]": measure(lambda: FaceGallery().load(rows), min_seconds),
+        }
+    finally:
+        db.close()
+        engine.dispose()
+
+def matching_stages(sizes, min_seconds: float) -> dict:
+    """One probe against galleries of each size: legacy loop, matrix product and the gallery search (ANN when large enough)"""
+    stages = {}
+    for size in sizes:
+        matrix = random_embeddings(size, seed=2)
+        student_ids = np.arange(1, size + 1, dtype=np.int64)
+        probe = matrix[size // 2] + 0.3 * random_embeddings(1, seed=3)[0]
+        candidates = list(zip(student_ids.tolist(), matrix))
+        gallery = FaceGallery()
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            gallery.load(zip(student_ids.tolist(), (student_ids // STUDENTS_PER_CLASS).tolist(), matrix))
+        print(f"Matching against {size} student(s)...")
+        stages[f"find_best_match[{size}]"] = measure(lambda: find_best_match(probe, candidates), min_seconds)
+        stages[f"find_best_match_vectorized[{size}]"] = measure(lambda: find_best_match_vectorized(probe, matrix, student_ids), min_seconds)
+        stages[f"gallery_search[{size}]"] = measure(lambda: gallery.search(probe), min_seconds)
+    return stages
+
+def environment() -> dict:
+    """What a baseline was measured on; timings only compare on the same machine and settings"""
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpus": available_cpus(),
+        "template_scoring": settings.template_scoring,
+        "ann_enabled": settings.ann_enabled,
+        "ann_min_gallery_size": settings.ann_min_gallery_size,
+        "embedding_storage_dtype": settings.embedding_storage_dtype,
+    }
+
+def benchmark(sizes, gallery_load_size: int, min_seconds: float) -> dict:
+    install_stub_model()
+    report = {"environment": environment(), "stages": {}}
+    with tempfile.TemporaryDirectory() as workdir:
+        # Keep the ANN indexes of the synthetic galleries out of data/
+        settings.ann_index_path = os.path.join(workdir, "ann_index.npz")
+        print("Benchmarking image stages...")
+        report["stages"].update(image_stages(min_seconds))
+        print("Benchmarking embedding serialization...")
+        report["stages"].update(serialization_stages(min_seconds))
+        print(f"Benchmarking gallery load of {gallery_load_size} student(s)...")
+        report["stages"].update(gallery_load_stages(gallery_load_size, workdir, min_seconds))
+        report["stages"].update(matching_stages(sizes, min_seconds))
+    return report
+
+def compare(report: dict, baseline: dict, tolerance: float) -> dict:
+    """Median ratio to the baseline per stage; above 1 + tolerance is a regression"""
+    comparison = {}
+    for stage, result in report["stages"].items():
+        before = baseline["stages"].get(stage)
+        if before is None:
+            comparison[stage] = {"status": "new"}
+            continue
+        ratio = result["median_us"] / max(before["median_us"], 1e-9)
+        if ratio > 1 + tolerance:
+            status = "regression"
+        elif ratio < 1 / (1 + tolerance):
+            status = "improvement"
+        else:
+            status = "ok"
+        comparison[stage] = {"baseline_median_us": before["median_us"], "ratio": round(ratio, 3), "status": status}
+    for stage in baseline["stages"]:
+        if stage not in report["stages"]:
+            comparison[stage] = {"status": "missing"}
+    return comparison
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="100,1000,10000,100000", help="Comma-separated gallery sizes for the matching stages")
+    parser.add_argument("--gallery-load-size", type=int, default=10000, help="Students in the synthetic database for the gallery load")
+    parser.add_argument("--min-time", type=float, default=0.5, help="Seconds each stage is repeated for (at least 3 runs)")
+    parser.add_argument("--compare", help="Baseline JSON report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown before a stage is flagged, 0.2 = 20%%")
+    parser.add_argument("--output", help="Write the JSON report (a baseline for later runs) here as well")
+    args = parser.parse_args()
+    
+    report = benchmark(
+        [int(value) for value in args.sizes.split(",") if value.strip()],
+        args.gallery_load_size,
+        args.min_time
+    )
+    comparison = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get("environment") != report["environment"]:
+            print(f"⚠️ Baseline was measured on a different environment: {baseline.get('environment')}")
+        comparison = compare(report, baseline, args.tolerance)
+        report["comparison"] = {"baseline": args.compare, "tolerance": args.tolerance, "stages": comparison}
+    
+    print(f"\n{'stage':<36} {'median':>12} {'p95':>12} {'runs':>7}")
+    for stage, result in report["stages"].items():
+        line = f"{stage:<36} {result['median_us']:>10.1f}us {result['p95_us']:>10.1f}us {result['runs']:>7}"
+        if stage in comparison and "ratio" in comparison[stage]:
+            marker = {"regression": "  ❌ regression", "improvement": "  ✅ faster"}.get(comparison[stage]["status"], "")
+            line += f"  x{comparison[stage]['ratio']:.2f}{marker}"
+        print(line)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"✅ Report written to {args.output}")
+    
+    missing = [stage for stage, result in comparison.items() if result["status"] == "missing"]
+    if missing:
+        print(f"⚠️ {len(missing)} baseline stage(s) not run: {', '.join(missing)}")
+    regressions = [stage for stage, result in comparison.items() if result["status"] == "regression"]
+    if regressions:
+        print(f"❌ {len(regressions)} stage(s) slower than the baseline by more than {args.tolerance:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
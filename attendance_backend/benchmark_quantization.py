@@ -0,0 +1,130 @@
+"""Compare FP32 and INT8 models: latency, memory and verification accuracy drift
+
+The image set is one folder per person, e.g. data/labelled/<person>/<photo>.jpg
+
+    python benchmark_quantization.py --images data/labelled --output quantization_report.json
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+# Add the app directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import insightface
+import numpy as np
+from insightface.utils import face_align
+from app.ai.insightface_model import INSIGHTFACE_ROOT, INT8_PACK_SUFFIX, rss_mb
+from app.ai.matcher import normalize_embeddings
+from app.core.config import settings
+from app.utils.image_utils import load_image
+
+def load_labelled_images(images_dir: str):
+    """(label, RGB image) pairs, decoded the way the app decodes uploads"""
+    samples = []
+    for path in sorted(glob.glob(os.path.join(images_dir, "*", "*.*"))):
+        with open(path, 'rb') as f:
+            image, _ = load_image(f.read(), max_size=settings.image_decode_max_size)
+        if image is not None:
+            samples.append((os.path.basename(os.path.dirname(path)), image))
+    return samples
+
+def load_pipeline(pack: str):
+    """Detection + recognition only, as the app loads them; returns (model, load stats)"""
+    rss_before = rss_mb()
+    started = time.perf_counter()
+    model = insightface.app.FaceAnalysis(name=pack, root=INSIGHTFACE_ROOT, allowed_modules=['detection', 'recognition'])
+    model.prepare(ctx_id=-1, det_size=(640, 640))
+    return model, {
+        "load_seconds": round(time.perf_counter() - started, 2),
+        "rss_mb_delta": round(rss_mb() - rss_before, 1),
+    }
+
+def embed_samples(model, samples):
+    """Embed the largest face of every image, timing detection and recognition separately"""
+    detector, recognizer = model.det_model, model.models['recognition']
+    embeddings, detect_ms, recognize_ms = [], [], []
+    for _, image in samples:
+        started = time.perf_counter()
+        bboxes, kpss = detector.detect(image, max_num=0, metric='default')
+        detect_ms.append((time.perf_counter() - started) * 1000)
+        if len(bboxes) == 0:
+            embeddings.append(None)
+            continue
+        
+        largest = int(np.argmax((bboxes[:, 2] - bboxes[:, 0]) * (bboxes[:, 3] - bboxes[:, 1])))
+        started = time.perf_counter()
+        crop = face_align.norm_crop(image, landmark=kpss[largest], image_size=recognizer.input_size[0])
+        embeddings.append(recognizer.get_feat([crop])[0])
+        recognize_ms.append((time.perf_counter() - started) * 1000)
+    
+    latency = {
+        "detect_ms_mean": round(float(np.mean(detect_ms)), 2),
+        "detect_ms_p95": round(float(np.percentile(detect_ms, 95)), 2),
+    }
+    if recognize_ms:
+        latency["recognize_ms_mean"] = round(float(np.mean(recognize_ms)), 2)
+        latency["recognize_ms_p95"] = round(float(np.percentile(recognize_ms, 95)), 2)
+    return embeddings, latency
+
+def verification_metrics(embeddings: np.ndarray, labels: np.ndarray, threshold: float) -> dict:
+    """Accept rates over every genuine and impostor pair at the app threshold"""
+    similarities = normalize_embeddings(embeddings) @ normalize_embeddings(embeddings).T
+    upper = np.triu_indices(len(labels), k=1)
+    scores = similarities[upper]
+    genuine = labels[upper[0]] == labels[upper[1]]
+    return {
+        "genuine_pairs": int(genuine.sum()),
+        "impostor_pairs": int((~genuine).sum()),
+        "true_accept_rate": round(float((scores[genuine] >= threshold).mean()), 4) if genuine.any() else None,
+        "false_accept_rate": round(float((scores[~genuine] >= threshold).mean()), 4) if (~genuine).any() else None,
+    }
+
+def benchmark(images_dir: str, pack: str, threshold: float) -> dict:
+    samples = load_labelled_images(images_dir)
+    if not samples:
+        raise SystemExit(f"❌ No readable images in {images_dir}")
+    print(f"Benchmarking {len(samples)} image(s) of {len({label for label, _ in samples})} person(s)")
+    
+    report = {"images": len(samples), "threshold": threshold}
+    results = {}
+    for variant, variant_pack in (("fp32", pack), ("int8", pack + INT8_PACK_SUFFIX)):
+        print(f"Running {variant} ({variant_pack})...")
+        model, load_stats = load_pipeline(variant_pack)
+        embeddings, latency = embed_samples(model, samples)
+        results[variant] = embeddings
+        report[variant] = dict(load_stats, **latency, faces_detected=sum(e is not None for e in embeddings))
+        del model
+    
+    # Drift and accuracy over the images where both variants found a face
+    both = [i for i in range(len(samples)) if results["fp32"][i] is not None and results["int8"][i] is not None]
+    labels = np.array([samples[i][0] for i in both])
+    fp32 = np.stack([results["fp32"][i] for i in both])
+    int8 = np.stack([results["int8"][i] for i in both])
+    cosine = np.sum(normalize_embeddings(fp32) * normalize_embeddings(int8), axis=1)
+    report["drift"] = {
+        "compared_images": len(both),
+        "cosine_to_fp32_mean": round(float(cosine.mean()), 4),
+        "cosine_to_fp32_min": round(float(cosine.min()), 4),
+    }
+    report["fp32"]["verification"] = verification_metrics(fp32, labels, threshold)
+    report["int8"]["verification"] = verification_metrics(int8, labels, threshold)
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", required=True, help="Folder with one sub-folder of photos per person")
+    parser.add_argument("--pack", default=settings.insightface_model_name, help="FP32 pack; <pack>_int8 must exist")
+    parser.add_argument("--threshold", type=float, default=settings.face_similarity_threshold)
+    parser.add_argument("--output", help="Write the JSON report here as well")
+    args = parser.parse_args()
+    
+    report = benchmark(args.images, args.pack, args.threshold)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"✅ Report written to {args.output}")
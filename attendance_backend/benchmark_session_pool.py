@@ -0,0 +1,87 @@
+"""Throughput of 1..N inference sessions at a fixed total thread budget
+
+Each configuration splits the same intra-op threads across N model copies
+and serves a fixed number of concurrent clients, each running detection
+at 640 and recognition of one face per request, like a verify.
+
+    python benchmark_session_pool.py --max-sessions 4 --requests 200 --output pool_report.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Add the app directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+from app.ai.insightface_model import face_model, rss_mb, threads_per_session
+from app.ai.session_pool import SessionPool
+from app.core.config import settings
+from app.core.executor import available_cpus
+
+def run_requests(pool: SessionPool, clients: int, requests: int) -> dict:
+    """Serve `requests` synthetic verifies from `clients` threads; returns throughput and latency"""
+    image = np.random.default_rng(0).integers(0, 255, (480, 640, 3), dtype=np.uint8)
+    crop_size = pool.sessions[0].models['recognition'].input_size
+    crop = np.zeros((crop_size[1], crop_size[0], 3), dtype=np.uint8)
+    
+    def verify(_):
+        started = time.perf_counter()
+        with pool.checkout() as model:
+            model.det_model.detect(image, input_size=(640, 640), max_num=0, metric='default')
+        with pool.checkout() as model:
+            model.models['recognition'].get_feat([crop])
+        return (time.perf_counter() - started) * 1000
+    
+    # Warm every session first, so the first shapes are not timed
+    with ThreadPoolExecutor(max_workers=pool.size) as executor:
+        list(executor.map(verify, range(pool.size * 2)))
+    
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        latencies = list(executor.map(verify, range(requests)))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests_per_second": round(requests / elapsed, 2),
+        "latency_ms_p50": round(float(np.percentile(latencies, 50)), 2),
+        "latency_ms_p95": round(float(np.percentile(latencies, 95)), 2),
+        "contended_checkouts": pool.stats()["contended_checkouts"],
+    }
+
+def benchmark(max_sessions: int, clients: int, requests: int) -> dict:
+    total_threads = settings.onnx_intra_op_threads or available_cpus()
+    report = {"total_intra_op_threads": total_threads, "clients": clients, "requests": requests, "configurations": []}
+    baseline = None
+    for size in range(1, max_sessions + 1):
+        print(f"Benchmarking {size} session(s) x {threads_per_session(size)} thread(s)...")
+        rss_before = rss_mb()
+        pool = SessionPool(face_model._build_pool(size))
+        result = dict(
+            sessions=size,
+            threads_per_session=threads_per_session(size),
+            rss_mb_delta=round(rss_mb() - rss_before, 1),
+            **run_requests(pool, clients, requests)
+        )
+        baseline = baseline or result["requests_per_second"]
+        result["speedup"] = round(result["requests_per_second"] / baseline, 2)
+        report["configurations"].append(result)
+        del pool
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--max-sessions", type=int, default=available_cpus(), help="Largest pool size tried")
+    parser.add_argument("--clients", type=int, default=0, help="Concurrent requests, 0 = 2x max sessions")
+    parser.add_argument("--requests", type=int, default=200, help="Timed requests per configuration")
+    parser.add_argument("--output", help="Write the JSON report here as well")
+    args = parser.parse_args()
+    
+    report = benchmark(args.max_sessions, args.clients or args.max_sessions * 2, args.requests)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"✅ Report written to {args.output}")
@@ -0,0 +1,55 @@
+"""Enroll student faces in bulk from a ZIP file or a folder of photos named by student ID
+
+    python bulk_enroll.py photos.zip
+    python bulk_enroll.py photos/ --replace --report enrollment_report.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import zipfile
+from collections import Counter
+
+# Add the app directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.ai.insightface_model import face_model
+from app.core.executor import face_executor
+from app.db.base import SessionLocal
+from app.services.enrollment_service import enroll_bulk
+from app.utils.archive_utils import folder_entries, zip_entries
+
+def main(path: str, replace: bool, report_path: str = None):
+    print("Loading InsightFace model...")
+    face_model.load_model()
+    db = SessionLocal()
+    try:
+        if os.path.isdir(path):
+            success, message, report = asyncio.run(enroll_bulk(folder_entries(path), db, replace))
+        else:
+            with zipfile.ZipFile(path) as archive:
+                success, message, report = asyncio.run(enroll_bulk(zip_entries(archive), db, replace))
+    finally:
+        db.close()
+        # Let background photo clean-up finish
+        face_executor.shutdown()
+        face_model.get_batcher().stop()
+    
+    for entry in report:
+        if entry["status"] != "enrolled":
+            print(f"  {entry['status']:<16} {entry['filename']}: {entry['message']}")
+    print(dict(Counter(entry["status"] for entry in report)))
+    print(f"{'✅' if success else '❌'} {message}")
+    if report_path:
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {report_path}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", help="ZIP file or folder of photos named <student_id>.jpg or <student_id>_<n>.jpg")
+    parser.add_argument("--replace", action="store_true", help="Drop the existing templates of enrolled students")
+    parser.add_argument("--report", help="Write the per-file report as JSON")
+    args = parser.parse_args()
+    main(args.path, args.replace, args.report)
@@ -0,0 +1,228 @@
+"""Measure false accepts and rejects of the similarity threshold on a labelled photo set
+
+The image set is one folder per person, e.g. data/labelled/<person>/<photo>.jpg.
+Embeddings are cached next to the set, so re-runs with other thresholds or
+gallery sizes skip the model entirely.
+
+    python evaluate_threshold.py --images data/labelled
+    python evaluate_threshold.py --images data/labelled --thresholds 0.4,0.5,0.6 --gallery-sizes 50,500 --output roc.json
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Add the app directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+from app.ai.insightface_model import face_model, parse_detection_sizes
+from app.ai.matcher import normalize_embeddings
+from app.core.config import settings
+from app.core.executor import available_cpus
+from app.utils.image_utils import load_image
+
+# Score histogram resolution; FAR/FRR are exact at multiples of it
+SCORE_BINS = np.linspace(-1.0, 1.0, 2001)
+
+# Rows of the similarity matrix scored at a time, bounds memory for large sets
+SCORE_CHUNK_SIZE = 2048
+
+def cache_key(path: str) -> str:
+    stat = os.stat(path)
+    return f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}|{settings.recognition_model_name}"
+
+def embed_image(path: str):
+    """Aligned crop of the largest face in a photo, decoded and detected as the app does"""
+    with open(path, 'rb') as f:
+        image, _ = load_image(f.read(), max_size=settings.image_decode_max_size)
+    if image is None:
+        return None
+    faces = face_model.detect_adaptive(image, parse_detection_sizes(settings.detection_sizes))
+    if not faces:
+        return None
+    largest = max(faces, key=lambda face: (face.bbox[2] - face.bbox[0]) * (face.bbox[3] - face.bbox[1]))
+    return face_model.align(image, largest)
+
+def load_embeddings(images_dir: str, cache_path: str, batch_size: int = 32):
+    """(labels, embeddings) of every photo with a face, embedding only photos missing from the cache"""
+    paths = sorted(glob.glob(os.path.join(images_dir, "*", "*.*")))
+    cached = {}
+    if os.path.exists(cache_path):
+        with np.load(cache_path) as data:
+            cached = dict(zip(data["keys"].tolist(), data["embeddings"]))
+    keys = [cache_key(path) for path in paths]
+    missing = [i for i, key in enumerate(keys) if key not in cached]
+    print(f"{len(paths)} photo(s), {len(paths) - len(missing)} cached, {len(missing)} to embed")
+    
+    if missing:
+        started = time.perf_counter()
+        face_model.load_model()
+        with ThreadPoolExecutor(max_workers=available_cpus(), thread_name_prefix="evaluate") as pool:
+            for start in range(0, len(missing), batch_size):
+                batch = missing[start:start + batch_size]
+                crops = list(pool.map(lambda i: embed_image(paths[i]), batch))
+                found = [(i, crop) for i, crop in zip(batch, crops) if crop is not None]
+                embeddings = face_model.embed_crops([crop for _, crop in found]) if found else []
+                for (i, _), embedding in zip(found, embeddings):
+                    cached[keys[i]] = embedding.flatten().astype(np.float32)
+                # Photos without a face are cached as an empty row, so they are not retried
+                for i, crop in zip(batch, crops):
+                    if crop is None:
+                        cached[keys[i]] = np.zeros(0, dtype=np.float32)
+        print(f"Embedded {len(missing)} photo(s) in {time.perf_counter() - started:.1f}s")
+        
+        os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+        dim = max((len(embedding) for embedding in cached.values()), default=0)
+        rows = [embedding if len(embedding) else np.full(dim, np.nan, dtype=np.float32) for embedding in cached.values()]
+        np.savez(cache_path, keys=np.array(list(cached.keys())), embeddings=np.stack(rows) if rows else np.zeros((0, dim)))
+    
+    labels, embeddings = [], []
+    for path, key in zip(paths, keys):
+        embedding = cached.get(key)
+        if embedding is not None and len(embedding) and not np.isnan(embedding).any():
+            labels.append(os.path.basename(os.path.dirname(path)))
+            embeddings.append(embedding)
+    skipped = len(paths) - len(labels)
+    if skipped:
+        print(f"⚠️ {skipped} photo(s) without a detectable face left out")
+    return np.array(labels), normalize_embeddings(np.stack(embeddings)) if embeddings else np.zeros((0, 512), dtype=np.float32)
+
+def score_histograms(labels: np.ndarray, embeddings: np.ndarray):
+    """Genuine and impostor score counts per bin over every pair, one block of rows at a time"""
+    _, label_ids = np.unique(labels, return_inverse=True)
+    genuine = np.zeros(len(SCORE_BINS) - 1, dtype=np.int64)
+    impostor = np.zeros(len(SCORE_BINS) - 1, dtype=np.int64)
+    for start in range(0, len(embeddings), SCORE_CHUNK_SIZE):
+        block = embeddings[start:start + SCORE_CHUNK_SIZE]
+        # Upper triangle only: each pair once, no self-pairs. Float32 rounding puts
+        # duplicate photos just above 1.0, outside the bins, so clip first
+        scores = np.clip(block @ embeddings[start:].T, -1.0, 1.0)
+        upper = np.arange(scores.shape[1])[None, :] > np.arange(len(block))[:, None]
+        same = label_ids[start:start + len(block), None] == label_ids[None, start:]
+        genuine += np.histogram(scores[upper & same], SCORE_BINS)[0]
+        impostor += np.histogram(scores[upper & ~same], SCORE_BINS)[0]
+    return genuine, impostor
+
+def error_rates(genuine: np.ndarray, impostor: np.ndarray):
+    """(thresholds, FAR, FRR) at every bin edge: accept when score >= threshold"""
+    thresholds = SCORE_BINS[:-1]
+    # Pairs at or above each bin's lower edge
+    impostor_accepted = np.cumsum(impostor[::-1])[::-1]
+    genuine_accepted = np.cumsum(genuine[::-1])[::-1]
+    far = impostor_accepted / max(impostor.sum(), 1)
+    frr = 1.0 - genuine_accepted / max(genuine.sum(), 1)
+    return thresholds, far, frr
+
+def equal_error_rate(thresholds: np.ndarray, far: np.ndarray, frr: np.ndarray):
+    """(EER, threshold) at the bin edge where FAR and FRR are closest"""
+    index = int(np.argmin(np.abs(far - frr)))
+    return float((far[index] + frr[index]) / 2), float(thresholds[index])
+
+def rank1_accuracy(labels: np.ndarray, embeddings: np.ndarray, gallery_size: int, threshold: float, seed: int = 0):
+    """Closed-set rank-1 accuracy and open-set identification rate with one enrollment photo per person
+    
+    The gallery holds `gallery_size` people, one photo each; every other
+    photo of a gallery person is a probe. Open-set also needs the best
+    match to clear the threshold, as verify does.
+    """
+    rng = np.random.default_rng(seed)
+    people = np.unique(labels)
+    if gallery_size > len(people):
+        return None
+    chosen = rng.choice(people, gallery_size, replace=False)
+    gallery_rows, probe_rows = [], []
+    for person in chosen:
+        rows = rng.permutation(np.flatnonzero(labels == person))
+        gallery_rows.append(rows[0])
+        probe_rows.extend(rows[1:])
+    if not probe_rows:
+        return None
+    return {"gallery_size": gallery_size, "probes": len(probe_rows), **identification_rates(labels, embeddings, gallery_rows, probe_rows, threshold)}
+
+def identification_rates(labels: np.ndarray, embeddings: np.ndarray, gallery_rows, probe_rows, threshold: float) -> dict:
+    """Rank-1 accuracy, identification and false identification rates of the probes against the gallery rows"""
+    scores = embeddings[probe_rows] @ embeddings[gallery_rows].T
+    best = np.argmax(scores, axis=1)
+    correct = labels[gallery_rows][best] == labels[probe_rows]
+    accepted = scores[np.arange(len(best)), best] >= threshold
+    return {
+        "rank1_accuracy": round(float(correct.mean()), 4),
+        "identification_rate": round(float((correct & accepted).mean()), 4),
+        "false_identification_rate": round(float((~correct & accepted).mean()), 4),
+    }
+
+def evaluate(images_dir: str, cache_path: str, thresholds, gallery_sizes) -> dict:
+    labels, embeddings = load_embeddings(images_dir, cache_path)
+    if len(labels) < 2:
+        raise SystemExit(f"❌ Not enough photos with faces in {images_dir}")
+    started = time.perf_counter()
+    genuine, impostor = score_histograms(labels, embeddings)
+    bin_thresholds, far, frr = error_rates(genuine, impostor)
+    
+    def at(threshold):
+        i = int(np.clip(np.searchsorted(bin_thresholds, threshold - 1e-9), 0, len(bin_thresholds) - 1))
+        return far[i], frr[i]
+    
+    eer, eer_threshold = equal_error_rate(bin_thresholds, far, frr)
+    report = {
+        "images": len(labels),
+        "people": len(np.unique(labels)),
+        "genuine_pairs": int(genuine.sum()),
+        "impostor_pairs": int(impostor.sum()),
+        "current_threshold": settings.face_similarity_threshold,
+        "eer": round(eer, 4),
+        "eer_threshold": round(eer_threshold, 3),
+        "thresholds": [
+            {"threshold": threshold, "far": round(float(at(threshold)[0]), 6), "frr": round(float(at(threshold)[1]), 4)}
+            for threshold in thresholds
+        ],
+        # Lowest threshold keeping false accepts at or under each target
+        "threshold_for_far": {
+            str(target): round(float(bin_thresholds[np.argmax(far <= target)]), 3) if (far <= target).any() else None
+            for target in (1e-2, 1e-3, 1e-4)
+        },
+        "roc": [
+            {"threshold": round(float(t), 2), "far": round(float(a), 6), "tar": round(float(1 - r), 4)}
+            for t, a, r in zip(bin_thresholds[::20], far[::20], frr[::20]) if 0.0 <= t <= 1.0
+        ],
+        "identification": [
+            result for result in (rank1_accuracy(labels, embeddings, size, settings.face_similarity_threshold) for size in gallery_sizes)
+            if result is not None
+        ],
+    }
+    report["scoring_seconds"] = round(time.perf_counter() - started, 2)
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", required=True, help="Folder with one sub-folder of photos per person")
+    parser.add_argument("--cache", help="Embedding cache (default: <images>/.embeddings.npz)")
+    parser.add_argument("--thresholds", default="0.3,0.35,0.4,0.45,0.5,0.55,0.6,0.65,0.7", help="Comma-separated thresholds to report")
+    parser.add_argument("--gallery-sizes", default="10,100,1000", help="Comma-separated numbers of enrolled people for rank-1 accuracy")
+    parser.add_argument("--output", help="Write the JSON report here as well")
+    args = parser.parse_args()
+    
+    report = evaluate(
+        args.images,
+        args.cache or os.path.join(args.images, ".embeddings.npz"),
+        [float(value) for value in args.thresholds.split(",") if value.strip()],
+        [int(value) for value in args.gallery_sizes.split(",") if value.strip()]
+    )
+    print(f"\n{report['images']} photo(s) of {report['people']} person(s): "
+          f"{report['genuine_pairs']} genuine and {report['impostor_pairs']} impostor pair(s)")
+    print(f"EER {report['eer']:.2%} at threshold {report['eer_threshold']}")
+    print(f"{'threshold':>10} {'FAR':>10} {'FRR':>8}")
+    for row in report["thresholds"]:
+        marker = "  <- current" if abs(row["threshold"] - report["current_threshold"]) < 1e-9 else ""
+        print(f"{row['threshold']:>10.2f} {row['far']:>10.4%} {row['frr']:>8.2%}{marker}")
+    for row in report["identification"]:
+        print(f"Gallery of {row['gallery_size']}: rank-1 {row['rank1_accuracy']:.2%}, "
+              f"identified at threshold {row['identification_rate']:.2%}, misidentified {row['false_identification_rate']:.2%}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"✅ Report written to {args.output}")
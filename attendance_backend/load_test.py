@@ -0,0 +1,467 @@
+"""Load test of the HTTP API with a morning roll-call mix, in-process or against a running server
+
+Without --url the app runs inside this process (httpx ASGI transport) on a
+freshly seeded synthetic database with the stub face model, and event loop
+lag is sampled on the app's own loop. To load a real server instead, seed
+the same database with --seed-only and start the server on it with the stub
+model, then pass the same seeding options with --url:
+
+    python load_test.py --concurrency 1,8,32 --stage-seconds 15 --output load.json
+    python load_test.py --compare load.json --output load_new.json
+    python load_test.py --seed-only --db loadtest.db
+    DATABASE_URL=sqlite:///./loadtest.db INSIGHTFACE_STUB_MODEL=true uvicorn app.main:app
+    python load_test.py --url http://localhost:8000
+
+Concurrency is ramped through the given levels, --stage-seconds each.
+Photos, payloads and every virtual user's choices are seeded, so runs with
+the same options send the same mix and their reports compare across commits.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, time as day_time, timedelta
+from itertools import count
+
+# Add the app directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import cv2
+import httpx
+import numpy as np
+
+DEFAULT_MIX = "verify=80,register=2,attendance_today=8,dashboard_stats=6,attendance_report=4"
+
+# Seeded admin account the harness logs in with
+ADMIN_EMAIL = "loadtest-admin@example.com"
+ADMIN_PASSWORD = "loadtest"
+
+# Expected sleep of the lag sampler; any extra delay is time the event loop was blocked
+LOOP_LAG_INTERVAL_S = 0.01
+
+# Share of seeded students marked present on each past day of the attendance history
+HISTORY_PRESENCE_RATE = 0.9
+
+def photo_seed(seed: int, student_id: int) -> int:
+    """Synthetic "face" of a student; the stub model embeds each seed as a different person"""
+    return seed * 1_000_003 + student_id
+
+def student_classes(classes: int, students_per_class: int) -> np.ndarray:
+    """Class ID of every seeded student, indexed by student ID - 1"""
+    return np.arange(classes * students_per_class) // students_per_class + 1
+
+def configure_app_environment(database_url: str, workdir: str, args):
+    """Point the app settings at the synthetic database and the stub model
+    
+    Must run before anything under app/ is imported: settings are read from
+    the environment once, at import.
+    """
+    os.environ.update({
+        "DATABASE_URL": database_url,
+        "INSIGHTFACE_STUB_MODEL": "true",
+        "INSIGHTFACE_STUB_DETECTION_MS": str(args.stub_detection_ms),
+        "INSIGHTFACE_STUB_RECOGNITION_MS": str(args.stub_recognition_ms),
+        "ANN_INDEX_PATH": os.path.join(workdir, "ann_index.npz"),
+        "DUPLICATE_AUDIT_PATH": os.path.join(workdir, "duplicate_audit.npz"),
+        "REEMBED_STATE_PATH": os.path.join(workdir, "reembed_job.json"),
+    })
+
+def seed_database(classes: int, students_per_class: int, history_days: int, seed: int):
+    """Admin, classes, students enrolled with stub embeddings of their synthetic photo, and past attendance"""
+    from app.ai.embedding import embedding_to_bytes, generate_embedding
+    from app.ai.insightface_model import face_model
+    from app.ai.stub_model import synthetic_photo
+    from app.core.security import get_password_hash
+    from app.db import models
+    from app.db.base import Base, engine
+    
+    Base.metadata.create_all(bind=engine)
+    started = time.perf_counter()
+    face_model.load_model()
+    class_ids = student_classes(classes, students_per_class)
+    embeddings = []
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for student_id in range(1, len(class_ids) + 1):
+            embedding, message = generate_embedding(synthetic_photo(photo_seed(seed, student_id)))
+            if embedding is None:
+                raise RuntimeError(f"Could not embed the synthetic photo of student {student_id}: {message}")
+            embeddings.append(embedding)
+    
+    rng = np.random.default_rng(seed)
+    attendance = []
+    for days_ago in range(1, history_days + 1):
+        day = date.today() - timedelta(days=days_ago)
+        present = np.flatnonzero(rng.random(len(class_ids)) < HISTORY_PRESENCE_RATE)
+        minutes = rng.integers(0, 60, len(present))
+        attendance.extend(
+            {"student_id": int(i) + 1, "class_id": int(class_ids[i]), "confidence_score": 0.9,
+             "marked_at": datetime.combine(day, day_time(7, int(minute)))}
+            for i, minute in zip(present, minutes)
+        )
+    
+    with engine.begin() as connection:
+        connection.execute(models.Teacher.__table__.insert(), [{
+            "id": 1, "teacher_id": "LT-ADMIN", "full_name": "Load Test Admin", "email": ADMIN_EMAIL,
+            "password_hash": get_password_hash(ADMIN_PASSWORD), "role": "admin", "status": "active",
+        }])
+        connection.execute(models.Class.__table__.insert(), [
+            {"id": class_id, "class_name": f"Class {class_id}", "class_code": f"LT{class_id:03d}", "teacher_id": 1}
+            for class_id in range(1, classes + 1)
+        ])
+        connection.execute(models.Student.__table__.insert(), [
+            {"id": student_id, "student_id": f"LT{student_id:05d}", "full_name": f"Student {student_id}",
+             "class_id": int(class_id), "face_enrolled": True}
+            for student_id, class_id in enumerate(class_ids.tolist(), start=1)
+        ])
+        connection.execute(models.FaceEmbedding.__table__.insert(), [
+            {"student_id": student_id, "embedding_blob": embedding_to_bytes(embedding), "source": "enrollment"}
+            for student_id, embedding in enumerate(embeddings, start=1)
+        ])
+        if attendance:
+            connection.execute(models.Attendance.__table__.insert(), attendance)
+    print(f"🌱 Seeded {classes} class(es), {len(class_ids)} enrolled student(s) and "
+          f"{len(attendance)} attendance record(s) over {history_days} day(s) in {time.perf_counter() - started:.1f}s")
+
+def build_uploads(class_ids: np.ndarray, photos: int, seed: int) -> list:
+    """(student_id, class_id, JPEG) uploads of seeded students, each with its own pixel noise
+    
+    Every upload has distinct bytes, so with more photos than
+    EMBEDDING_CACHE_SIZE the exact-upload cache never short-circuits a
+    verify, as in a real roll call.
+    """
+    from app.ai.stub_model import synthetic_photo
+    
+    rng = np.random.default_rng([seed, 1])
+    uploads = []
+    for student_id in rng.integers(1, len(class_ids) + 1, photos).tolist():
+        photo = synthetic_photo(photo_seed(seed, student_id)).astype(np.int16)
+        photo += rng.integers(-3, 4, photo.shape, dtype=np.int16)
+        image = cv2.cvtColor(np.clip(photo, 0, 255).astype(np.uint8), cv2.COLOR_RGB2BGR)
+        ok, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        uploads.append((student_id, int(class_ids[student_id - 1]), encoded.tobytes()))
+    return uploads
+
+def parse_mix(value: str) -> dict:
+    """"verify=80,register=2" -> endpoint weights summing to 1"""
+    weights = {}
+    for item in value.split(","):
+        if item.strip():
+            name, weight = item.split("=")
+            if name.strip() not in REQUESTS:
+                raise SystemExit(f"❌ Unknown endpoint {name.strip()!r}, expected one of {', '.join(REQUESTS)}")
+            weights[name.strip()] = float(weight)
+    total = sum(weights.values())
+    return {name: weight / total for name, weight in weights.items() if weight > 0}
+
+class Workload:
+    """Payload source shared by the virtual users"""
+    
+    def __init__(self, uploads: list, classes: int):
+        self.uploads = uploads
+        self.classes = classes
+        self._next_upload = count()
+    
+    def upload(self):
+        return self.uploads[next(self._next_upload) % len(self.uploads)]
+
+async def verify(client: httpx.AsyncClient, workload: Workload, rng) -> httpx.Response:
+    """Roll-call verify within the student's class, marking attendance"""
+    _, class_id, photo = workload.upload()
+    return await client.post("/face/verify", data={"class_id": str(class_id), "auto_mark": "true"},
+                             files={"file": ("capture.jpg", photo, "image/jpeg")})
+
+async def register(client: httpx.AsyncClient, workload: Workload, rng) -> httpx.Response:
+    """Re-enrollment of a student with a new photo (adds a template)"""
+    student_id, _, photo = workload.upload()
+    return await client.post("/face/register", data={"student_id": str(student_id)},
+                             files={"file": ("enroll.jpg", photo, "image/jpeg")})
+
+async def attendance_today(client: httpx.AsyncClient, workload: Workload, rng) -> httpx.Response:
+    return await client.get("/attendance/today", params={"class_id": int(rng.integers(1, workload.classes + 1))})
+
+async def dashboard_stats(client: httpx.AsyncClient, workload: Workload, rng) -> httpx.Response:
+    return await client.get("/dashboard/stats")
+
+async def attendance_report(client: httpx.AsyncClient, workload: Workload, rng) -> httpx.Response:
+    return await client.get(f"/reports/attendance/{int(rng.integers(1, workload.classes + 1))}")
+
+REQUESTS = {
+    "verify": verify,
+    "register": register,
+    "attendance_today": attendance_today,
+    "dashboard_stats": dashboard_stats,
+    "attendance_report": attendance_report,
+}
+
+async def virtual_user(client: httpx.AsyncClient, workload: Workload, mix: dict, rng, deadline: float, records: list):
+    """Send requests back to back until the deadline, recording (endpoint, start, end, status, succeeded)"""
+    endpoints, weights = list(mix), list(mix.values())
+    while time.perf_counter() < deadline:
+        endpoint = endpoints[rng.choice(len(endpoints), p=weights)]
+        started = time.perf_counter()
+        succeeded = None
+        try:
+            response = await REQUESTS[endpoint](client, workload, rng)
+            status = response.status_code
+            if status < 400 and response.headers.get("content-type", "").startswith("application/json"):
+                body = response.json()
+                if isinstance(body, dict) and "success" in body:
+                    succeeded = bool(body["success"])
+        except httpx.HTTPError:
+            status = 0
+        records.append((endpoint, started, time.perf_counter(), status, succeeded))
+
+async def sample_loop_lag(samples: list):
+    """Record (time, lag in ms) of every sleep until cancelled"""
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(LOOP_LAG_INTERVAL_S)
+        now = time.perf_counter()
+        samples.append((now, (now - started - LOOP_LAG_INTERVAL_S) * 1000))
+
+def percentiles(values, prefix: str) -> dict:
+    if len(values) == 0:
+        return {f"{prefix}_p50": None, f"{prefix}_p95": None, f"{prefix}_p99": None, f"{prefix}_max": None}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        f"{prefix}_p50": round(float(p50), 2),
+        f"{prefix}_p95": round(float(p95), 2),
+        f"{prefix}_p99": round(float(p99), 2),
+        f"{prefix}_max": round(float(np.max(values)), 2),
+    }
+
+def summarize(records: list, lag_samples: list, seconds: float) -> dict:
+    """Throughput, error rate, latency and event loop lag, overall and per endpoint
+    
+    A request's loop lag is the worst lag sampled while it was in flight.
+    """
+    lag_times = np.array([sample[0] for sample in lag_samples])
+    lags = np.array([sample[1] for sample in lag_samples])
+    
+    def describe(selected: list) -> dict:
+        latencies = np.array([(end - start) * 1000 for _, start, end, _, _ in selected])
+        errors = sum(1 for record in selected if record[3] == 0 or record[3] >= 400)
+        answered = [record[4] for record in selected if record[4] is not None]
+        request_lags = []
+        for _, start, end, _, _ in selected:
+            window = lags[np.searchsorted(lag_times, start):np.searchsorted(lag_times, end, side="right")]
+            request_lags.append(float(window.max()) if len(window) else 0.0)
+        result = {
+            "requests": len(selected),
+            "throughput_rps": round(len(selected) / seconds, 2),
+            "errors": errors,
+            "error_rate": round(errors / len(selected), 4) if selected else 0.0,
+            "success_rate": round(sum(answered) / len(answered), 4) if answered else None,
+        }
+        result.update(percentiles(latencies, "latency_ms"))
+        result.update(percentiles(np.array(request_lags), "loop_lag_ms"))
+        return result
+    
+    summary = {"all": describe(records)}
+    summary["all"].update({f"loop_{key}": value for key, value in percentiles(lags, "lag_ms").items()})
+    summary["endpoints"] = {
+        endpoint: describe([record for record in records if record[0] == endpoint])
+        for endpoint in REQUESTS if any(record[0] == endpoint for record in records)
+    }
+    return summary
+
+async def run_stage(client: httpx.AsyncClient, workload: Workload, mix: dict, concurrency: int, seconds: float, seed: int) -> dict:
+    records, lag_samples = [], []
+    sampler = asyncio.create_task(sample_loop_lag(lag_samples))
+    deadline = time.perf_counter() + seconds
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(
+            virtual_user(client, workload, mix, np.random.default_rng([seed, concurrency, user]), deadline, records)
+            for user in range(concurrency)
+        ))
+    finally:
+        sampler.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await sampler
+    elapsed = time.perf_counter() - started
+    return dict(concurrency=concurrency, seconds=round(elapsed, 2), **summarize(records, lag_samples, elapsed))
+
+async def login(client: httpx.AsyncClient):
+    """Bearer token of the seeded admin; without it only a DEV_MODE server accepts the requests"""
+    response = await client.post("/auth/login", json={"email": ADMIN_EMAIL, "password": ADMIN_PASSWORD})
+    if response.status_code == 200:
+        client.headers["Authorization"] = f"Bearer {response.json()['access_token']}"
+    else:
+        print(f"⚠️ Login as {ADMIN_EMAIL} failed ({response.status_code}), sending requests without a token")
+
+async def run_load(client: httpx.AsyncClient, workload: Workload, args, progress) -> list:
+    mix = parse_mix(args.mix)
+    await login(client)
+    if args.warmup_seconds > 0:
+        print(f"Warming up for {args.warmup_seconds}s...", file=progress)
+        await run_stage(client, workload, mix, args.levels[0], args.warmup_seconds, args.seed - 1)
+    stages = []
+    for concurrency in args.levels:
+        print(f"Running {concurrency} concurrent user(s) for {args.stage_seconds}s...", file=progress)
+        stages.append(await run_stage(client, workload, mix, concurrency, args.stage_seconds, args.seed))
+    return stages
+
+async def run_in_process(workload: Workload, args, progress, workdir: str) -> list:
+    """Drive the ASGI app in this process, with its lifespan (stub model load, gallery load) around the run"""
+    from app.main import app
+    from app.utils import photo_utils
+    
+    # Enrollment photos of register requests go to the scratch directory, not uploads/
+    photo_utils.UPLOADS_DIR = workdir
+    photo_utils.STUDENT_PHOTO_DIR = os.path.join(workdir, "students")
+    async with app.router.lifespan_context(app):
+        # Unhandled app exceptions become 500s and count as errors, as behind a server
+        transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=args.timeout) as client:
+            return await run_load(client, workload, args, progress)
+
+async def run_remote(workload: Workload, args, progress) -> list:
+    limits = httpx.Limits(max_connections=max(args.levels), max_keepalive_connections=max(args.levels))
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        return await run_load(client, workload, args, progress)
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list:
+    """Per concurrency level and endpoint: p95 latency and throughput ratios, error rate change"""
+    baseline_stages = {stage["concurrency"]: stage for stage in baseline["stages"]}
+    rows = []
+    for stage in report["stages"]:
+        before = baseline_stages.get(stage["concurrency"])
+        if before is None:
+            continue
+        current = dict(stage["endpoints"], all=stage["all"])
+        previous = dict(before["endpoints"], all=before["all"])
+        for endpoint, result in current.items():
+            old = previous.get(endpoint)
+            if old is None or not old["latency_ms_p95"] or not old["throughput_rps"] or result["latency_ms_p95"] is None:
+                continue
+            latency_ratio = result["latency_ms_p95"] / old["latency_ms_p95"]
+            throughput_ratio = result["throughput_rps"] / old["throughput_rps"]
+            error_increase = result["error_rate"] - old["error_rate"]
+            regressed = latency_ratio > 1 + tolerance or throughput_ratio < 1 / (1 + tolerance) or error_increase > 0.01
+            rows.append({
+                "concurrency": stage["concurrency"],
+                "endpoint": endpoint,
+                "latency_p95_ratio": round(latency_ratio, 3),
+                "throughput_ratio": round(throughput_ratio, 3),
+                "error_rate_change": round(error_increase, 4),
+                "status": "regression" if regressed else "ok",
+            })
+    return rows
+
+def print_stage(stage: dict):
+    overall = stage["all"]
+    print(f"\nConcurrency {stage['concurrency']}: {overall['throughput_rps']} req/s, {overall['error_rate']:.2%} errors, "
+          f"loop lag p95 {overall['loop_lag_ms_p95']} ms (max {overall['loop_lag_ms_max']} ms)")
+    print(f"  {'endpoint':<18} {'req':>6} {'req/s':>8} {'err':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'lag p95':>8}")
+    for endpoint, result in dict(stage["endpoints"], all=overall).items():
+        print(f"  {endpoint:<18} {result['requests']:>6} {result['throughput_rps']:>8.1f} {result['error_rate']:>7.2%} "
+              f"{result['latency_ms_p50']:>8} {result['latency_ms_p95']:>8} {result['latency_ms_p99']:>8} {result['loop_lag_ms_p95']:>8}")
+
+def main(args) -> int:
+    args.levels = [int(value) for value in args.concurrency.split(",") if value.strip()]
+    parse_mix(args.mix)
+    progress = sys.stdout
+    
+    with tempfile.TemporaryDirectory() as workdir:
+        if args.seed_only:
+            if os.path.exists(args.db):
+                raise SystemExit(f"❌ {args.db} already exists; remove it or pick another --db")
+            configure_app_environment(f"sqlite:///{os.path.abspath(args.db)}", workdir, args)
+            seed_database(args.classes, args.students_per_class, args.history_days, args.seed)
+            print(f"✅ Start the server with DATABASE_URL=sqlite:///{os.path.abspath(args.db)} INSIGHTFACE_STUB_MODEL=true")
+            return 0
+        
+        if args.url is None:
+            configure_app_environment(f"sqlite:///{os.path.join(workdir, 'loadtest.db')}", workdir, args)
+            seed_database(args.classes, args.students_per_class, args.history_days, args.seed)
+        workload = Workload(
+            build_uploads(student_classes(args.classes, args.students_per_class), args.photos, args.seed), args.classes
+        )
+        # The app logs every face request; keep that out of the report
+        with open(args.server_log, "w") as log, contextlib.redirect_stdout(log):
+            if args.url is None:
+                stages = asyncio.run(run_in_process(workload, args, progress, workdir))
+            else:
+                stages = asyncio.run(run_remote(workload, args, progress))
+    
+    from app.core.executor import available_cpus
+    report = {
+        "commit": git_commit(),
+        "target": args.url or "in-process",
+        "loop_lag_measured_on": "client" if args.url else "server",
+        "config": {
+            "mix": parse_mix(args.mix),
+            "concurrency": args.levels,
+            "stage_seconds": args.stage_seconds,
+            "classes": args.classes,
+            "students_per_class": args.students_per_class,
+            "history_days": args.history_days,
+            "photos": args.photos,
+            "seed": args.seed,
+            "stub_detection_ms": args.stub_detection_ms,
+            "stub_recognition_ms": args.stub_recognition_ms,
+        },
+        "environment": {"python": platform.python_version(), "machine": platform.machine(), "cpus": available_cpus()},
+        "stages": stages,
+    }
+    for stage in stages:
+        print_stage(stage)
+    
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get("config") != report["config"] or baseline.get("environment") != report["environment"]:
+            print(f"⚠️ Baseline {args.compare} was run with other options or on another machine")
+        rows = compare(report, baseline, args.tolerance)
+        report["comparison"] = {"baseline": args.compare, "baseline_commit": baseline.get("commit"), "tolerance": args.tolerance, "rows": rows}
+        regressions = [row for row in rows if row["status"] == "regression"]
+        for row in regressions:
+            print(f"❌ {row['endpoint']} at concurrency {row['concurrency']}: p95 x{row['latency_p95_ratio']}, "
+                  f"throughput x{row['throughput_ratio']}, error rate {row['error_rate_change']:+.2%}")
+        if not regressions:
+            print(f"✅ No regression against {args.compare} (commit {baseline.get('commit')})")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"✅ Report written to {args.output}")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="Base URL of a running server; default: the app in this process")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Comma-separated endpoint=weight, endpoints: {', '.join(REQUESTS)}")
+    parser.add_argument("--concurrency", default="1,8,32", help="Comma-separated concurrent users per stage, ramped in order")
+    parser.add_argument("--stage-seconds", type=float, default=15.0, help="Duration of each concurrency stage")
+    parser.add_argument("--warmup-seconds", type=float, default=3.0, help="Untimed run at the first concurrency level")
+    parser.add_argument("--classes", type=int, default=30, help="Seeded classes")
+    parser.add_argument("--students-per-class", type=int, default=40, help="Seeded students per class, all enrolled")
+    parser.add_argument("--history-days", type=int, default=30, help="Days of past attendance seeded for reports")
+    parser.add_argument("--photos", type=int, default=1024, help="Distinct verify/register uploads cycled through")
+    parser.add_argument("--seed", type=int, default=1, help="Seed of the database, photos and request mix")
+    parser.add_argument("--stub-detection-ms", type=float, default=0.0, help="Simulated detector time per image (in-process only)")
+    parser.add_argument("--stub-recognition-ms", type=float, default=0.0, help="Simulated recognizer time per face (in-process only)")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Request timeout in seconds")
+    parser.add_argument("--server-log", default=os.devnull, help="Where the app's own output goes during the run")
+    parser.add_argument("--seed-only", action="store_true", help="Only seed --db for a separately started server")
+    parser.add_argument("--db", default="loadtest.db", help="SQLite file written by --seed-only")
+    parser.add_argument("--compare", help="Earlier JSON report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed p95 slowdown or throughput drop before flagging, 0.25 = 25%%")
+    parser.add_argument("--output", help="Write the JSON report here as well")
+    sys.exit(main(parser.parse_args()))
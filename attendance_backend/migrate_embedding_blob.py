@@ -0,0 +1,96 @@
+"""Move face embeddings from JSON text to the binary embedding_blob column"""
+import sqlite3
+import sys
+import os
+
+# Add the app directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.ai.embedding import embedding_from_json, embedding_to_bytes
+from app.core.config import settings
+
+# Get the database path
+db_path = os.path.join(os.path.dirname(__file__), 'attendance.db')
+
+# Rows converted per transaction; the app keeps reading unconverted JSON rows meanwhile
+BATCH_SIZE = 500
+
+def upgrade_schema(cursor):
+    """Add embedding_blob and make the legacy embedding column nullable"""
+    cursor.execute("PRAGMA table_info(face_embeddings)")
+    columns = [column[1] for column in cursor.fetchall()]
+    
+    if 'embedding_blob' in columns:
+        print("✅ embedding_blob column already exists. No schema change needed.")
+        return
+    
+    # SQLite cannot drop NOT NULL in place, so rebuild the table
+    print("Rebuilding face_embeddings table with embedding_blob column...")
+    cursor.execute("""
+        CREATE TABLE face_embeddings_new (
+            id INTEGER NOT NULL,
+            student_id INTEGER NOT NULL,
+            embedding TEXT,
+            embedding_blob BLOB,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (id),
+            UNIQUE (student_id),
+            FOREIGN KEY(student_id) REFERENCES students (id)
+        )
+    """)
+    cursor.execute("""
+        INSERT INTO face_embeddings_new (id, student_id, embedding, created_at, updated_at)
+        SELECT id, student_id, embedding, created_at, updated_at FROM face_embeddings
+    """)
+    cursor.execute("DROP TABLE face_embeddings")
+    cursor.execute("ALTER TABLE face_embeddings_new RENAME TO face_embeddings")
+    cursor.execute("CREATE INDEX ix_face_embeddings_id ON face_embeddings (id)")
+
+def convert_rows(conn):
+    """Convert JSON rows to binary in batches, committing each batch"""
+    cursor = conn.cursor()
+    converted = 0
+    while True:
+        cursor.execute(
+            "SELECT id, embedding FROM face_embeddings WHERE embedding_blob IS NULL AND embedding IS NOT NULL LIMIT ?",
+            (BATCH_SIZE,)
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        
+        cursor.executemany(
+            "UPDATE face_embeddings SET embedding_blob = ?, embedding = NULL WHERE id = ?",
+            # JSON rows predate pack tags and were all produced by the default pack, not whatever recognizer is configured now
+            [(embedding_to_bytes(embedding_from_json(embedding), model_name=settings.insightface_model_name), row_id)
+             for row_id, embedding in rows]
+        )
+        conn.commit()
+        converted += len(rows)
+        print(f"  Converted {converted} embedding(s)...")
+    return converted
+
+def migrate():
+    """Add the binary embedding column and convert existing JSON embeddings"""
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    
+    try:
+        upgrade_schema(cursor)
+        conn.commit()
+        
+        converted = convert_rows(conn)
+        print(f"✅ Migration completed successfully! {converted} embedding(s) converted.")
+        
+        # Reclaim the space freed by the JSON text
+        conn.execute("VACUUM")
+    
+    except Exception as e:
+        print(f"❌ Migration failed: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    migrate()
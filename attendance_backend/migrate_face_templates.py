@@ -0,0 +1,63 @@
+"""Allow several face templates per student"""
+import sqlite3
+import sys
+import os
+
+# Add the app directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Get the database path
+db_path = os.path.join(os.path.dirname(__file__), 'attendance.db')
+
+def migrate():
+    """Drop the one-embedding-per-student constraint and add the template source column"""
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute("PRAGMA table_info(face_embeddings)")
+        columns = [column[1] for column in cursor.fetchall()]
+        
+        if 'embedding_blob' not in columns:
+            print("❌ Run migrate_embedding_blob.py first.")
+            return
+        
+        if 'source' in columns:
+            print("✅ source column already exists. No migration needed.")
+            return
+        
+        # SQLite cannot drop a UNIQUE constraint in place, so rebuild the table
+        print("Rebuilding face_embeddings table for multiple templates per student...")
+        cursor.execute("""
+            CREATE TABLE face_embeddings_new (
+                id INTEGER NOT NULL,
+                student_id INTEGER NOT NULL,
+                embedding TEXT,
+                embedding_blob BLOB,
+                source VARCHAR NOT NULL DEFAULT 'enrollment',
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (id),
+                FOREIGN KEY(student_id) REFERENCES students (id)
+            )
+        """)
+        cursor.execute("""
+            INSERT INTO face_embeddings_new (id, student_id, embedding, embedding_blob, created_at, updated_at)
+            SELECT id, student_id, embedding, embedding_blob, created_at, updated_at FROM face_embeddings
+        """)
+        cursor.execute("DROP TABLE face_embeddings")
+        cursor.execute("ALTER TABLE face_embeddings_new RENAME TO face_embeddings")
+        cursor.execute("CREATE INDEX ix_face_embeddings_id ON face_embeddings (id)")
+        cursor.execute("CREATE INDEX ix_face_embeddings_student_id ON face_embeddings (student_id)")
+        
+        conn.commit()
+        print("✅ Migration completed successfully!")
+    
+    except Exception as e:
+        print(f"❌ Migration failed: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,127 @@
+"""Produce INT8-quantized copies of the InsightFace detection and recognition models
+
+Writes <pack>_int8 next to the original pack in the InsightFace model root,
+which the app loads when INSIGHTFACE_INT8=true. Requires the onnx package
+(pip install onnx).
+
+    python quantize_models.py                                   # dynamic, weights only
+    python quantize_models.py --calibration-dir data/calib      # static, activations calibrated
+"""
+import argparse
+import glob
+import os
+import sys
+
+# Add the app directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import cv2
+import numpy as np
+from insightface.model_zoo import model_zoo
+from insightface.utils import face_align
+from onnxruntime.quantization import (
+    CalibrationDataReader, QuantFormat, QuantType, quantize_dynamic, quantize_static
+)
+from app.ai.insightface_model import INSIGHTFACE_ROOT, INT8_PACK_SUFFIX, pack_dir
+from app.core.config import settings
+
+QUANTIZED_TASKS = ("detection", "recognition")
+
+# Calibration samples per model; a few hundred cover the activation ranges
+MAX_CALIBRATION_SAMPLES = 200
+
+class BlobReader(CalibrationDataReader):
+    """Feed preprocessed blobs to the ONNX Runtime calibrator one at a time"""
+    
+    def __init__(self, input_name: str, blobs):
+        self._inputs = iter([{input_name: blob} for blob in blobs])
+    
+    def get_next(self):
+        return next(self._inputs, None)
+
+def load_calibration_images(calibration_dir: str):
+    """RGB images, decoded the way the app decodes uploads"""
+    from app.utils.image_utils import load_image
+    paths = sorted(glob.glob(os.path.join(calibration_dir, "**", "*.*"), recursive=True))
+    for path in paths[:MAX_CALIBRATION_SAMPLES]:
+        with open(path, 'rb') as f:
+            image, _ = load_image(f.read(), max_size=settings.image_decode_max_size)
+        if image is not None:
+            yield image
+
+def detection_blobs(detector, images, size: int = 640):
+    """Letterboxed detector inputs, as RetinaFace.detect builds them"""
+    for image in images:
+        scale = size / max(image.shape[:2])
+        resized = cv2.resize(image, (int(image.shape[1] * scale), int(image.shape[0] * scale)))
+        canvas = np.zeros((size, size, 3), dtype=np.uint8)
+        canvas[:resized.shape[0], :resized.shape[1]] = resized
+        yield cv2.dnn.blobFromImage(
+            canvas, 1.0 / detector.input_std, (size, size),
+            (detector.input_mean, detector.input_mean, detector.input_mean), swapRB=True
+        )
+
+def recognition_blobs(detector, recognizer, images):
+    """Aligned face crops, as ArcFaceONNX.get_feat builds them"""
+    for image in images:
+        bboxes, kpss = detector.detect(image, input_size=(640, 640), max_num=0, metric='default')
+        for kps in (kpss if kpss is not None else []):
+            crop = face_align.norm_crop(image, landmark=kps, image_size=recognizer.input_size[0])
+            yield cv2.dnn.blobFromImage(
+                crop, 1.0 / recognizer.input_std, recognizer.input_size,
+                (recognizer.input_mean, recognizer.input_mean, recognizer.input_mean), swapRB=True
+            )
+
+def quantize_pack(pack: str, calibration_dir: str = None):
+    """Quantize the detection and recognition models of a pack into <pack>_int8"""
+    source_dir = pack_dir(pack)
+    target_dir = os.path.join(os.path.expanduser(INSIGHTFACE_ROOT), "models", pack + INT8_PACK_SUFFIX)
+    os.makedirs(target_dir, exist_ok=True)
+    
+    models = {}
+    for onnx_file in sorted(glob.glob(os.path.join(source_dir, "*.onnx"))):
+        model = model_zoo.get_model(onnx_file)
+        if model is not None and model.taskname in QUANTIZED_TASKS and model.taskname not in models:
+            models[model.taskname] = (onnx_file, model)
+    if set(models) != set(QUANTIZED_TASKS):
+        print(f"❌ Pack {pack} lacks a detection or recognition model")
+        return
+    
+    detector = models["detection"][1]
+    detector.prepare(ctx_id=-1, input_size=(640, 640))
+    images = list(load_calibration_images(calibration_dir)) if calibration_dir else []
+    if calibration_dir and not images:
+        print(f"❌ No readable images in {calibration_dir}")
+        return
+    
+    for taskname, (onnx_file, model) in models.items():
+        target = os.path.join(target_dir, os.path.basename(onnx_file))
+        print(f"Quantizing {taskname} model {os.path.basename(onnx_file)}...")
+        if not images:
+            # Weights only; activations are quantized on the fly per batch
+            quantize_dynamic(onnx_file, target, weight_type=QuantType.QInt8)
+        else:
+            if taskname == "detection":
+                blobs = detection_blobs(detector, images)
+            else:
+                blobs = list(recognition_blobs(detector, model, images))[:MAX_CALIBRATION_SAMPLES]
+            quantize_static(
+                onnx_file, target, BlobReader(model.input_name, blobs),
+                quant_format=QuantFormat.QDQ,
+                activation_type=QuantType.QUInt8,
+                weight_type=QuantType.QInt8,
+                per_channel=True
+            )
+        size_mb = os.path.getsize(onnx_file) / (1024 * 1024)
+        quantized_mb = os.path.getsize(target) / (1024 * 1024)
+        print(f"  {size_mb:.1f} MB -> {quantized_mb:.1f} MB")
+    
+    print(f"✅ Quantized models written to {target_dir}")
+    print("Set INSIGHTFACE_INT8=true to use them, and check accuracy with benchmark_quantization.py")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pack", default=settings.insightface_model_name, help="InsightFace model pack")
+    parser.add_argument("--calibration-dir", help="Images for static quantization (dynamic if omitted)")
+    args = parser.parse_args()
+    quantize_pack(args.pack, args.calibration_dir)
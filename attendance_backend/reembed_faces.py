@@ -0,0 +1,57 @@
+"""Re-compute every student's face template with the recognizer of another model pack
+
+Runs the same resumable job as POST /face/reembed; Ctrl+C stops it after the
+current batch and running the command again resumes. Restart the server once
+it completes so it serves the new recognizer.
+
+    python reembed_faces.py --target-pack antelopev2
+    python reembed_faces.py --status
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+# Add the app directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.ai.insightface_model import face_model
+from app.services.reembedding_service import reembedding_job
+
+def main(target_pack: str, force: bool = False, progress_interval: float = 10.0):
+    print("Loading InsightFace model...")
+    face_model.load_model()
+    success, message = reembedding_job.start(target_pack, force)
+    print(message)
+    if not success:
+        return
+    try:
+        while reembedding_job.running:
+            time.sleep(progress_interval)
+            state = reembedding_job.status()
+            eta = f", ETA {state['eta_s']:.0f}s" if state["eta_s"] is not None else ""
+            print(f"  {state['done']}/{state['total']} done, {state['failed']} failed, {state['throughput_per_s']}/s{eta}")
+    except KeyboardInterrupt:
+        print("Stopping after the current batch...")
+        reembedding_job.stop(wait=True)
+    finally:
+        face_model.get_batcher().stop()
+    
+    state = reembedding_job.status()
+    for student_id, failure in state.get("failures", {}).items():
+        print(f"  student {student_id}: {failure}")
+    print(f"{'✅' if state['status'] == 'completed' else '❌'} Re-embedding {state['status']}: {state.get('done', 0)}/{state.get('total', 0)} student(s), {state.get('failed', 0)} failed")
+    if state["status"] == "incomplete":
+        print(f"  {state.get('message')} (--force)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--target-pack", help="Model pack whose recognition model replaces the current one")
+    parser.add_argument("--force", action="store_true", help="Switch even if some students could not be re-embedded")
+    parser.add_argument("--status", action="store_true", help="Print the job state and exit")
+    args = parser.parse_args()
+    if args.status or not args.target_pack:
+        print(json.dumps(reembedding_job.status(), indent=2))
+    else:
+        main(args.target_pack, args.force)
@@ -1422,7 +1422,7 @@ class _MarkAttendanceScreen1State extends State<MarkAttendanceScreen1>
                     image: student['photo_path'] != null
                         ? DecorationImage(
                             image: NetworkImage(
-                                '${ApiService.baseUrl}/uploads/${student['photo_path']}'),
+                                '${ApiService.baseUrl}/uploads/${student['thumbnail_path'] ?? student['photo_path']}'),
                             fit: BoxFit.cover,
                           )
                         : null,
@@ -170,7 +170,7 @@ class _ReportsScreenState extends ConsumerState<ReportsScreen> {
                         ? DateFormat('hh:mm a').format(DateTime.parse(log['timestamp'])) 
                         : '--:--';
                     
-                    return _buildReportItem(context, name, "ID: #$idStr • $time", "Present", Colors.green);
+                    return _buildReportItem(context, name, "ID: #$idStr • $time", "Present", Colors.green, thumbnailPath: log['student_thumbnail_path']);
                  },
                ),
           ],
@@ -209,7 +209,7 @@ class _ReportsScreenState extends ConsumerState<ReportsScreen> {
     );
   }
 
-  Widget _buildReportItem(BuildContext context, String name, String subtitle, String status, Color statusColor) {
+  Widget _buildReportItem(BuildContext context, String name, String subtitle, String status, Color statusColor, {String? thumbnailPath}) {
     final theme = Theme.of(context);
     final isDark = theme.brightness == Brightness.dark;
     
@@ -223,14 +223,21 @@ class _ReportsScreenState extends ConsumerState<ReportsScreen> {
       ),
       child: Row(
         children: [
-          Container(
-            padding: const EdgeInsets.all(10),
-            decoration: BoxDecoration(
-              color: statusColor.withOpacity(0.1),
-              shape: BoxShape.circle,
+          if (thumbnailPath != null)
+            CircleAvatar(
+              radius: 22,
+              backgroundColor: statusColor.withOpacity(0.1),
+              backgroundImage: NetworkImage('${ApiService.baseUrl}/uploads/$thumbnailPath'),
+            )
+          else
+            Container(
+              padding: const EdgeInsets.all(10),
+              decoration: BoxDecoration(
+                color: statusColor.withOpacity(0.1),
+                shape: BoxShape.circle,
+              ),
+              child: Icon(Icons.person, color: statusColor),
             ),
-            child: Icon(Icons.person, color: statusColor),
-          ),
           const SizedBox(width: 12),
           Expanded(
             child: Column(
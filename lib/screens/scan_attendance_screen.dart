@@ -610,7 +610,7 @@ class _ScanAttendanceScreenState extends State<ScanAttendanceScreen>
     
     final studentName = student['student_name'] ?? 'Unknown';
     final studentId = student['student_student_id'] ?? student['student_id']?.toString() ?? 'N/A';
-    final photoPath = student['photo_path'];
+    final photoPath = student['thumbnail_path'] ?? student['photo_path'];
     final isMarked = student['attendance_marked'] == true;
     
     // Format Time
@@ -171,7 +171,7 @@ class _StudentListScreenState extends ConsumerState<StudentListScreen> {
                         "ID: ${student['student_id']} • ${student['class_name'] ?? 'No Class'}",
                         hasFace ? "Registered" : "Pending",
                         hasFace ? Colors.green : Colors.orange,
-                        student['photo_path'],
+                        student['thumbnail_path'] ?? student['photo_path'],
                         student,
                       );
                     },